@@ -0,0 +1,161 @@
+import asyncio
+import time
+import weakref
+from typing import NamedTuple
+
+from .usbredirectorapi import USBRedirectorAPI
+
+# Семафоры по серверам: общие для всех клиентов одного сервера в одном цикле событий.
+# Цикл событий - слабый ключ, семафор - слабое значение: семафор живет, пока им пользуется
+# клиент, и закрытые после asyncio.run() циклы не остаются в памяти
+_semaphores = weakref.WeakKeyDictionary()
+
+
+class _ServerSemaphore(asyncio.Semaphore):
+    def __init__(self, limit):
+        super().__init__(limit)
+        self.limit = limit
+
+
+class DeviceResult(NamedTuple):
+    ok: bool
+    duration: float
+    steps: dict
+    error: str = None
+
+
+class AsyncUSBRedirectorAPI:
+    """
+    asyncio-версия USBRedirectorAPI для подключения многих устройств сразу.
+
+    Команды usbclnt и REST запросы к разным устройствам выполняются одновременно,
+    но к одному серверу - не больше max_concurrency за раз (лимит общий для всех клиентов
+    сервера в цикле событий, клиент с другим лимитом получает ValueError). REST запросы идут через
+    requests.Session синхронного клиента в пуле потоков, список устройств
+    кэшируется так же, как в USBRedirectorAPI.
+    """
+
+    def __init__(self, server_ip, client_path=None, server_api_port=80,
+                 server_port=45696, max_concurrency=4, devices_ttl=2.0):
+        self.api = USBRedirectorAPI(server_ip, client_path, server_api_port,
+                                    server_port, devices_ttl)
+        self.max_concurrency = max_concurrency
+        # (слабая ссылка на цикл событий, семафор сервера в нем)
+        self._loop_semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.api.close()
+
+    @property
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._loop_semaphore is not None and self._loop_semaphore[0]() is loop:
+            return self._loop_semaphore[1]
+        servers = _semaphores.setdefault(loop, weakref.WeakValueDictionary())
+        semaphore = servers.get(self.api.server_ip)
+        if semaphore is None:
+            semaphore = servers[self.api.server_ip] = _ServerSemaphore(self.max_concurrency)
+        elif semaphore.limit != self.max_concurrency:
+            raise ValueError('max_concurrency {} conflicts with {} of another client of server {}'
+                             .format(self.max_concurrency, semaphore.limit, self.api.server_ip))
+        self._loop_semaphore = (weakref.ref(loop), semaphore)
+        return semaphore
+
+    async def _call(self, func, *args):
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _run_client(self, action, port=None, serial=None):
+        if port is None and serial is None:
+            command = self.api._server_command(action)
+        else:
+            command = self.api._client_command(action, port, serial)
+        async with self._semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            await process.communicate()
+        return process.returncode
+
+    async def _step(self, steps, name, coroutine, error):
+        start = time.monotonic()
+        result = await coroutine
+        steps[name] = time.monotonic() - start
+        if result not in (None, 0):
+            raise ValueError(error)
+
+    async def list_usb(self, refresh=False):
+        return await self._call(self.api.list_usb, refresh)
+
+    async def _check_devices(self, devices):
+        await self.list_usb()
+        for port, serial in devices:
+            if self.api._check_usb(port=port, serial=serial) is False:
+                raise ValueError()
+
+    async def connect_server(self):
+        if await self._run_client(["-addserver"]) != 0:
+            raise ValueError('Connect server failed')
+
+    async def disconnect_server(self):
+        if await self._run_client(["-remserver"]) != 0:
+            raise ValueError('Disconnect server failed')
+
+    async def _connect_device(self, port, serial, force, steps):
+        if force:
+            await self._step(steps, 'share',
+                             self._call(self.api._post_device, 'share', port, serial), None)
+        await self._step(steps, 'connect', self._run_client(["-connect"], port, serial),
+                         'Connect usb failed')
+        await self._step(steps, 'autoconnect',
+                         self._run_client(["-autoconnect", "on"], port, serial),
+                         'Autoconnect_on failed')
+
+    async def _disconnect_device(self, port, serial, force, steps):
+        await self._step(steps, 'disconnect', self._run_client(["-disconnect"], port, serial),
+                         'Disconnect usb failed')
+        if force:
+            await self._step(steps, 'unshare',
+                             self._call(self.api._post_device, 'unshare', port, serial), None)
+
+    async def _for_each(self, devices, action, force):
+        async def run(port, serial):
+            start = time.monotonic()
+            steps = {}
+            try:
+                await action(port, serial, force, steps)
+            except Exception as e:
+                return DeviceResult(False, time.monotonic() - start, steps,
+                                    str(e) or e.__class__.__name__)
+            return DeviceResult(True, time.monotonic() - start, steps)
+
+        results = await asyncio.gather(*(run(port, serial) for port, serial in devices))
+        return dict(zip(devices, results))
+
+    async def connect_many(self, devices, force=True):
+        """
+        Подключить устройства одновременно.
+
+        :param devices: список пар (port, serial), одно из значений может быть None
+        :return: {(port, serial): DeviceResult} с длительностью каждого шага
+        """
+        devices = list(devices)
+        await self._check_devices(devices)
+        if force:
+            await self.connect_server()
+        return await self._for_each(devices, self._connect_device, force)
+
+    async def disconnect_many(self, devices, force=False):
+        """
+        Отключить устройства одновременно.
+
+        :return: {(port, serial): DeviceResult} с длительностью каждого шага
+        """
+        devices = list(devices)
+        await self._check_devices(devices)
+        results = await self._for_each(devices, self._disconnect_device, force)
+        if force:
+            await self.disconnect_server()
+        return results
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+
+# Значения поля состояния устройства, при которых оно подключено к клиенту
+CONNECTED_STATES = ('connected', 'in use', 'in-use', 'used')
+STATE_KEYS = ('State', 'Status')
+
+
+class USBDeviceStateError(ValueError):
+    def __init__(self, device, state_keys=STATE_KEYS):
+        super().__init__('USB device {} has no state field ({}): /api/devices lists devices '
+                         'whether a client is attached or not, connection state is unknown'
+                         .format(device, ', '.join(state_keys)))
+
+
+def device_state(device, state_keys=STATE_KEYS):
+    for key in state_keys:
+        if key in device:
+            return str(device[key])
+    return None
+
+
+def is_connected(device, state_keys=STATE_KEYS, connected_states=CONNECTED_STATES):
+    """
+    Устройство подключено: есть в списке сервера и его поле состояния из connected_states.
+    Само присутствие в списке ничего не значит - сервер перечисляет и неподключенные
+    устройства, поэтому без поля состояния выбрасывается USBDeviceStateError.
+    """
+    if device is None:
+        return False
+    state = device_state(device, state_keys)
+    if state is None:
+        raise USBDeviceStateError(device, state_keys)
+    return state.lower() in connected_states
+
+
+class USBDeviceWatcher:
+    """
+    Отслеживание состояния устройств USB Redirector.
+
+    Фоновый поток опрашивает /api/devices каждые interval секунд и ведет таблицу
+    устройств по порту и серийному номеру. Подписчики получают вызовы
+    callback(event, device) с event из 'added', 'removed', 'changed',
+    а wait_connected / wait_released ждут нужного состояния без sleep.
+
+    Состояние берется из поля устройства state_keys (первое найденное), подключенным
+    считаются значения connected_states. Если сервер не отдает такого поля, ожидания
+    выбрасывают USBDeviceStateError.
+    """
+
+    def __init__(self, api, interval=0.5, state_keys=STATE_KEYS, connected_states=CONNECTED_STATES):
+        self.api = api
+        self.interval = interval
+        self.state_keys = state_keys
+        self.connected_states = tuple(state.lower() for state in connected_states)
+        self._by_port = {}
+        self._by_serial = {}
+        self._subscribers = []
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.poll()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='usb-device-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logging.warning('USB devices poll failed: {}'.format(e))
+
+    def poll(self):
+        """
+        Один опрос сервера: обновить таблицу и оповестить подписчиков об изменениях.
+        """
+        devices = self.api.list_usb(refresh=True)
+        by_port = {usb['Port']: usb for usb in devices if 'Port' in usb}
+        by_serial = {usb['Serial']: usb for usb in devices if 'Serial' in usb}
+
+        events = []
+        with self._condition:
+            for old, new in ((self._by_port, by_port), (self._by_serial, by_serial)):
+                for key in new.keys() - old.keys():
+                    events.append(('added', new[key]))
+                for key in old.keys() - new.keys():
+                    events.append(('removed', old[key]))
+                for key in new.keys() & old.keys():
+                    if new[key] != old[key]:
+                        events.append(('changed', new[key]))
+            self._by_port, self._by_serial = by_port, by_serial
+            self._condition.notify_all()
+
+        # Устройство с портом и серийным номером попадает в оба индекса - оповещаем один раз
+        seen = []
+        for event, device in events:
+            if (event, device) in seen:
+                continue
+            seen.append((event, device))
+            for callback in list(self._subscribers):
+                callback(event, device)
+
+    def device(self, port=None, serial=None):
+        with self._condition:
+            if port is not None:
+                return self._by_port.get(port)
+            if serial is not None:
+                return self._by_serial.get(serial)
+        raise ValueError()
+
+    def _wait(self, predicate, port, serial, timeout):
+        start = time.monotonic()
+        with self._condition:
+            if self._thread is None:
+                raise RuntimeError('USBDeviceWatcher is not started')
+            if not self._condition.wait_for(lambda: predicate(self.device(port, serial)), timeout):
+                raise TimeoutError('USB device port={} serial={} state wait timed out after {}s'
+                                   .format(port, serial, timeout))
+        return time.monotonic() - start
+
+    def is_connected(self, device):
+        return is_connected(device, self.state_keys, self.connected_states)
+
+    def wait_connected(self, port=None, serial=None, timeout=60):
+        """
+        Ждать, пока устройство не станет подключенным.
+
+        :return: время ожидания в секундах
+        :raises USBDeviceStateError: сервер не отдает состояние устройства
+        """
+        return self._wait(self.is_connected, port, serial, timeout)
+
+    def wait_released(self, port=None, serial=None, timeout=60):
+        """
+        Ждать, пока устройство не пропадет из списка или не перестанет быть подключенным.
+
+        :return: время ожидания в секундах
+        :raises USBDeviceStateError: сервер не отдает состояние устройства
+        """
+        return self._wait(lambda device: not self.is_connected(device), port, serial, timeout)
@@ -1,5 +1,6 @@
 import os
 import subprocess
+import time
 import requests
 from sys import platform
 
@@ -11,13 +12,30 @@ class USBRedirectorAPI:
     _paths_unix = ("/usr/local/bin/usbclnt", "./usbclnt")
 
     def __init__(self, server_ip, client_path=None, server_api_port=80,
-                 server_port=45696):
+                 server_port=45696, devices_ttl=2.0):
         self.client_path = client_path
         self.server_ip = server_ip
         self.server_api_port = server_api_port
         self.server_port = server_port
+        # Одно keep-alive соединение с REST API сервера на все запросы
+        self.session = requests.Session()
+        # Сколько секунд список устройств считается актуальным
+        self.devices_ttl = devices_ttl
+        self._devices = None
+        self._devices_time = 0
+        self._by_port = {}
+        self._by_serial = {}
         self._path_exists()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
     def _path_exists(self):
         if platform == "win32":
             paths = self._paths_win32
@@ -30,53 +48,90 @@ class USBRedirectorAPI:
                 if os.path.exists(i):
                     break
 
+    def _api_url(self, path):
+        return 'http://{}:{}/api/{}'.format(str(self.server_ip),
+                                            str(self.server_api_port), path)
+
     def _check_usb(self, port, serial):
-        list_usb = self.list_usb()
-        for usb in list_usb:
-            if 'Port' in usb:
-                if port == usb['Port']:
-                    return True
-            elif 'Serial' in usb:
-                if serial == usb['Serial']:
-                    return True
-        return False
+        self.list_usb()
+        return port in self._by_port or serial in self._by_serial
+
+    def _device_args(self, port, serial):
+        if port is not None:
+            return ["-usbport", "{}".format(port)]
+        elif serial is not None:
+            return ["-serial", "{}".format(serial)]
+        raise ValueError()
+
+    def _device_data(self, port, serial):
+        if port is not None:
+            return {'Port': str(port)}
+        elif serial is not None:
+            return {'Serial': str(serial)}
+        raise ValueError()
+
+    def _server_command(self, action):
+        return (["{}".format(self.client_path)] + action +
+                ["-server", "{}:{}".format(str(self.server_ip), str(self.server_port))])
+
+    def _client_command(self, action, port, serial):
+        return self._server_command(action) + self._device_args(port, serial)
+
+    def _run_clients(self, action, devices, error):
+        # Команды клиента для разных устройств запускаются одновременно
+        processes = [subprocess.Popen(self._client_command(action, port, serial),
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                     for port, serial in devices]
+        for process in processes:
+            process.communicate()
+        if any(process.returncode != 0 for process in processes):
+            raise ValueError(error)
+
+    def invalidate_devices(self):
+        self._devices = None
 
     def is_client_exists(self):
         return os.path.isfile(self.client_path)
 
     def connect_server(self):
-        command = ["{}".format(self.client_path), "-addserver", "-server", 
-                   "{}:{}".format(str(self.server_ip), str(self.server_port))]
-        subprocess.Popen(command, stdout=subprocess.PIPE,
+        subprocess.Popen(self._server_command(["-addserver"]), stdout=subprocess.PIPE,
                          stderr=subprocess.PIPE)
 
-    def list_usb(self):
-        response = requests.get(
-            'http://{}:{}/api/devices'.format(str(self.server_ip), 
-            str(self.server_api_port)), timeout=(5, 30))
+    def list_usb(self, refresh=False):
+        if (not refresh and self._devices is not None and
+                time.monotonic() - self._devices_time < self.devices_ttl):
+            return self._devices
+
+        response = self.session.get(self._api_url('devices'), timeout=(5, 30))
 
         if response.status_code != 200:
             raise ConnectionError()
 
-        return response.json()['Devices']
+        self._devices = response.json()['Devices']
+        self._devices_time = time.monotonic()
+        self._by_port = {}
+        self._by_serial = {}
+        for usb in self._devices:
+            if 'Port' in usb:
+                self._by_port[usb['Port']] = usb
+            elif 'Serial' in usb:
+                self._by_serial[usb['Serial']] = usb
+        return self._devices
+
+    def _post_device(self, action, port, serial):
+        response = self.session.post(self._api_url('device/{}'.format(action)),
+                                     data=self._device_data(port, serial),
+                                     timeout=(5, 30))
+        self.invalidate_devices()
+
+        if response.status_code != 200:
+            raise ConnectionError()
 
     def share_usb(self, port=None, serial=None):
         if self._check_usb(port=port, serial=serial) is False:
             raise ValueError()
 
-        if port is not None:
-            data = {'Port': str(port)}
-        elif serial is not None:
-            data = {'Serial': str(serial)}
-        else:
-            raise ValueError()
-
-        response = requests.post(
-            'http://{}:{}/api/device/share'.format(str(self.server_ip), 
-            str(self.server_api_port)), data=data, timeout=(5, 30))
-
-        if response.status_code != 200:
-            raise ConnectionError()
+        self._post_device('share', port, serial)
 
     def connect_usb(self, port=None, serial=None, force=True):
         if self._check_usb(port=port, serial=serial) is False:
@@ -86,81 +141,25 @@ class USBRedirectorAPI:
             self.connect_server()
             self.share_usb(port=port, serial=serial)
 
-        command = ["{}".format(self.client_path), "-connect", "-server",
-                   "{}:{}".format(str(self.server_ip), str(self.server_port))]
-
-        if port is not None:
-            command.extend(["-usbport", "{}".format(port)])
-        elif serial is not None:
-            command.extend(["-serial", "{}".format(serial)])
-        else:
-            raise ValueError()
-
-        connect = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        result = connect.wait()
-        if result != 0:
-            raise ValueError('Connect usb failed')
+        self._run_clients(["-connect"], [(port, serial)], 'Connect usb failed')
 
         self.autoconnect_on(port=port, serial=serial)
 
     def autoconnect_on(self, port=None, serial=None):
         if self._check_usb(port=port, serial=serial) is False:
             raise ValueError()
-        command = ["{}".format(self.client_path), "-autoconnect", "on", "-server",
-                   "{}:{}".format(str(self.server_ip), str(self.server_port))]
-
-        if port is not None:
-            command.extend(["-usbport", "{}".format(port)])
-        elif serial is not None:
-            command.extend(["-serial", "{}".format(serial)])
-        else:
-            raise ValueError()
-
-        connect = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        result = connect.wait()
-        if result != 0:
-            raise ValueError('Autoconnect_on failed')
+        self._run_clients(["-autoconnect", "on"], [(port, serial)], 'Autoconnect_on failed')
 
     def autoconnect_off(self, port=None, serial=None):
         if self._check_usb(port=port, serial=serial) is False:
             raise ValueError()
-        command = ["{}".format(self.client_path), "-autoconnect", "off", "-server",
-                   "{}:{}".format(str(self.server_ip), str(self.server_port))]
-
-        if port is not None:
-            command.extend(["-usbport", "{}".format(port)])
-        elif serial is not None:
-            command.extend(["-serial", "{}".format(serial)])
-        else:
-            raise ValueError()
-
-        connect = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        result = connect.wait()
-        if result != 0:
-            raise ValueError('Autoconnect_off failed')
+        self._run_clients(["-autoconnect", "off"], [(port, serial)], 'Autoconnect_off failed')
 
     def disconnect_usb(self, port=None, serial=None, force=False):
         if self._check_usb(port=port, serial=serial) is False:
             raise ValueError()
 
-        command = ["{}".format(self.client_path), "-disconnect", "-server",
-                   "{}:{}".format(str(self.server_ip), str(self.server_port))]
-
-        if port is not None:
-            command.extend(["-usbport", "{}".format(port)])
-        elif serial is not None:
-            command.extend(["-serial", "{}".format(serial)])
-        else:
-            raise ValueError()
-
-        connect = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        result = connect.wait()
-        if result != 0:
-            raise ValueError('Disconnect usb failed')
+        self._run_clients(["-disconnect"], [(port, serial)], 'Disconnect usb failed')
 
         if force:
             self.unshare_usb(port=port, serial=serial)
@@ -169,26 +168,52 @@ class USBRedirectorAPI:
     def unshare_usb(self, port=None, serial=None):
         if self._check_usb(port=port, serial=serial) is False:
             raise ValueError()
-        if port is not None:
-            data = {'Port': str(port)}
-        elif serial is not None:
-            data = {'Serial': str(serial)}
-        else:
-            raise ValueError()
 
-        response = requests.post(
-            'http://{}:{}/api/device/unshare'.format(str(self.server_ip), 
-            str(self.server_api_port)), data=data, timeout=(5, 30))
-
-        if response.status_code != 200:
-            raise ConnectionError()
+        self._post_device('unshare', port, serial)
 
     def disconnect_server(self):
-        command = ["{}".format(self.client_path), "-remserver", "-server",
-                   "{}:{}".format(str(self.server_ip), str(self.server_port))]
-        connect = subprocess.Popen(command, stdout=subprocess.PIPE,
+        connect = subprocess.Popen(self._server_command(["-remserver"]), stdout=subprocess.PIPE,
                                    stderr=subprocess.PIPE)
         result = connect.wait()
 
         if result != 0:
             raise ValueError('Disconnect server failed')
+
+    def _check_devices(self, devices):
+        devices = list(devices)
+        for port, serial in devices:
+            if self._check_usb(port=port, serial=serial) is False:
+                raise ValueError()
+        return devices
+
+    def connect_usb_many(self, devices, force=True):
+        """
+        Подключить несколько устройств за один проход: один листинг, один -addserver,
+        команды клиента для всех устройств запускаются одновременно.
+
+        :param devices: список пар (port, serial), одно из значений может быть None
+        """
+        devices = self._check_devices(devices)
+
+        if force:
+            self.connect_server()
+            for port, serial in devices:
+                self._post_device('share', port, serial)
+
+        self._run_clients(["-connect"], devices, 'Connect usb failed')
+        self._run_clients(["-autoconnect", "on"], devices, 'Autoconnect_on failed')
+
+    def disconnect_usb_many(self, devices, force=False):
+        """
+        Отключить несколько устройств за один проход.
+
+        :param devices: список пар (port, serial), одно из значений может быть None
+        """
+        devices = self._check_devices(devices)
+
+        self._run_clients(["-disconnect"], devices, 'Disconnect usb failed')
+
+        if force:
+            for port, serial in devices:
+                self._post_device('unshare', port, serial)
+            self.disconnect_server()
@@ -1,13 +1,17 @@
 import os
-import time
+import shlex
 import sys
+import time
 import logging
-import psutil
 
 from common import ICommand, ExceptionHandler
+from csp_worker import CspInvokeWorker, AsyncCspRunner
+from process_registry import TokenLock
+from contextlib import nullcontext
 from pathlib import Path
 from enum import Enum
-from subprocess import Popen, PIPE, STDOUT, TimeoutExpired
+from subprocess import TimeoutExpired, list2cmdline
+from typing import List, NamedTuple, Tuple
 
 
 class FuncVipNet:
@@ -20,7 +24,9 @@ class FuncVipNet:
             hash_alg: str,
             key_type: str,
             certificate_name: str,
-            file_path: str
+            file_path: str,
+            worker: CspInvokeWorker = None,
+            work_dir: str = None
     ):
         self.csp_invoke = path_to_csp_invoke
         self.container_name = container_name
@@ -31,353 +37,186 @@ class FuncVipNet:
         self.certificate_name = certificate_name
         self.file_path = file_path
         self.csp_invoke_base_name = os.path.basename(self.csp_invoke)
-
-    def _get_vip_net_process(self, key_name):
-        functions_vipnet = {
-            VipNetOperationsName.KEY_GENERATION: [self.csp_invoke, 'container', '--newkey', '--container',
-                                                  self.container_name, '--provtype', self.provtype, '--keytype',
-                                                  self.key_type, '--pin', self.user_pin],
-            VipNetOperationsName.ENUM_CONTAINERS: [self.csp_invoke, 'container', '--enum', '--unique'],
-            VipNetOperationsName.ENUM_CONTAINERS2: [self.csp_invoke, 'container', '--keyinfo', '--container',
-                                                    self.container_name, '--pin', self.user_pin],
-            VipNetOperationsName.SAVE_CONTAINER_PASSWORD: [self.csp_invoke, 'container', '--savepass', '--container',
-                                                           self.container_name, '--pin', self.user_pin],
-            VipNetOperationsName.CREATE_SELFSIGNED_CERT: [self.csp_invoke, 'mkcert', '--selfsigned', '--container',
-                                                          self.container_name, '--cn',
-                                                          f'CN={self.certificate_name}', '--out',
-                                                          f'{self.certificate_name}.cer', '--provtype',
-                                                          self.provtype, '--before', '01/01/2019', '--after',
-                                                          '12/31/2049', '--pin', self.user_pin],
-            VipNetOperationsName.SETUP_CERT_TO_CONTAINER: [self.csp_invoke, 'cert', '--cmd', 'copy', '--usecertin',
-                                                           'file', '--certfile', f'{self.certificate_name}.cer',
-                                                           '--rcontainer', self.container_name, '--userecipin',
-                                                           'container', '--rpin', self.user_pin, '--rsilent',
-                                                           '--rkeytype', 'signature'],
-            VipNetOperationsName.CHECK_CERT_IN_CONTAINER: [self.csp_invoke, 'cert', '--cmd', 'info', '--usecertin',
-                                                           'container', '--container', self.container_name],
-            VipNetOperationsName.SETUP_CERT_TO_STORAGE: [self.csp_invoke, 'cert', '--cmd', 'install', '--usecertin',
-                                                         'container', '--container', self.container_name, '--rstore',
-                                                         'My'],
-            VipNetOperationsName.SIGN_MESSAGE: [self.csp_invoke, 'cp', '--cmd', 'sign', '--hashalg', self.hash_alg,
-                                                '--in', self.file_path, '--out', 'sign.sig', '--container',
-                                                self.container_name, '--pin', self.user_pin],
-            VipNetOperationsName.SIGN_MESSAGE2: [self.csp_invoke, 'cp', '--cmd', 'exppub', '--container',
-                                                 self.container_name, '--out', 'key.pub'],
-            VipNetOperationsName.CHECK_MESSAGE: [self.csp_invoke, 'cp', '--cmd', 'verify', '--hashalg', self.hash_alg,
-                                                 '--in', self.file_path, '--public', 'key.pub', '--sigfile',
-                                                 'sign.sig'],
-            VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE: [self.csp_invoke, 'cms', '--cmd', 'lowsign', '--hashalg',
-                                                                self.hash_alg, '--in', self.file_path, '--out',
-                                                                'low.sig', '--include', '--dn', self.certificate_name,
-                                                                '--pin', self.user_pin],
-            VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE2: [self.csp_invoke, 'cms', '--cmd', 'lowverify',
-                                                                 '--hashalg', self.hash_alg, '--in', 'low.sig', '--out',
-                                                                 'low.sig.txt'],
-            VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE3: [self.csp_invoke, 'cms', '--cmd', 'lowsign',
-                                                                 '--hashalg', self.hash_alg, '--in', self.file_path,
-                                                                 '--out', 'low_detached.sig', '--include',
-                                                                 '--dn', self.certificate_name, '--detached', '--pin',
-                                                                 self.user_pin],
-            VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE4: [self.csp_invoke, 'cms', '--cmd', 'lowverify',
-                                                                 '--hashalg', self.hash_alg, '--in', self.file_path,
-                                                                 '--sigfile', 'low_detached.sig', '--out',
-                                                                 'low_detached.sig.txt'],
-            VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE: [self.csp_invoke, 'cms', '--cmd', 'sfsign', '--hashalg',
-                                                                self.hash_alg, '--in', self.file_path, '--out',
-                                                                'sf.sig', '--include', '--dn', self.certificate_name,
-                                                                '--pin', self.user_pin],
-            VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE2: [self.csp_invoke, 'cms', '--cmd', 'sfverify',
-                                                                 '--hashalg', self.hash_alg, '--in', 'low.sig', '--out',
-                                                                 'sf.sig.txt'],
-            VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE3: [self.csp_invoke, 'cms', '--cmd', 'sfsign', '--hashalg',
-                                                                 self.hash_alg, '--in', self.file_path, '--out',
-                                                                 'sf_detached.sig', '--include', '--dn',
-                                                                 self.certificate_name, '--detached', '--pin',
-                                                                 self.user_pin],
-            VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE4: [self.csp_invoke, 'cms', '--cmd', 'sfverify',
-                                                                 '--hashalg', self.hash_alg, '--in', self.file_path,
-                                                                 '--sigfile', 'sf_detached.sig', '--out',
-                                                                 'sf_detached.sig.txt'],
-            VipNetOperationsName.LOWLVL_CMS_ENCRYPT: [self.csp_invoke, 'cms', '--cmd', 'lowenc', '--in', self.file_path,
-                                                      '--out', 'low.enc', '--rstore', 'My', '--rdn',
-                                                      self.certificate_name],
-            VipNetOperationsName.LOWLVL_CMS_ENCRYPT2: [self.csp_invoke, 'cms', '--cmd', 'lowdec', '--in', 'low.enc',
-                                                       '--out', 'low.enc.txt', '--pin', self.user_pin, '--dn',
-                                                       self.certificate_name],
-            VipNetOperationsName.SIMPLE_CMS_ENCRYPT: [self.csp_invoke, 'cms', '--cmd', 'sfenc', '--in', self.file_path,
-                                                      '--out', 'sf.enc', '--rstore', 'My', '--rdn',
-                                                      self.certificate_name],
-            VipNetOperationsName.SIMPLE_CMS_ENCRYPT2: [self.csp_invoke, 'cms', '--cmd', 'sfdec', '--in', 'sf.enc',
-                                                       '--out', 'sf.enc.txt', '--pin', self.user_pin],
-            VipNetOperationsName.DELETE_PASSWORD: [self.csp_invoke, 'container', '--delpass', '--container',
-                                                   self.container_name, '--silent'],
-            VipNetOperationsName.DELETE_CERT: [self.csp_invoke, 'cert', '--cmd', 'del', '--dn', self.certificate_name],
-            VipNetOperationsName.DELETE_CONTAINER: [self.csp_invoke, 'container', '--delete', '--container',
-                                                    self.container_name, '--pin', self.user_pin]
+        self.worker = worker
+        # Директория для файлов сценария (sign.sig, key.pub, *.enc, ...), None - текущая
+        self.work_dir = work_dir
+        self.runner = AsyncCspRunner()
+        self._commands = self._compile_commands()
+
+    def _compile_commands(self):
+        return {
+            name: (self.csp_invoke, *(arg.format_map(vars(self)) for arg in template))
+            for name, template in COMMAND_TEMPLATES.items()
         }
 
-        return ",".join(map(str, functions_vipnet[key_name])).split(",")
-
-    def _wait_cspinvoke(func):
-        def wrapper(self, *args, **kwargs):
-            if sys.platform == "win32":
-                for _ in range(40):
-                    for proc in psutil.process_iter():
-                        if proc.name() == self.csp_invoke_base_name:
-                            time.sleep(1)
-                    break
-                else:
-                    self._kill_cspinvoke()
-                    logging.error('csp_invoke process name already exists')
-                    raise TimeoutError('csp_invoke is already running, probably hung')
-            return func(self, *args, **kwargs)
-
-        return wrapper
-
-    def _kill_cspinvoke(self):
-        for proc in psutil.process_iter():
-            if proc.name() == self.csp_invoke_base_name:
-                proc.kill()
-
-    @_wait_cspinvoke
-    def _run_operation(self, process):
-        if sys.platform == 'linux':
-            process.insert(0, 'sudo')
-        proc = Popen(process, stdout=PIPE, stderr=STDOUT)
-        try:
-            proc.wait(1080)
-        except TimeoutExpired as e:
-            self._kill_cspinvoke()
-            logging.error('TimeoutError: csp_invoke failed after 360 seconds')
-            return ExceptionHandler.handle(e, self)
-
-        data = proc.communicate()
-
-        return proc.returncode, data[0]
+    def _get_vip_net_process(self, key_name):
+        return list(self._commands[key_name])
+
+    def command(self, key_name) -> 'CspCommand':
+        return CspCommand(key_name, self._commands[key_name], OPERATION_TIMEOUTS.get(key_name, DEFAULT_TIMEOUT))
+
+    def commands(self, key_names) -> List['CspCommand']:
+        """
+        Команды для пакетного запуска: CspInvokeWorker.run_many / AsyncCspRunner.run_all
+        принимают [command.args for command in commands].
+        """
+        return [self.command(key_name) for key_name in key_names]
+
+    def batch_script(self, key_names, windows=sys.platform == 'win32') -> str:
+        """
+        Скрипт (sh или cmd), выполняющий команды по порядку до первой ошибки.
+        """
+        if windows:
+            lines = ['@echo off']
+            if self.work_dir:
+                lines.append(f'cd /d {list2cmdline([self.work_dir])}')
+            for command in self.commands(key_names):
+                lines += [list2cmdline(command.args), 'if errorlevel 1 exit /b %errorlevel%']
+            return '\r\n'.join(lines) + '\r\n'
+        lines = ['#!/bin/sh', 'set -e']
+        if self.work_dir:
+            lines.append(f'cd {shlex.quote(self.work_dir)}')
+        lines += [shlex.join(command.args) for command in self.commands(key_names)]
+        return '\n'.join(lines) + '\n'
+
+    def _run_operation(self, process, timeout=1080, name=None, exclusive=True):
+        # exclusive=False - для команд, которые не обращаются к токену (проверка по файлам)
+        with TokenLock(self.container_name) if exclusive else nullcontext() as lock:
+            start = time.monotonic()
+            try:
+                if self.worker is not None:
+                    return self.worker.run(process, timeout, self.work_dir)
+                return self.runner.run_sync(process, timeout, self.work_dir)
+            except TimeoutExpired as e:
+                logging.error(f'TimeoutError: csp_invoke failed after {timeout} seconds')
+                return ExceptionHandler.handle(e, self)
+            finally:
+                waited = f'token lock wait {lock.waited:.3f}s' if exclusive else 'no token lock'
+                logging.info(f'{name or process[1]}: {waited}, csp_invoke {time.monotonic() - start:.3f}s')
+
+    def _run(self, key_name, exclusive=True):
+        command = self.command(key_name)
+        return self._run_operation(list(command.args), command.timeout, key_name.value, exclusive)
 
     def create_file(self):
-        with Path(self.file_path).open('w') as fp:
+        with Path(self.work_dir or '.', self.file_path).open('w') as fp:
             fp.write('IT IS A TEST FILE')
 
     def key_generation(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.KEY_GENERATION,
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.KEY_GENERATION)
         assert return_code == 0, f"Ошибка при генерации ключа: {return_code}, {data}"
 
     def enum_containers_first(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.ENUM_CONTAINERS,
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.ENUM_CONTAINERS)
         assert return_code == 0, f"Ошибка при перечислении контейнеров на носителе: {return_code}, {data}"
 
     def enum_containers_second(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.ENUM_CONTAINERS2,
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.ENUM_CONTAINERS2)
         assert return_code == 0, f"Ошибка при перечислении контейнеров на носителе: {return_code}, {data}"
 
     def save_container_password(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SAVE_CONTAINER_PASSWORD
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SAVE_CONTAINER_PASSWORD)
         assert return_code == 0, f"Ошибка при сохранении пароля от контейнера: {return_code}, {data}"
 
     def create_self_signed_cert(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.CREATE_SELFSIGNED_CERT
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.CREATE_SELFSIGNED_CERT)
         assert return_code == 0, f"Ошибка при создании самоподписанного сертификата: {return_code}, {data}"
 
     def setup_cert_to_container(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SETUP_CERT_TO_CONTAINER
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SETUP_CERT_TO_CONTAINER)
         assert return_code == 0, f"Ошибка при установке сертификата в контейнер: {return_code}, {data}"
 
     def check_cert_in_container(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.CHECK_CERT_IN_CONTAINER
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.CHECK_CERT_IN_CONTAINER)
         assert return_code == 0, f"Ошибка при проверке присутствия сертификата в контейнере: {return_code}, {data}"
 
     def setup_cert_to_storage(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SETUP_CERT_TO_STORAGE
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SETUP_CERT_TO_STORAGE)
         assert return_code == 0, f"Ошибка при установке сертификата из контейнера в хранилище MY: {return_code}, {data}"
 
     def sign_message_first(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SIGN_MESSAGE
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SIGN_MESSAGE)
         assert return_code == 0, f"Ошибка при подписи сообщения / проверке подписи: {return_code}, {data}"
 
     def sign_message_second(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SIGN_MESSAGE2
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SIGN_MESSAGE2)
         assert return_code == 0, f"Ошибка при подписи сообщения / проверке подписи: {return_code}, {data}"
 
     def check_message(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.CHECK_MESSAGE
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.CHECK_MESSAGE)
         assert return_code == 0, f"Ошибка при подписи сообщения / проверке подписи" \
                                  f" c несохраненным паролем: {return_code}, {data}"
 
     def lowlvl_cms_sign_from_storage_first(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE)
         assert return_code == 0, f"Ошибка при низкоуровневой подписи cms сообщения с использованием" \
                                  f" сертификата из хранилища MY: {return_code}, {data}"
 
     def lowlvl_cms_sign_from_storage_second(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE2
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE2)
         assert return_code == 0, f"Ошибка при низкоуровневой подписи cms сообщения с использованием" \
                                  f" сертификата из хранилища MY: {return_code}, {data}"
 
     def lowlvl_cms_sign_from_storage_third(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE3
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE3)
         assert return_code == 0, f"Ошибка при низкоуровневой подписи cms сообщения с использованием" \
                                  f" сертификата из хранилища MY: {return_code}, {data}"
 
     def lowlvl_cms_sign_from_storage_fourth(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE4
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE4)
         assert return_code == 0, f"Ошибка при низкоуровневой подписи cms сообщения с использованием" \
                                  f" сертификата из хранилища MY: {return_code}, {data}"
 
     def simple_cms_sign_from_storage_first(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE)
         assert return_code == 0, f"Ошибка при упрощенной подписи cms сообщения с использованием " \
                                  f"сертификата из хранилища MY: {return_code}, {data}"
 
     def simple_cms_sign_from_storage_second(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE2
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE2)
         assert return_code == 0, f"Ошибка при упрощенной подписи cms сообщения с использованием " \
                                  f"сертификата из хранилища MY: {return_code}, {data}"
 
     def simple_cms_sign_from_storage_third(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE3
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE3)
         assert return_code == 0, f"Ошибка при упрощенной подписи cms сообщения с использованием " \
                                  f"сертификата из хранилища MY: {return_code}, {data}"
 
     def simple_cms_sign_from_storage_fourth(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE4
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE4)
         assert return_code == 0, f"Ошибка при упрощенной подписи cms сообщения с использованием " \
                                  f"сертификата из хранилища MY: {return_code}, {data}"
 
     def lowlvl_cms_encrypt_first(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.LOWLVL_CMS_ENCRYPT
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.LOWLVL_CMS_ENCRYPT)
         assert return_code == 0, f"Ошибка при низкоуровневом шифровании cms сообщения / Расшифровании " \
                                  f"с использованием сертификата из хранилища MY: {return_code}, {data}"
 
     def lowlvl_cms_encrypt_second(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.LOWLVL_CMS_ENCRYPT2
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.LOWLVL_CMS_ENCRYPT2)
         assert return_code == 0, f"Ошибка при низкоуровневом шифровании cms сообщения / Расшифровании " \
                                  f"с использованием сертификата из хранилища MY: {return_code}, {data}"
 
     def simple_cms_encrypt_first(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SIMPLE_CMS_ENCRYPT
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SIMPLE_CMS_ENCRYPT)
         assert return_code == 0, f"Ошибка при упрощенном шифрование cms сообщения / Расшифрование " \
                                  f"с использованием сертификата из хранилища MY: {return_code}, {data}"
 
     def simple_cms_encrypt_second(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.SIMPLE_CMS_ENCRYPT2
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.SIMPLE_CMS_ENCRYPT2)
         assert return_code == 0, f"Ошибка при упрощенном шифрование cms сообщения / Расшифрование " \
                                  f"с использованием сертификата из хранилища MY: {return_code}, {data}"
 
     def delete_cert(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.DELETE_CERT
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.DELETE_CERT)
         assert return_code == 0, f"Ошибка при удалении сертификата из хранилища MY: {return_code}, {data}"
 
     def delete_password(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.DELETE_PASSWORD
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.DELETE_PASSWORD)
         assert return_code == 0, f"Ошибка при удалении сохраненного пароля: {return_code}, {data}"
 
     def delete_container(self):
-        return_code, data = self._run_operation(
-            self._get_vip_net_process(
-                VipNetOperationsName.DELETE_CONTAINER
-            )
-        )
+        return_code, data = self._run(VipNetOperationsName.DELETE_CONTAINER)
         assert return_code == 0, f"Ошибка при удалении контейнера: {return_code}, {data}"
 
 
@@ -389,6 +228,12 @@ class KeyGeneration(ICommand):
         self.__executor.key_generation()
 
 
+class CspCommand(NamedTuple):
+    name: 'VipNetOperationsName'
+    args: Tuple[str, ...]
+    timeout: int
+
+
 class VipNetOperationsName(Enum):
     KEY_GENERATION = "key_generation"
     ENUM_CONTAINERS = "enum_containers"
@@ -416,3 +261,82 @@ class VipNetOperationsName(Enum):
     DELETE_PASSWORD = "delete_password"
     DELETE_CERT = "delete_cert"
     DELETE_CONTAINER = "delete_container"
+
+
+DEFAULT_TIMEOUT = 1080
+# Таймауты в секундах по типу операции, остальные операции - DEFAULT_TIMEOUT
+OPERATION_TIMEOUTS = {
+    VipNetOperationsName.KEY_GENERATION: 600,
+    VipNetOperationsName.ENUM_CONTAINERS: 120,
+    VipNetOperationsName.ENUM_CONTAINERS2: 120,
+    VipNetOperationsName.SAVE_CONTAINER_PASSWORD: 120,
+    VipNetOperationsName.CHECK_CERT_IN_CONTAINER: 120,
+    VipNetOperationsName.SIGN_MESSAGE2: 120,
+    VipNetOperationsName.CHECK_MESSAGE: 120,
+    VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE2: 120,
+    VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE4: 120,
+    VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE2: 120,
+    VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE4: 120,
+    VipNetOperationsName.LOWLVL_CMS_ENCRYPT: 120,
+    VipNetOperationsName.SIMPLE_CMS_ENCRYPT: 120,
+    VipNetOperationsName.DELETE_PASSWORD: 120,
+    VipNetOperationsName.DELETE_CERT: 120,
+    VipNetOperationsName.DELETE_CONTAINER: 240,
+}
+
+# Шаблоны команд csp_invoke (без пути к csp_invoke), поля в {} - атрибуты FuncVipNet
+COMMAND_TEMPLATES = {
+    VipNetOperationsName.KEY_GENERATION: ('container', '--newkey', '--container', '{container_name}', '--provtype',
+        '{provtype}', '--keytype', '{key_type}', '--pin', '{user_pin}'),
+    VipNetOperationsName.ENUM_CONTAINERS: ('container', '--enum', '--unique'),
+    VipNetOperationsName.ENUM_CONTAINERS2: ('container', '--keyinfo', '--container', '{container_name}', '--pin',
+        '{user_pin}'),
+    VipNetOperationsName.SAVE_CONTAINER_PASSWORD: ('container', '--savepass', '--container', '{container_name}',
+        '--pin', '{user_pin}'),
+    VipNetOperationsName.CREATE_SELFSIGNED_CERT: ('mkcert', '--selfsigned', '--container', '{container_name}',
+        '--cn', 'CN={certificate_name}', '--out', '{certificate_name}.cer', '--provtype', '{provtype}', '--before',
+        '01/01/2019', '--after', '12/31/2049', '--pin', '{user_pin}'),
+    VipNetOperationsName.SETUP_CERT_TO_CONTAINER: ('cert', '--cmd', 'copy', '--usecertin', 'file', '--certfile',
+        '{certificate_name}.cer', '--rcontainer', '{container_name}', '--userecipin', 'container', '--rpin',
+        '{user_pin}', '--rsilent', '--rkeytype', 'signature'),
+    VipNetOperationsName.CHECK_CERT_IN_CONTAINER: ('cert', '--cmd', 'info', '--usecertin', 'container',
+        '--container', '{container_name}'),
+    VipNetOperationsName.SETUP_CERT_TO_STORAGE: ('cert', '--cmd', 'install', '--usecertin', 'container',
+        '--container', '{container_name}', '--rstore', 'My'),
+    VipNetOperationsName.SIGN_MESSAGE: ('cp', '--cmd', 'sign', '--hashalg', '{hash_alg}', '--in', '{file_path}',
+        '--out', 'sign.sig', '--container', '{container_name}', '--pin', '{user_pin}'),
+    VipNetOperationsName.SIGN_MESSAGE2: ('cp', '--cmd', 'exppub', '--container', '{container_name}', '--out',
+        'key.pub'),
+    VipNetOperationsName.CHECK_MESSAGE: ('cp', '--cmd', 'verify', '--hashalg', '{hash_alg}', '--in', '{file_path}',
+        '--public', 'key.pub', '--sigfile', 'sign.sig'),
+    VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE: ('cms', '--cmd', 'lowsign', '--hashalg', '{hash_alg}',
+        '--in', '{file_path}', '--out', 'low.sig', '--include', '--dn', '{certificate_name}', '--pin', '{user_pin}'),
+    VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE2: ('cms', '--cmd', 'lowverify', '--hashalg', '{hash_alg}',
+        '--in', 'low.sig', '--out', 'low.sig.txt'),
+    VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE3: ('cms', '--cmd', 'lowsign', '--hashalg', '{hash_alg}',
+        '--in', '{file_path}', '--out', 'low_detached.sig', '--include', '--dn', '{certificate_name}', '--detached',
+        '--pin', '{user_pin}'),
+    VipNetOperationsName.LOWLVL_CMS_SIGN_FROM_STORAGE4: ('cms', '--cmd', 'lowverify', '--hashalg', '{hash_alg}',
+        '--in', '{file_path}', '--sigfile', 'low_detached.sig', '--out', 'low_detached.sig.txt'),
+    VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE: ('cms', '--cmd', 'sfsign', '--hashalg', '{hash_alg}', '--in',
+        '{file_path}', '--out', 'sf.sig', '--include', '--dn', '{certificate_name}', '--pin', '{user_pin}'),
+    VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE2: ('cms', '--cmd', 'sfverify', '--hashalg', '{hash_alg}',
+        '--in', 'low.sig', '--out', 'sf.sig.txt'),
+    VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE3: ('cms', '--cmd', 'sfsign', '--hashalg', '{hash_alg}',
+        '--in', '{file_path}', '--out', 'sf_detached.sig', '--include', '--dn', '{certificate_name}', '--detached',
+        '--pin', '{user_pin}'),
+    VipNetOperationsName.SIMPLE_CMS_SIGN_FROM_STORAGE4: ('cms', '--cmd', 'sfverify', '--hashalg', '{hash_alg}',
+        '--in', '{file_path}', '--sigfile', 'sf_detached.sig', '--out', 'sf_detached.sig.txt'),
+    VipNetOperationsName.LOWLVL_CMS_ENCRYPT: ('cms', '--cmd', 'lowenc', '--in', '{file_path}', '--out', 'low.enc',
+        '--rstore', 'My', '--rdn', '{certificate_name}'),
+    VipNetOperationsName.LOWLVL_CMS_ENCRYPT2: ('cms', '--cmd', 'lowdec', '--in', 'low.enc', '--out', 'low.enc.txt',
+        '--pin', '{user_pin}', '--dn', '{certificate_name}'),
+    VipNetOperationsName.SIMPLE_CMS_ENCRYPT: ('cms', '--cmd', 'sfenc', '--in', '{file_path}', '--out', 'sf.enc',
+        '--rstore', 'My', '--rdn', '{certificate_name}'),
+    VipNetOperationsName.SIMPLE_CMS_ENCRYPT2: ('cms', '--cmd', 'sfdec', '--in', 'sf.enc', '--out', 'sf.enc.txt',
+        '--pin', '{user_pin}'),
+    VipNetOperationsName.DELETE_PASSWORD: ('container', '--delpass', '--container', '{container_name}', '--silent'),
+    VipNetOperationsName.DELETE_CERT: ('cert', '--cmd', 'del', '--dn', '{certificate_name}'),
+    VipNetOperationsName.DELETE_CONTAINER: ('container', '--delete', '--container', '{container_name}', '--pin',
+        '{user_pin}'),
+}
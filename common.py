@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from collections import deque
 from errors import ERRORS
 
 
@@ -10,13 +11,13 @@ class ICommand(ABC):
 
 class Command:
     def __init__(self):
-        self.store = []
+        self.store = deque()
 
     def add_command(self, command):
         self.store.append(command)
 
     def run_command(self):
-        return self.store.pop(0).execute()
+        return self.store.popleft().execute()
 
     def clear(self):
         self.store.clear()
@@ -1,15 +1,17 @@
-import time
 import sys
 import pytest
 import os
-import glob
+import tempfile
 import yaml
 import platform
 import shutil
 import logging
 import re
 
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import Popen, PIPE
+from csp_worker import CspInvokeWorker, AsyncCspRunner
+from errors import CspWorkerException
+from process_registry import REGISTRY
 from USBRedirectorAPI.usbredirectorapi import USBRedirectorAPI
 from pypkcs11.src.applets import (
     AppletSelector,
@@ -58,6 +60,10 @@ providers = {
     "provtype_78_hash_alg_2012_512": ['78', '2012-512']
 }
 ids_provider_list = []
+workers_lock_stats = []
+SHM_DIR = '/dev/shm'
+# Снимки объектов токенов после форматирования, см. reset_applet
+token_baselines = {}
 
 
 def pytest_addoption(parser):
@@ -73,6 +79,12 @@ def pytest_addoption(parser):
         required=True,
         help='Path to csp_invoke'
     )
+    parser.addoption(
+        '--csp-helper',
+        type=str,
+        help='Путь до установленной копии csp_helper.py (владелец root) для запуска csp_invoke '
+             'одним процессом через sudo. Без опции каждая команда запускается через sudo отдельно'
+    )
     parser.addoption(
         "--tokens",
         help="Path to file tokens.yml"
@@ -101,16 +113,78 @@ def pytest_addoption(parser):
 
 @pytest.fixture(scope="session", autouse=True)
 def get_default_values(request):
-    pytest.path_to_jcpkcs11 = request.config.getoption("--path_to_JCPKCS11")
+    # Пути абсолютные: csp_invoke запускается в директории теста (work_dir)
+    pytest.path_to_jcpkcs11 = os.path.abspath(request.config.getoption("--path_to_JCPKCS11"))
     if not os.path.isfile(pytest.path_to_jcpkcs11):
         raise Exception("JCPKCS11 path not valid")
 
-    pytest.path_to_csp_invoke = request.config.getoption("--path")
+    pytest.path_to_csp_invoke = os.path.abspath(request.config.getoption("--path"))
     if not os.path.isfile(pytest.path_to_csp_invoke):
         raise Exception("csp_invoke path not valid")
     pytest.file_path = 'testfile.txt'
     pytest.certificate_name = 'testcertificate'
-    pytest.path_to_log = request.config.getoption("--path-to-log")
+    pytest.path_to_log = os.path.abspath(request.config.getoption("--path-to-log"))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def tracked_processes(request):
+    yield REGISTRY
+    # Завершаем только процессы, запущенные тестами, и логируем ожидание токенов
+    REGISTRY.kill_tracked()
+    # Без пути (get_default_values упал) замер пропускаем, чтобы не скрыть исходную ошибку
+    path_to_csp_invoke = getattr(pytest, "path_to_csp_invoke", None)
+    scan = REGISTRY.measure_scan(os.path.basename(path_to_csp_invoke)) if path_to_csp_invoke else None
+    stats = REGISTRY.wait_stats(scan=scan)
+    message = (f"csp_invoke: {stats['operations']} operations, "
+               f"token lock wait total {stats['total_wait']:.1f}s, max {stats['max_wait']:.1f}s")
+    if scan is not None:
+        message += f"; process scan {stats['scan']:.3f}s, saved {stats['saved']:.1f}s without scans"
+    logging.info(message)
+    # При запуске через xdist статистика уходит в основной процесс
+    if hasattr(request.config, "workeroutput"):
+        request.config.workeroutput["token_lock_stats"] = stats
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_cmdline_main(config):
+    # С -n тесты распределяются по токенам, если --dist не задан явно
+    if getattr(config.option, "numprocesses", None) and config.option.dist == "no":
+        config.option.dist = "loadscope"
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_make_scheduler(config, log):
+    if config.getoption("dist") != "loadscope":
+        return None
+    from token_scheduling import TokenScheduling
+    return TokenScheduling(config, log)
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_auto_num_workers(config):
+    # -n auto: по воркеру на каждый физический токен
+    _, tokens_list = load_tokens(config)
+    return max(1, len({token['name'] for token in tokens_list}))
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    stats = getattr(node, "workeroutput", {}).get("token_lock_stats")
+    if stats is not None:
+        workers_lock_stats.append(stats)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not workers_lock_stats:
+        return
+    terminalreporter.write_sep("-", "token locks")
+    terminalreporter.write_line(
+        f"{len(workers_lock_stats)} workers, "
+        f"{sum(stats['operations'] for stats in workers_lock_stats)} csp_invoke operations, "
+        f"lock wait total {sum(stats['total_wait'] for stats in workers_lock_stats):.1f}s, "
+        f"max {max(stats['max_wait'] for stats in workers_lock_stats):.1f}s, "
+        f"saved {sum(stats['saved'] or 0.0 for stats in workers_lock_stats):.1f}s without process scans"
+    )
 
 
 @pytest.fixture(scope="class", autouse=True)
@@ -118,34 +192,59 @@ def get_container_name(token):
     pytest.container_name = f'1|2\\5|{token["family_id"]}\\17|{token["applet_serial"]}\\8|testcontainer'
 
 
+@pytest.fixture(scope="class")
+def csp_worker(request):
+    """
+    Вспомогательный процесс csp_invoke или None - тогда каждая команда запускается через
+    sudo отдельно (AsyncCspRunner).
+    """
+    helper = request.config.getoption("--csp-helper")
+    if helper is not None:
+        helper = os.path.abspath(helper)
+    if sys.platform == 'linux' and helper is None:
+        yield None
+        return
+    worker = CspInvokeWorker(pytest.path_to_csp_invoke, helper=helper)
+    try:
+        worker.start()
+    except CspWorkerException as e:
+        logging.warning(f'{e}; csp_invoke will be started through sudo for each command')
+        yield None
+        return
+    with worker:
+        yield worker
+
+
+@pytest.fixture(scope="function")
+def work_dir(tmp_path_factory):
+    """
+    Отдельная директория для файлов сценария на каждый тест, в tmpfs (/dev/shm), если есть.
+    После теста удаляется целиком.
+    """
+    base = SHM_DIR if os.access(SHM_DIR, os.W_OK) else tmp_path_factory.getbasetemp()
+    worker_id = os.environ.get("PYTEST_XDIST_WORKER", "master")
+    path = tempfile.mkdtemp(prefix=f"vipnet_{worker_id}_", dir=base)
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
 @pytest.fixture(scope="function", autouse=True)
-def clear_token(request):
+def clear_token(request, csp_worker):
     try:
         os.remove(pytest.path_to_log)
     except FileNotFoundError:
         pass
     yield
-    files = [
-        glob.glob('*.enc'),
-        glob.glob('*.sig'),
-        glob.glob('*.pub'),
-        glob.glob('*.enc.txt'),
-        glob.glob('*.sig.txt'),
-        glob.glob(pytest.file_path),
-        glob.glob(f"{pytest.certificate_name}.cer")
-    ]
-    for file in files:
-        for f in file:
-            os.remove(f)
 
     delpass = [pytest.path_to_csp_invoke, 'container', '--delpass', '--container', pytest.container_name, '--silent']
     delete_cert = [pytest.path_to_csp_invoke, 'cert', '--cmd', 'del', '--dn', 'testcertificate']
 
-    for procces in delpass, delete_cert:
-        if sys.platform == 'linux':
-            procces.insert(0, 'sudo')
-        process = Popen(procces, stdout=PIPE, stderr=STDOUT)
-        process.wait(240)
+    if csp_worker is not None:
+        csp_worker.run_many([delpass, delete_cert], timeout=240)
+    else:
+        runner = AsyncCspRunner()
+        for process in (delpass, delete_cert):
+            runner.run_sync(process, timeout=240)
 
 
 @pytest.fixture(scope="function", autouse=True)
@@ -158,38 +257,36 @@ def check_configuration(token, provider):
 def connect_token(token, request):
     if request.config.getoption("--local"):
         yield token
-        pkcs11_format_applet(token)
+        reset_applet(token)
         return
     server = request.config.getoption("--server")
     usb_redirector_api = USBRedirectorAPI(server)
     usb_connect(usb_redirector_api, token)
 
-    # После коннект токена ждем...
-    os_name = platform.platform()
-    os_time = 40
-    time.sleep(os_time)
+    # После коннекта ждем, пока токен не станет доступен через pkcs11
+    wait_token(token)
 
     yield token
 
-    time.sleep(2)
     try:
-        pkcs11_format_applet(token)
+        reset_applet(token)
     except Exception as err:
         usb_disconnect(usb_redirector_api, token)
         raise Exception(err)
+    finally:
+        token_baselines.pop(token_key(token), None)
     usb_disconnect(usb_redirector_api, token)
-    time.sleep(15)
+    wait_token(token, present=False)
 
 
 @pytest.fixture(scope="function", autouse=True)
 def init_token(token):
-    time.sleep(10)
-    pkcs11_format_applet(token)
+    reset_applet(token)
 
 
-def pkcs11_format_applet(token):
+def get_applet(token):
     try:
-        applet = AppletSelector.get_applet(token['applet_model'])(
+        return AppletSelector.get_applet(token['applet_model'])(
             pytest.path_to_jcpkcs11,
             token['applet_serial'].replace(' ', ''),
             token['applet_model'],
@@ -197,6 +294,50 @@ def pkcs11_format_applet(token):
     except FindAppletException:
         raise Exception("Ошибка при поиске апплета")
 
+
+def wait_token(token, present=True):
+    applet = get_applet(token)
+    with applet:
+        try:
+            if present:
+                latency = applet.wait_ready(timeout=120)
+            else:
+                latency = applet.wait_removed(timeout=60)
+        except FindSlotException:
+            state = "подключения" if present else "отключения"
+            raise Exception(f"Не дождались {state} токена {token['applet_model']} {token['applet_serial']}")
+    event = "attach" if present else "detach"
+    logging.info(f"{token['applet_model']} {token['applet_serial']}: {event} latency {latency:.2f}s")
+    return latency
+
+
+def token_key(token):
+    return token['applet_model'], token['applet_serial']
+
+
+def reset_applet(token):
+    """
+    Возвращает токен в состояние после форматирования: удаляет объекты, созданные после
+    снимка, сделанного сразу после последнего форматирования. Полное форматирование - только
+    если снимка нет, состояние PIN неизвестно или удаление не удалось.
+    """
+    baseline = token_baselines.get(token_key(token))
+    if baseline is not None:
+        applet = get_applet(token)
+        with applet:
+            try:
+                applet.wait_ready(timeout=30)
+                destroyed = applet.restore(baseline, token['user_pin'])
+                logging.info(f"{token['applet_model']}: removed {destroyed} objects without format")
+                return
+            except (FindSlotException, ErrorAppletException) as err:
+                logging.warning(f"{token['applet_model']}: diff-clean failed ({err}), formatting")
+    pkcs11_format_applet(token)
+
+
+def pkcs11_format_applet(token):
+    token_baselines.pop(token_key(token), None)
+    applet = get_applet(token)
     with applet:
         try:
             applet.format(
@@ -204,6 +345,7 @@ def pkcs11_format_applet(token):
                 token['so_pin'],
                 "VipNet tests"
             )
+            token_baselines[token_key(token)] = applet.snapshot(token['user_pin'])
         except (FindSlotException, ErrorAppletException):
             raise Exception("Ошибка при работе со смарт-картой")
 
@@ -242,6 +384,12 @@ def parametrize_osname(os_name):
     pass
 
 
+def load_tokens(config):
+    with open(config.getoption("--tokens")) as f:
+        tokens_yml = yaml.full_load(f)
+    return get_tokens_list(tokens_yml["tokens"], config.getoption("--vipnet_version"))
+
+
 def get_tokens_list(tokens_group, vipnet_version):
     vipnet_version = '.'.join(vipnet_version.split('.')[:2])
     remove_list = []
@@ -318,10 +466,7 @@ def pytest_generate_tests(metafunc):
 
     if "token" in metafunc.fixturenames:
         if tokens is None:
-            with open(path_to_tokens) as f:
-                tokens_yml = yaml.full_load(f)
-            tokens_list = tokens_yml["tokens"]
-            ids_token_list, tokens = get_tokens_list(tokens_list, metafunc.config.getoption("--vipnet_version"))
+            ids_token_list, tokens = load_tokens(metafunc.config)
 
         metafunc.parametrize(
             "token",
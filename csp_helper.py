@@ -0,0 +1,55 @@
+"""
+Вспомогательный процесс CspInvokeWorker: читает команды построчно (JSON) из stdin,
+запускает каждую и возвращает код возврата и вывод отдельной строкой JSON.
+
+На linux запускается через sudo, поэтому выполняет только программу, путь к которой
+передан первым аргументом (csp_invoke). В sudoers без пароля разрешается ровно эта
+команда, например:
+
+    admin-test ALL=(root) NOPASSWD: /usr/bin/python3 -u /opt/tests/csp_helper.py /opt/itcs/bin/csp_invoke
+
+Файл, интерпретатор и csp_invoke должны принадлежать root и быть недоступны на запись
+пользователю: иначе такое правило разрешает запуск любого кода от root. Поэтому через
+sudo запускается не этот файл из рабочей копии, а его установленная копия (опция
+--csp-helper), см. README.md.
+"""
+import base64
+import json
+import os
+import subprocess
+import sys
+
+# Код возврата для команды, отличной от разрешенной программы
+NOT_ALLOWED = 126
+
+
+def handle(request, allowed=None):
+    args = request["args"]
+    response = {"id": request["id"]}
+    if allowed is not None and os.path.realpath(args[0]) != allowed:
+        response["returncode"] = NOT_ALLOWED
+        response["output"] = base64.b64encode(f"{args[0]} is not allowed".encode()).decode()
+        return response
+    try:
+        proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              timeout=request.get("timeout"), cwd=request.get("cwd"))
+        response["returncode"] = proc.returncode
+        response["output"] = base64.b64encode(proc.stdout).decode()
+    except subprocess.TimeoutExpired as e:
+        response["timeout"] = True
+        response["output"] = base64.b64encode(e.output or b"").decode()
+    except OSError as e:
+        response["returncode"] = 127
+        response["output"] = base64.b64encode(str(e).encode()).decode()
+    return response
+
+
+def main(argv):
+    allowed = os.path.realpath(argv[1]) if len(argv) > 1 else None
+    for line in sys.stdin:
+        sys.stdout.write(json.dumps(handle(json.loads(line), allowed)) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,288 @@
+import asyncio
+import base64
+import getpass
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, TimeoutExpired
+
+from errors import CspWorkerException
+from process_registry import REGISTRY
+
+# Вспомогательный процесс, см. csp_helper.py
+HELPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csp_helper.py')
+
+
+class CspInvokeWorker:
+    """
+    Долгоживущий вспомогательный процесс для запуска csp_invoke.
+
+    На linux процесс поднимается через sudo один раз, дальше все команды выполняются
+    его дочерними процессами без повторных sudo/PAM. Для каждой команды отдельно
+    возвращаются код возврата и вывод.
+
+    Помощник выполняет только программу executable (csp_invoke), поэтому sudo без пароля
+    нужен ровно для команды `python -u <helper> <csp_invoke>` - правило sudoers описано
+    в csp_helper.py и README.md. Для sudo helper - установленная копия csp_helper.py,
+    принадлежащая root, а не файл из рабочей копии репозитория. Перед запуском
+    проверяются владелец помощника и правило (sudo -n -l): если правила нет,
+    выбрасывается CspWorkerException с текстом нужной строки sudoers.
+    """
+
+    # Запас времени сверх таймаута команды: помощник сам завершает команду по таймауту
+    # и отвечает, если ответа нет и после запаса - помощник считается зависшим
+    RESPONSE_MARGIN = 30
+
+    def __init__(self, executable=None, elevate=sys.platform == 'linux', python=sys.executable,
+                 helper=None):
+        if elevate and executable is None:
+            raise ValueError('executable is required to run the worker through sudo')
+        if elevate and helper is None:
+            raise ValueError('helper is required to run the worker through sudo: '
+                             'pass the root-owned installed copy of csp_helper.py')
+        self.executable = executable
+        self.elevate = elevate
+        self.python = python
+        self.helper = HELPER_PATH if helper is None else helper
+        self._proc = None
+        self._responses = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    @staticmethod
+    def _read_responses(stdout, responses):
+        # Ответы читаются в отдельном потоке, чтобы ждать их с таймаутом и на windows
+        with stdout:
+            for line in stdout:
+                responses.put(line)
+        responses.put('')
+
+    @property
+    def command(self):
+        command = [self.python, '-u', self.helper]
+        if self.executable is not None:
+            command.append(str(self.executable))
+        return command
+
+    def sudoers_rule(self, user=None):
+        """
+        Строка sudoers, разрешающая запуск помощника без пароля.
+        """
+        return f'{user or getpass.getuser()} ALL=(root) NOPASSWD: {" ".join(self.command)}'
+
+    def check_sudo(self):
+        """
+        Проверить, что помощник можно запустить через sudo -n.
+
+        :raises CspWorkerException: помощник или интерпретатор не принадлежит root или
+            доступен на запись другим пользователям, либо в sudoers нет правила для команды помощника
+        """
+        for path in (self.python, self.helper):
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                raise CspWorkerException(f'{path}: {e.strerror}') from e
+            if stat.st_uid != 0 or stat.st_mode & 0o022:
+                raise CspWorkerException(f'{path} must be owned by root and not writable by group or others')
+        try:
+            with Popen(['sudo', '-n', '-l', *self.command], stdout=PIPE, stderr=PIPE) as proc:
+                proc.communicate()
+        except OSError as e:
+            raise CspWorkerException(f'sudo: {e.strerror}') from e
+        if proc.returncode != 0:
+            raise CspWorkerException(f'sudo -n refused to run the csp_invoke worker, add to sudoers: '
+                                     f'{self.sudoers_rule()}')
+
+    def start(self):
+        if self.alive:
+            return
+        command = self.command
+        if self.elevate:
+            self.check_sudo()
+            command[:0] = ['sudo', '-n']
+        self._proc = Popen(command, stdin=PIPE, stdout=PIPE, universal_newlines=True, bufsize=1)
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read_responses, args=(self._proc.stdout, self._responses),
+                         name='csp_invoke worker reader', daemon=True).start()
+        REGISTRY.register(self._proc.pid, 'csp_invoke worker')
+        logging.info('csp_invoke worker started, pid %s', self._proc.pid)
+
+    def stop(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+            self._proc.wait(30)
+        except (OSError, TimeoutExpired):
+            self.kill()
+            return
+        REGISTRY.unregister(self._proc.pid)
+        self._proc = None
+
+    def kill(self):
+        """
+        Завершить помощник, не дожидаясь текущей команды.
+        """
+        if self._proc is None:
+            return
+        # sudo передает SIGTERM дочернему процессу, SIGKILL - нет, поэтому сначала terminate
+        try:
+            self._proc.terminate()
+            self._proc.wait(10)
+        except TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        except OSError:
+            logging.exception('csp_invoke worker %s could not be terminated', self._proc.pid)
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        REGISTRY.unregister(self._proc.pid)
+        self._proc = None
+
+    def run(self, process, timeout=1080, cwd=None):
+        """
+        Выполнить одну команду.
+
+        :param process: аргументы команды, без sudo
+        :param timeout: таймаут в секундах, по истечении процесс команды убивается.
+            Если помощник не ответил и через RESPONSE_MARGIN секунд после таймаута,
+            он завершается и тоже выбрасывается TimeoutExpired
+        :param cwd: рабочая директория команды
+        :return: (код возврата, вывод в байтах)
+        """
+        with self._lock:
+            self.start()
+            self._next_id += 1
+            request = {"id": self._next_id, "args": list(map(str, process)), "timeout": timeout,
+                       "cwd": None if cwd is None else str(cwd)}
+            try:
+                self._proc.stdin.write(json.dumps(request) + "\n")
+                self._proc.stdin.flush()
+            except OSError as e:
+                self.kill()
+                raise CspWorkerException() from e
+            try:
+                line = self._responses.get(timeout=None if timeout is None else timeout + self.RESPONSE_MARGIN)
+            except queue.Empty:
+                logging.error(f'csp_invoke worker did not answer in {timeout + self.RESPONSE_MARGIN}s, killing it')
+                self.kill()
+                raise TimeoutExpired(process, timeout)
+            if not line:
+                self.kill()
+                raise CspWorkerException()
+
+        response = json.loads(line)
+        output = base64.b64decode(response["output"])
+        if response.get("timeout"):
+            raise TimeoutExpired(process, timeout, output)
+        return response["returncode"], output
+
+    def run_many(self, processes, timeout=1080, cwd=None):
+        """
+        Выполнить очередь команд по порядку.
+
+        :return: список (код возврата, вывод) по каждой команде
+        """
+        return [self.run(process, timeout, cwd) for process in processes]
+
+
+class AsyncCspRunner:
+    """
+    Запуск csp_invoke через asyncio.
+
+    Вывод читается по мере поступления (без риска заполнить буфер пайпа), по таймауту
+    завершается только запущенный этим раннером процесс. Команды разных токенов можно
+    выполнять параллельно через run_all.
+    """
+
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, elevate=sys.platform == 'linux', on_output=None):
+        self.elevate = elevate
+        self.on_output = on_output
+
+    async def _read_output(self, proc, chunks):
+        while True:
+            chunk = await proc.stdout.read(self.READ_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if self.on_output is not None:
+                self.on_output(chunk)
+        return await proc.wait()
+
+    async def _terminate(self, proc):
+        # sudo передает SIGTERM дочернему процессу, SIGKILL - нет, поэтому сначала terminate
+        try:
+            proc.terminate()
+            await asyncio.wait_for(proc.wait(), 10)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+
+    async def run(self, process, timeout=1080, cwd=None):
+        """
+        Выполнить команду.
+
+        :param process: аргументы команды, без sudo
+        :param timeout: таймаут в секундах
+        :param cwd: рабочая директория команды
+        :return: (код возврата, вывод в байтах)
+        """
+        command = list(map(str, process))
+        if self.elevate:
+            command.insert(0, 'sudo')
+        proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.STDOUT, cwd=cwd)
+        REGISTRY.register(proc.pid, command[0])
+        chunks = []
+        try:
+            returncode = await asyncio.wait_for(self._read_output(proc, chunks), timeout)
+        except asyncio.TimeoutError:
+            await self._terminate(proc)
+            raise TimeoutExpired(process, timeout, b"".join(chunks))
+        finally:
+            REGISTRY.unregister(proc.pid)
+        return returncode, b"".join(chunks)
+
+    async def run_all(self, processes, timeout=1080, cwd=None):
+        """
+        Выполнить команды параллельно.
+
+        :return: список (код возврата, вывод) в порядке команд
+        """
+        return await asyncio.gather(*(self.run(process, timeout, cwd) for process in processes))
+
+    def run_sync(self, process, timeout=1080, cwd=None):
+        """
+        Выполнить команду синхронно, см. run.
+
+        В потоке с работающим циклом событий asyncio.run недоступен: команда выполняется
+        в отдельном потоке со своим циклом, вызывающий поток (и его цикл) ждет результата.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.run(process, timeout, cwd))
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(asyncio.run, self.run(process, timeout, cwd)).result()
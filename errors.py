@@ -3,6 +3,11 @@ class CspInvokeException(Exception):
         return "Ошибка при работе с csp_invoke"
 
 
+class CspWorkerException(Exception):
+    def __str__(self):
+        return self.args[0] if self.args else "Вспомогательный процесс csp_invoke завершился"
+
+
 ERRORS = {
     "FuncVipNet":
         {
@@ -0,0 +1,176 @@
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+
+class ProcessRegistry:
+    """
+    Реестр процессов, запущенных самим тестовым окружением.
+
+    Завершаются только процессы из реестра (с проверкой времени создания, чтобы не убить
+    чужой процесс с переиспользованным PID), без перебора всех процессов машины.
+    Также собирает время ожидания блокировок токенов.
+    """
+
+    def __init__(self):
+        self._processes = {}
+        self._waits = []
+        self._lock = threading.Lock()
+
+    def register(self, pid, label=''):
+        try:
+            create_time = psutil.Process(pid).create_time()
+        except psutil.Error:
+            return
+        with self._lock:
+            self._processes[pid] = (create_time, label)
+
+    def unregister(self, pid):
+        with self._lock:
+            self._processes.pop(pid, None)
+
+    def _alive(self, pid, create_time):
+        try:
+            proc = psutil.Process(pid)
+            return proc if proc.create_time() == create_time else None
+        except psutil.Error:
+            return None
+
+    def tracked(self):
+        with self._lock:
+            processes = dict(self._processes)
+        return [pid for pid, (create_time, _) in processes.items() if self._alive(pid, create_time)]
+
+    @staticmethod
+    def _kill(proc, label, timeout=5):
+        logging.warning(f'Killing tracked process {proc.pid} ({label})')
+        try:
+            children = proc.children(recursive=True)
+        except psutil.Error:
+            children = []
+        # Сначала SIGTERM отслеживаемому процессу: sudo передает его команде,
+        # а процессы, запущенные от root, пользователь сам завершить не может
+        try:
+            proc.terminate()
+        except psutil.Error as e:
+            logging.error(f'Failed to terminate process {proc.pid}: {e}')
+        _, alive = psutil.wait_procs([proc] + children, timeout=timeout)
+        for leftover in alive:
+            try:
+                leftover.kill()
+            except psutil.Error as e:
+                logging.error(f'Failed to kill process {leftover.pid}: {e}')
+
+    def kill_tracked(self):
+        with self._lock:
+            processes, self._processes = self._processes, {}
+        for pid, (create_time, label) in processes.items():
+            proc = self._alive(pid, create_time)
+            if proc is not None:
+                self._kill(proc, label)
+
+    def record_wait(self, name, seconds):
+        with self._lock:
+            self._waits.append((name, seconds))
+
+    @staticmethod
+    def measure_scan(name='csp_invoke'):
+        """
+        Время одного перебора процессов по имени, как делал FuncVipNet перед каждой
+        операцией на windows до появления реестра.
+
+        :return: время в секундах
+        """
+        start = time.monotonic()
+        found = [proc.pid for proc in psutil.process_iter(['name']) if proc.info['name'] == name]
+        elapsed = time.monotonic() - start
+        logging.debug(f'Process scan: {len(found)} {name} processes in {elapsed:.3f}s')
+        return elapsed
+
+    def wait_stats(self, scan=None):
+        """
+        :param scan: время одного перебора процессов (measure_scan): экономия считается
+            как перебор на каждую операцию, если он выполнялся на этой платформе
+        """
+        with self._lock:
+            waits = [seconds for _, seconds in self._waits]
+        stats = {
+            "operations": len(waits),
+            "total_wait": sum(waits),
+            "max_wait": max(waits, default=0.0),
+            "scan": scan,
+            "saved": None,
+        }
+        if scan is not None:
+            stats["saved"] = scan * len(waits) if sys.platform == "win32" else 0.0
+        return stats
+
+
+REGISTRY = ProcessRegistry()
+
+
+class TokenLock:
+    """
+    Межпроцессная блокировка токена на lock-файле: одновременно с токеном работает
+    только одна операция, в том числе из разных процессов (xdist).
+    """
+
+    def __init__(self, name, lock_dir=None, timeout=1200, registry=REGISTRY):
+        self.name = re.sub(r'\W+', '_', name).strip('_')
+        self.path = os.path.join(lock_dir or tempfile.gettempdir(), f'vipnet_token_{self.name}.lock')
+        self.timeout = timeout
+        self.registry = registry
+        self.waited = None
+        self._file = None
+
+    def _try_lock(self):
+        try:
+            if sys.platform == "win32":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self):
+        start = time.monotonic()
+        self._file = open(self.path, 'a+')
+        while not self._try_lock():
+            if time.monotonic() - start > self.timeout:
+                self._file.close()
+                self._file = None
+                raise TimeoutError(f'Token {self.name} is locked for more than {self.timeout} seconds')
+            time.sleep(0.05)
+        self.waited = time.monotonic() - start
+        self.registry.record_wait(self.name, self.waited)
+
+    def release(self):
+        if self._file is None:
+            return
+        if sys.platform == "win32":
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Throughput benchmark for the daemon's bulk-data transport.
+
+Starts a :py:class:`~pycryptoki.daemon.rpyc_pycryptoki.PycryptokiService` on loopback with
+two echo endpoints and compares, for payloads from 1 KB to 64 MB:
+
+* ``bytes``: the payload passed as a regular RPyC argument.
+* ``chunks``: the payload passed as a list of chunks (multipart style), which RPyC sends
+  as a netref.
+* ``frame``: the payload sent as a binary frame, see :py:mod:`pycryptoki.daemon.transport`.
+
+Run via ``python benchmarks/bench_daemon_transport.py [--compressible]``.
+"""
+from __future__ import print_function
+
+import os
+import threading
+import time
+from argparse import ArgumentParser
+
+import rpyc
+from rpyc.utils.server import ThreadedServer
+
+from pycryptoki.daemon.rpyc_pycryptoki import PycryptokiService
+from pycryptoki.daemon.transport import (COMPRESSION_THRESHOLD, decode_frame,
+                                         encode_frame)
+
+KB = 1024
+MB = 1024 * KB
+DEFAULT_SIZES = [KB, 4 * KB, 16 * KB, 64 * KB, 256 * KB, MB, 4 * MB, 16 * MB, 64 * MB]
+SERVER_CONFIG = {'allow_public_attrs': True,
+                 'allow_all_attrs': True,
+                 'allow_getattr': True,
+                 'allow_setattr': True,
+                 'allow_delattr': True,
+                 'sync_request_timeout': 600}
+
+
+class EchoService(PycryptokiService):
+    """Daemon service with echo endpoints standing in for c_encrypt."""
+
+    @staticmethod
+    def exposed_echo(data):
+        if not isinstance(data, bytes):
+            data = b"".join(data)
+        return data
+
+    @staticmethod
+    def exposed_echo_frame(frame):
+        payload, meta = decode_frame(frame)
+        return encode_frame(payload, meta, meta.get('threshold'))
+
+
+def make_payload(size, compressible):
+    """Payload of random data, or of half random/half zero bytes if compressible."""
+    if compressible:
+        return os.urandom(size // 2) + b"\x00" * (size - size // 2)
+    return os.urandom(size)
+
+
+def measure(func, min_time, max_iterations=100):
+    """Run ``func`` until ``min_time`` has passed; return the mean duration of a call."""
+    func()
+    iterations, start = 0, time.time()
+    while True:
+        func()
+        iterations += 1
+        elapsed = time.time() - start
+        if elapsed >= min_time or iterations >= max_iterations:
+            return elapsed / iterations
+
+
+def run(sizes, chunk_size, compressible, min_time, port):
+    server = ThreadedServer(EchoService, hostname="127.0.0.1", port=port,
+                            protocol_config=SERVER_CONFIG)
+    thread = threading.Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+    conn = rpyc.connect("127.0.0.1", port, config=SERVER_CONFIG)
+    root = conn.root
+    print("{:>10} {:>12} {:>12} {:>12}".format("size", "bytes MB/s", "chunks MB/s",
+                                              "frame MB/s"))
+    try:
+        for size in sizes:
+            payload = make_payload(size, compressible)
+            chunks = [payload[i:i + chunk_size] for i in range(0, size, chunk_size)]
+
+            def send_frame():
+                frame = encode_frame(payload, {'threshold': COMPRESSION_THRESHOLD})
+                data, _ = decode_frame(root.echo_frame(frame))
+                assert len(data) == size
+
+            timings = [measure(lambda: root.echo(payload), min_time),
+                       measure(lambda: root.echo(chunks), min_time),
+                       measure(send_frame, min_time)]
+            print("{:>10} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+                "{}K".format(size // KB), *[2 * size / MB / timing for timing in timings]))
+    finally:
+        conn.close()
+        server.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=lambda x: [int(size) * KB for size in x.split(",")],
+                        default=DEFAULT_SIZES, help="Comma separated payload sizes in KB")
+    parser.add_argument("--chunk-size", type=int, default=64 * KB,
+                        help="Chunk size for the multipart variant, in bytes")
+    parser.add_argument("--compressible", action="store_true",
+                        help="Use half-zero payloads so frame compression kicks in")
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="Minimum time to spend on each measurement, in seconds")
+    parser.add_argument("-p", "--port", type=int, default=18001)
+    args = parser.parse_args()
+    run(args.sizes, args.chunk_size, args.compressible, args.min_time, args.port)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks of pycryptoki's hot paths, with regression gating.
+
+Runs against :py:class:`~pycryptoki.fake_cryptoki.FakeCryptoki`, so what is measured is
+pycryptoki's own overhead (templates, conversions, ctypes marshalling, wrappers), no HSM
+needed. Each benchmark reports the best time per call out of several repeats.
+
+Save a baseline on a given machine, then compare later runs against it::
+
+    python benchmarks/run_benchmarks.py --save
+    python benchmarks/run_benchmarks.py --threshold 0.2
+
+The second run exits with status 1 if a benchmark got slower than the baseline by more
+than the threshold (20% here). Baselines are only meaningful on the machine (and Python)
+they were recorded on. Use ``-k`` to run a subset, ``--json`` for machine-readable output.
+"""
+from __future__ import print_function
+
+import json
+import os
+import platform
+import sys
+import timeit
+from argparse import ArgumentParser
+
+from pycryptoki.attributes import Attributes, c_struct_to_python, to_byte_array
+from pycryptoki.default_templates import CKM_AES_KEY_GEN_TEMP, \
+    CKM_RSA_PKCS_KEY_PAIR_GEN_PUBTEMP, CKM_RSA_PKCS_KEY_PAIR_GEN_PRIVTEMP
+from pycryptoki.defines import CKM_AES_KEY_GEN, CKM_AES_CBC, CKM_RSA_PKCS_KEY_PAIR_GEN, \
+    CKM_SHA256_RSA_PKCS, CKA_CLASS, CKA_LABEL, CKA_TOKEN, CKO_SECRET_KEY, CKU_USER
+from pycryptoki.encryption import c_encrypt_ex
+from pycryptoki.fake_cryptoki import FakeCryptoki
+from pycryptoki.key_generator import c_generate_key_ex, c_generate_key_pair_ex
+from pycryptoki.mechanism import parse_mechanism
+from pycryptoki.misc import c_generate_random, c_generate_random_ex
+from pycryptoki.object_attr_lookup import c_find_objects_ex
+from pycryptoki.session_management import c_initialize_ex, c_finalize_ex, \
+    c_open_session_ex, c_close_session_ex, login_ex
+from pycryptoki.sign_verify import c_sign_ex
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+KB = 1024
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """
+    Register a benchmark: ``func(session)`` returns the callable to time.
+
+    Each benchmark gets a session of its own, closed once measured. Objects it creates
+    must be session objects (see :py:func:`_session_template`): they are destroyed with
+    the session, so results don't depend on which benchmarks ran before.
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+@benchmark
+def attributes_get_c_struct(session):
+    return lambda: Attributes(CKM_AES_KEY_GEN_TEMP).get_c_struct()
+
+
+@benchmark
+def c_struct_to_python_template(session):
+    c_struct = Attributes(CKM_AES_KEY_GEN_TEMP).get_c_struct()
+    return lambda: c_struct_to_python(c_struct)
+
+
+@benchmark
+def to_byte_array_int(session):
+    value = int("ab" * 32, 16)
+    return lambda: to_byte_array(value)
+
+
+@benchmark
+def to_byte_array_list(session):
+    value = list(range(256))
+    return lambda: to_byte_array(value)
+
+
+@benchmark
+def to_byte_array_bytes(session):
+    value = os.urandom(KB)
+    return lambda: to_byte_array(value)
+
+
+@benchmark
+def parse_mechanism_int(session):
+    return lambda: parse_mechanism(CKM_SHA256_RSA_PKCS)
+
+
+@benchmark
+def parse_mechanism_iv(session):
+    mechanism = {'mech_type': CKM_AES_CBC, 'params': {'iv': list(range(16))}}
+    return lambda: parse_mechanism(mechanism)
+
+
+@benchmark
+def generate_random(session):
+    return lambda: c_generate_random(session, 32)
+
+
+@benchmark
+def generate_random_ex(session):
+    return lambda: c_generate_random_ex(session, 32)
+
+
+def _session_template(template):
+    """Copy of a default template for a session (non-token) object."""
+    template = dict(template)
+    template[CKA_TOKEN] = False
+    return template
+
+
+def _objects(session, count):
+    template = _session_template(CKM_AES_KEY_GEN_TEMP)
+    template[CKA_LABEL] = b"bench"
+    for _ in range(count):
+        c_generate_key_ex(session, CKM_AES_KEY_GEN, template)
+
+
+@benchmark
+def find_objects_page_10(session):
+    _objects(session, 1000)
+    return lambda: c_find_objects_ex(session, {CKA_CLASS: CKO_SECRET_KEY}, 10)
+
+
+@benchmark
+def find_objects_page_1000(session):
+    _objects(session, 1000)
+    return lambda: c_find_objects_ex(session, {CKA_LABEL: b"bench"}, 1000)
+
+
+def _aes_key(session):
+    return c_generate_key_ex(session, CKM_AES_KEY_GEN, _session_template(CKM_AES_KEY_GEN_TEMP))
+
+
+def _rsa_key(session):
+    return c_generate_key_pair_ex(session, CKM_RSA_PKCS_KEY_PAIR_GEN,
+                                  _session_template(CKM_RSA_PKCS_KEY_PAIR_GEN_PUBTEMP),
+                                  _session_template(CKM_RSA_PKCS_KEY_PAIR_GEN_PRIVTEMP))[1]
+
+
+@benchmark
+def encrypt_single_part(session):
+    key, data = _aes_key(session), os.urandom(4 * KB)
+    return lambda: c_encrypt_ex(session, key, data, CKM_AES_CBC)
+
+
+@benchmark
+def encrypt_multipart(session):
+    key, data = _aes_key(session), [os.urandom(KB) for _ in range(4)]
+    return lambda: c_encrypt_ex(session, key, data, CKM_AES_CBC)
+
+
+@benchmark
+def sign_single_part(session):
+    key, data = _rsa_key(session), os.urandom(4 * KB)
+    return lambda: c_sign_ex(session, key, data, CKM_SHA256_RSA_PKCS)
+
+
+@benchmark
+def sign_multipart(session):
+    key, data = _rsa_key(session), [os.urandom(KB) for _ in range(4)]
+    return lambda: c_sign_ex(session, key, data, CKM_SHA256_RSA_PKCS)
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """
+    :return: Best time per call of ``func``, in seconds, out of ``repeat`` runs of at least
+        ``min_time`` seconds.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time / 10:
+        number *= 10
+    number = max(1, int(number * min_time / max(timer.timeit(number), 1e-9)))
+    return min(timer.repeat(repeat, number)) / number
+
+
+def run(names=None, min_time=0.2, repeat=5):
+    """
+    Run the benchmarks against a fake library.
+
+    :param names: Substrings of benchmark names to run, all if None.
+    :return: dict of benchmark name to best time per call, in seconds.
+    """
+    results = {}
+    with FakeCryptoki(password=b"userpin"):
+        c_initialize_ex()
+        try:
+            # Keeps the library logged in, the benchmarks run on sessions of their own
+            login_session = c_open_session_ex(1)
+            login_ex(login_session, 1, b"userpin", CKU_USER)
+            for bench in BENCHMARKS:
+                if names and not any(name in bench.__name__ for name in names):
+                    continue
+                session = c_open_session_ex(1)
+                try:
+                    results[bench.__name__] = measure(bench(session), min_time, repeat)
+                finally:
+                    c_close_session_ex(session)
+        finally:
+            c_finalize_ex()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: list of (name, time, baseline time, relative change) for benchmarks slower
+        than the baseline by more than ``threshold``.
+    """
+    regressions = []
+    for name, duration in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference:
+            change = duration / reference - 1
+            if change > threshold:
+                regressions.append((name, duration, reference, change))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-k", dest="names", action="append",
+                        help="Only run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save", action="store_true",
+                        help="Store the results as the new baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown against the baseline, as a fraction")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="Minimum time of each repeat, in seconds")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeats per benchmark")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.names, args.min_time, args.repeat)
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    print("{:<30} {:>12} {:>12} {:>9}".format("benchmark", "us/call", "baseline", "change"))
+    for name in sorted(results):
+        reference = baseline.get(name)
+        print("{:<30} {:>12.2f} {:>12} {:>9}".format(
+            name, results[name] * 1e6,
+            "{:.2f}".format(reference * 1e6) if reference else "-",
+            "{:+.1%}".format(results[name] / reference - 1) if reference else "-"))
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'results': results}
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent=2, sort_keys=True)
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+        print("Saved baseline to {}".format(args.baseline))
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, duration, reference, change in regressions:
+        print("REGRESSION {}: {:.2f}us vs {:.2f}us ({:+.1%})".format(
+            name, duration * 1e6, reference * 1e6, change))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
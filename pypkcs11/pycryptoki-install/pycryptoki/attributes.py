@@ -4,7 +4,6 @@ generation to make it possible to create templates in python and easily
 convert them into templates in C.
 """
 import binascii
-import collections
 import datetime
 import logging
 from collections import defaultdict
@@ -13,6 +12,7 @@ from ctypes import cast, c_void_p, create_string_buffer, c_bool, \
 from functools import wraps
 
 from six import b, string_types, integer_types, text_type, binary_type
+from six.moves.collections_abc import Iterable
 
 from pycryptoki.conversions import from_bytestring
 from .cryptoki import CK_ATTRIBUTE, CK_BBOOL, CK_ATTRIBUTE_TYPE, CK_ULONG, \
@@ -205,7 +205,7 @@ def to_byte_array(val, reverse=False, output_to_hex=True, *args, **kwargs):
                   fin)
         return fin
 
-    if not isinstance(val, (binary_type, collections.Iterable, integer_types)):
+    if not isinstance(val, (binary_type, Iterable, integer_types)):
         raise TypeError("Unknown conversion to byte array for type {}".format(type(val)))
 
     if isinstance(val, binary_type):
@@ -219,7 +219,7 @@ def to_byte_array(val, reverse=False, output_to_hex=True, *args, **kwargs):
         # Hex string: '01af'
         else:
             val = int(val, 16)
-    elif isinstance(val, collections.Iterable):
+    elif isinstance(val, Iterable):
         py_bytes = bytearray(val)
         byte_array = (CK_BYTE * len(py_bytes))(*py_bytes)
 
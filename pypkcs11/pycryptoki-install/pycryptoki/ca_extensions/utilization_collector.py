@@ -0,0 +1,188 @@
+"""
+Background collector for HSM utilization metrics.
+
+Periodically snapshots the utilization counters on a dedicated session
+(:py:func:`~pycryptoki.ca_extensions.utilization_metrics.ca_read_utilization_metrics`, then
+:py:func:`~pycryptoki.ca_extensions.utilization_metrics.ca_read_all_utilization_counters`),
+computes per-second rates for every partition & bin and appends them to a rotating CSV
+time series::
+
+    with UtilizationCollector(slot=0, password=b"sopin", path="utilization.csv"):
+        run_load()
+
+Each row is ``timestamp,partition,bin,count,delta,rate``. When the file grows past
+``max_bytes`` it's rotated to ``utilization.csv.1``, ``.2``... like a rotating log file.
+"""
+import logging
+import os
+import threading
+import time
+
+from pycryptoki.ca_extensions.utilization_metrics import (ca_read_utilization_metrics_ex,
+                                                          ca_read_all_utilization_counters_ex)
+from pycryptoki.defines import CKU_SO
+from pycryptoki.session_management import c_open_session_ex, login_ex, c_close_session_ex
+
+LOG = logging.getLogger(__name__)
+
+CSV_COLUMNS = ('timestamp', 'partition', 'bin', 'count', 'delta', 'rate')
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+
+class RotatingCsvWriter(object):
+    """
+    Append rows to a CSV file, rotating it once it grows past ``max_bytes``.
+
+    :param str path: CSV file
+    :param columns: Header columns, written at the top of every file.
+    :param int max_bytes: Size after which the file is rotated.
+    :param int backup_count: Number of rotated files to keep.
+    """
+
+    def __init__(self, path, columns, max_bytes=DEFAULT_MAX_BYTES, backup_count=5):
+        self.path = path
+        self.columns = columns
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = None
+
+    def _open(self):
+        self._file = open(self.path, "a")
+        if self._file.tell() == 0:
+            self._file.write(",".join(self.columns) + "\n")
+
+    def rotate(self):
+        """
+        Move the current file to ``<path>.1`` (shifting older ones) and start a new one.
+        """
+        self.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = "{}.{}".format(self.path, index)
+            if os.path.exists(source):
+                os.rename(source, "{}.{}".format(self.path, index + 1))
+        if self.backup_count > 0:
+            os.rename(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def write_rows(self, rows):
+        """
+        :param rows: Iterable of tuples, in column order.
+        """
+        data = "".join(",".join(str(value) for value in row) + "\n" for row in rows)
+        if self._file is None:
+            self._open()
+        if self._file.tell() + len(data) > self.max_bytes and self._file.tell() > 0:
+            self.rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def close(self):
+        """Close the current file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class UtilizationCollector(object):
+    """
+    Poll utilization counters in a background thread & write per-second rates to disk.
+
+    :param int slot: Slot to open the dedicated session on (usually the admin partition).
+    :param bytes password: Password to log in with; no login if None.
+    :param int user_type: User type to log in as.
+    :param str path: CSV time series file.
+    :param float interval: Seconds between two polls.
+    :param int max_bytes: Size after which the CSV file is rotated.
+    :param int backup_count: Number of rotated CSV files to keep.
+    """
+
+    def __init__(self, slot, password=None, user_type=CKU_SO, path="utilization.csv",
+                 interval=1.0, max_bytes=DEFAULT_MAX_BYTES, backup_count=5):
+        self.slot = slot
+        self.password = password
+        self.user_type = user_type
+        self.interval = interval
+        self.writer = RotatingCsvWriter(path, CSV_COLUMNS, max_bytes, backup_count)
+        self.h_session = None
+        self.failures = 0
+        #: Latest rates, as {partition: {bin: calls per second}}
+        self.rates = {}
+        self._previous = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        """
+        Open the dedicated session and start polling in a background thread.
+        """
+        self.h_session = c_open_session_ex(self.slot)
+        if self.password is not None:
+            login_ex(self.h_session, self.slot, self.password, self.user_type)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="UtilizationCollector")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop polling, close the session and the CSV file.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.h_session is not None:
+            c_close_session_ex(self.h_session)
+            self.h_session = None
+        self.writer.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.poll()
+            except Exception:
+                self.failures += 1
+                LOG.exception("Failed to read utilization metrics on slot %s", self.slot)
+            self._stop.wait(max(0, self.interval - (time.time() - started)))
+
+    def poll(self, now=None):
+        """
+        Snapshot & read the counters once, and write the rates since the previous poll.
+        The first poll only records the baseline.
+
+        :param float now: Timestamp of the poll, defaults to the current time.
+        :return: list of rows written
+        """
+        ca_read_utilization_metrics_ex(self.h_session)
+        counters = ca_read_all_utilization_counters_ex(self.h_session)
+        now = time.time() if now is None else now
+
+        previous, self._previous = self._previous, (now, counters)
+        if previous is None:
+            return []
+
+        elapsed = now - previous[0]
+        rows, rates = [], {}
+        for partition in sorted(counters):
+            for bin_name in sorted(counters[partition]):
+                count = counters[partition][bin_name]
+                last = previous[1].get(partition, {}).get(bin_name, 0)
+                # Counters went down: they were reset (e.g. ca_read_and_reset_utilization_metrics)
+                delta = count - last if count >= last else count
+                rate = delta / elapsed if elapsed > 0 else 0.0
+                rates.setdefault(partition, {})[bin_name] = rate
+                rows.append(("{:.3f}".format(now), partition, bin_name, count, delta,
+                             "{:.3f}".format(rate)))
+        self.rates = rates
+        self.writer.write_rows(rows)
+        return rows
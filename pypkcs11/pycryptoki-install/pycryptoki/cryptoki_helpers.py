@@ -6,7 +6,9 @@ import os
 import re
 import struct
 import sys
+import time
 from ctypes import CDLL
+from timeit import default_timer
 
 from six.moves import configparser
 from . import defaults
@@ -19,6 +21,9 @@ IS_64B = 8 * struct.calcsize("P") == 64
 
 CRYSTOKI_CONF_DLL = "CHRYSTOKI_CONF_DLL"
 
+# Hooks run after every PKCS11 library call, see register_call_hook().
+_CALL_HOOKS = []
+
 
 class CryptokiConfigException(LunaException):
     """
@@ -195,6 +200,41 @@ def log_args(funcname, args):
     LOG.debug(log_msg)
 
 
+def register_call_hook(hook):
+    """Register a function to be called after every call into the PKCS11 library::
+
+        hook(function_name, args, return_value, start, duration, exception)
+
+    ``start`` is the wall clock time the call started at, ``duration`` how long it took in
+    seconds. If the call raised, ``return_value`` is None and ``exception`` is set.
+
+    Hooks run in the calling thread, so they must be fast and thread safe. When no hooks
+    are registered, calls aren't timed at all.
+
+    :param hook: Callable
+    """
+    if hook not in _CALL_HOOKS:
+        _CALL_HOOKS.append(hook)
+
+
+def unregister_call_hook(hook):
+    """Remove a hook added with :py:func:`register_call_hook`. Unknown hooks are ignored.
+
+    :param hook: Callable
+    """
+    if hook in _CALL_HOOKS:
+        _CALL_HOOKS.remove(hook)
+
+
+def _run_call_hooks(function_name, args, return_value, start, duration, exception):
+    """Call every registered hook, logging (not raising) hook failures."""
+    for hook in list(_CALL_HOOKS):
+        try:
+            hook(function_name, args, return_value, start, duration, exception)
+        except Exception:
+            LOG.exception("Call hook %s failed for %s", hook, function_name)
+
+
 def make_late_binding_function(function_name):
     """A function factory for creating a function that will bind to the cryptoki
     DLL only when the function is called.
@@ -215,13 +255,25 @@ def make_late_binding_function(function_name):
         late_binded_function.argtypes = luna_function.argtypes
 
         log_args(function_name, args)
+        if not _CALL_HOOKS:
+            try:
+                return late_binded_function(*args)
+            except Exception as e:
+                raise CryptokiDLLException("Call to '{}({})' "
+                                           "failed.".format(function_name,
+                                                            ", ".join([str(arg) for arg in args])),
+                                           e)
+
+        start, timer = time.time(), default_timer()
         try:
             return_value = late_binded_function(*args)
-            return return_value
         except Exception as e:
+            _run_call_hooks(function_name, args, None, start, default_timer() - timer, e)
             raise CryptokiDLLException("Call to '{}({})' "
                                        "failed.".format(function_name,
                                                         ", ".join([str(arg) for arg in args])), e)
+        _run_call_hooks(function_name, args, return_value, start, default_timer() - timer, None)
+        return return_value
 
     luna_function.__name__ = function_name
     return luna_function
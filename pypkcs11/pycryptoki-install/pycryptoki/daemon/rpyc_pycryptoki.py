@@ -21,6 +21,7 @@ from __future__ import print_function
 
 import multiprocessing
 import os
+import pickle
 import signal
 import sys
 import time
@@ -31,6 +32,7 @@ import rpyc
 from rpyc.utils.server import ThreadedServer
 
 import pycryptoki
+from pycryptoki import call_stats, tracing
 from pycryptoki.attributes import *
 from pycryptoki.audit_handling import (ca_get_time, ca_get_time_ex,
                                        ca_init_audit, ca_init_audit_ex,
@@ -45,8 +47,16 @@ from pycryptoki.ca_extensions.session import ca_get_session_info, ca_get_session
 from pycryptoki.ca_extensions.object_handler import ca_destroy_multiple_objects, \
     ca_destroy_multiple_objects_ex, ca_get_object_handle, ca_get_object_handle_ex
 from pycryptoki.cryptoki import CK_ULONG
+from pycryptoki.daemon.streams import StreamTable
+from pycryptoki.daemon.transport import decode_call, encode_result
 from pycryptoki.encryption import (c_encrypt, c_encrypt_ex,
                                    c_decrypt, c_decrypt_ex,
+                                   c_encrypt_init, c_encrypt_init_ex,
+                                   c_encrypt_update, c_encrypt_update_ex,
+                                   c_encrypt_final, c_encrypt_final_ex,
+                                   c_decrypt_init, c_decrypt_init_ex,
+                                   c_decrypt_update, c_decrypt_update_ex,
+                                   c_decrypt_final, c_decrypt_final_ex,
                                    c_wrap_key, c_wrap_key_ex,
                                    c_unwrap_key, c_unwrap_key_ex)
 from pycryptoki.hsm_management import (c_performselftest, c_performselftest_ex,
@@ -149,6 +159,15 @@ from pycryptoki.token_management import (c_init_token, c_init_token_ex,
 
 CRYPTO_OPS = pycryptoki.cryptoki.__all__[:]
 
+# Functions available through the bulk-data endpoint, with the name of the argument
+# carrying the bulk data.
+BULK_OPS = {'c_encrypt': (c_encrypt, 'data'),
+            'c_encrypt_ex': (c_encrypt_ex, 'data'),
+            'c_sign': (c_sign, 'data_to_sign'),
+            'c_sign_ex': (c_sign_ex, 'data_to_sign'),
+            'ca_sim_insert': (ca_sim_insert, 'blob_data'),
+            'ca_sim_insert_ex': (ca_sim_insert_ex, 'blob_data')}
+
 MAX_LOG_SIZE = 5242880
 
 
@@ -195,6 +214,18 @@ class PycryptokiService(rpyc.SlaveService):
     exposed_c_encrypt_ex = staticmethod(c_encrypt_ex)
     exposed_c_decrypt = staticmethod(c_decrypt)
     exposed_c_decrypt_ex = staticmethod(c_decrypt_ex)
+    exposed_c_encrypt_init = staticmethod(c_encrypt_init)
+    exposed_c_encrypt_init_ex = staticmethod(c_encrypt_init_ex)
+    exposed_c_encrypt_update = staticmethod(c_encrypt_update)
+    exposed_c_encrypt_update_ex = staticmethod(c_encrypt_update_ex)
+    exposed_c_encrypt_final = staticmethod(c_encrypt_final)
+    exposed_c_encrypt_final_ex = staticmethod(c_encrypt_final_ex)
+    exposed_c_decrypt_init = staticmethod(c_decrypt_init)
+    exposed_c_decrypt_init_ex = staticmethod(c_decrypt_init_ex)
+    exposed_c_decrypt_update = staticmethod(c_decrypt_update)
+    exposed_c_decrypt_update_ex = staticmethod(c_decrypt_update_ex)
+    exposed_c_decrypt_final = staticmethod(c_decrypt_final)
+    exposed_c_decrypt_final_ex = staticmethod(c_decrypt_final_ex)
 
     # sign_verify.py
     exposed_c_sign = staticmethod(c_sign)
@@ -410,6 +441,183 @@ class PycryptokiService(rpyc.SlaveService):
     exposed_ca_read_and_reset_utilization_metrics_ex =\
                                     staticmethod(ca_read_and_reset_utilization_metrics_ex)
 
+    # call_stats.py
+    exposed_call_stats_enable = staticmethod(call_stats.enable)
+    exposed_call_stats_disable = staticmethod(call_stats.disable)
+    exposed_call_stats_reset = staticmethod(call_stats.reset)
+    exposed_call_stats_json = staticmethod(call_stats.to_json)
+    exposed_call_stats_prometheus = staticmethod(call_stats.to_prometheus)
+
+    @staticmethod
+    def exposed_tracing_enable(path, chrome_format=False):
+        """Start tracing pycryptoki calls on the daemon, see :py:mod:`pycryptoki.tracing`.
+
+        :param str path: Trace file to write on the daemon host.
+        :param bool chrome_format: Write a Chrome trace instead of JSON lines.
+        """
+        exporter_class = tracing.ChromeTraceExporter if chrome_format else \
+            tracing.JsonLinesExporter
+        tracing.enable(exporter_class(path))
+
+    exposed_tracing_disable = staticmethod(tracing.disable)
+
+    def exposed_batch(self, calls, stop_on_error=False):
+        """Run a list of pycryptoki calls on the server in a single round trip.
+
+        The calls are sent as one pickled blob (see
+        :py:meth:`~pycryptoki.pycryptoki_client.RemotePycryptokiClient.batch`), so
+        templates & other containers don't turn into netrefs that have to be walked
+        over the wire.
+
+        :param bytes calls: Pickled list of ``(function_name, args, kwargs)`` tuples.
+        :param bool stop_on_error: Stop at the first call that raises.
+        :return: Pickled list of results, see :py:func:`run_batch`.
+        """
+        if isinstance(calls, bytes):
+            calls = pickle.loads(calls)
+        else:
+            calls = rpyc.classic.obtain(calls)
+        return _encode_batch_results(run_batch(calls, stop_on_error))
+
+    def exposed_bulk_call(self, name, frame):
+        """Call a pycryptoki function whose bulk data is sent as a binary frame.
+
+        See :py:mod:`pycryptoki.daemon.transport` for the frame layout, and
+        :py:meth:`~pycryptoki.pycryptoki_client.RemotePycryptokiClient.bulk_call` for the
+        client side.
+
+        :param str name: Function name, one of ``BULK_OPS``
+        :param bytes frame: Call arguments, encoded with
+            :py:func:`~pycryptoki.daemon.transport.encode_call`
+        :return: The function's return value encoded with
+            :py:func:`~pycryptoki.daemon.transport.encode_result`
+        """
+        if name not in BULK_OPS:
+            raise AttributeError("'{}' has no bulk-data endpoint".format(name))
+        func = BULK_OPS[name][0]
+        kwargs, threshold = decode_call(frame)
+        return encode_result(func(**kwargs), threshold)
+
+    @property
+    def streams(self):
+        """Open streams of this connection, see :py:mod:`pycryptoki.daemon.streams`."""
+        if getattr(self, "_streams", None) is None:
+            self._streams = StreamTable()
+        return self._streams
+
+    def exposed_encrypt_stream_open(self, h_session, h_key, mechanism):
+        """Start a streaming encrypt operation.
+
+        :return: Stream ID to pass to :py:meth:`exposed_stream_push` &
+            :py:meth:`exposed_stream_close`
+        """
+        return self.streams.open('encrypt', h_session, h_key, mechanism)
+
+    def exposed_decrypt_stream_open(self, h_session, h_key, mechanism):
+        """Start a streaming decrypt operation.
+
+        :return: Stream ID to pass to :py:meth:`exposed_stream_push` &
+            :py:meth:`exposed_stream_close`
+        """
+        return self.streams.open('decrypt', h_session, h_key, mechanism)
+
+    def exposed_stream_push(self, stream_id, seq, chunk):
+        """Feed the next chunk of a stream.
+
+        :param int stream_id: Stream ID
+        :param int seq: Sequence number of the chunk, starting at 0
+        :param bytes chunk: Data
+        :return: bytes output for this chunk
+        """
+        return self.streams.push(stream_id, seq, chunk)
+
+    def exposed_stream_close(self, stream_id):
+        """Finish a stream.
+
+        :return: bytes output of the final block
+        """
+        return self.streams.close(stream_id)
+
+    def exposed_stream_abort(self, stream_id):
+        """Abandon a stream, finalizing the operation on the HSM."""
+        self.streams.abort(stream_id)
+
+    def on_disconnect(self, *args):
+        """Don't leave operations active on the HSM when a client goes away mid-stream."""
+        if getattr(self, "_streams", None) is not None:
+            self._streams.abort_all()
+        super(PycryptokiService, self).on_disconnect(*args)
+
+
+def run_batch(calls, stop_on_error=False):
+    """
+    Execute a sequence of pycryptoki calls, collecting the result or the error of each one.
+
+    Each call is a ``(function_name, args, kwargs)`` tuple; ``args`` and ``kwargs`` can be
+    omitted. Function names are the same ones accepted by the daemon (``c_open_session_ex``,
+    ``c_generate_key``...).
+
+    Each result is a dictionary::
+
+        {'name': 'c_open_session_ex', 'result': 5, 'error': None, 'error_code': None}
+
+    If the call raised, ``result`` is None, ``error`` holds the formatted exception and
+    ``error_code`` the return code for a :py:class:`~pycryptoki.exceptions.LunaCallException`.
+
+    Use the ``_ex`` variants together with ``stop_on_error`` to get transactional-style
+    sequences: execution stops at the first failing call, so the returned list is shorter
+    than ``calls`` and its last entry is the failure.
+
+    :param calls: Iterable of ``(function_name, args, kwargs)`` tuples.
+    :param bool stop_on_error: Stop at the first call that raises.
+    :return: list of result dictionaries, in call order.
+    """
+    results = []
+    for call in calls:
+        call = tuple(call)
+        name = call[0]
+        args = tuple(call[1]) if len(call) > 1 and call[1] else ()
+        kwargs = dict(call[2]) if len(call) > 2 and call[2] else {}
+        entry = {'name': name, 'result': None, 'error': None, 'error_code': None}
+        try:
+            func = getattr(PycryptokiService, "exposed_" + name, None)
+            if func is None:
+                raise AttributeError("Unknown pycryptoki function '{}'".format(name))
+            entry['result'] = func(*args, **kwargs)
+        except Exception as e:
+            entry['error'] = "{}: {}".format(e.__class__.__name__, e)
+            entry['error_code'] = getattr(e, "error_code", None)
+        results.append(entry)
+
+        if entry['error'] is not None and stop_on_error:
+            break
+    return results
+
+
+def _encode_batch_results(results):
+    """
+    Pickle batch results for the trip back to the client. A result that can't be pickled
+    (ctypes pointers, etc) is replaced by its repr & flagged as an error rather than
+    failing the whole batch.
+
+    :param list results: Output of :py:func:`run_batch`
+    :return: bytes
+    """
+    try:
+        return pickle.dumps(results, protocol=2)
+    except Exception:
+        safe_results = []
+        for entry in results:
+            try:
+                pickle.dumps(entry['result'], protocol=2)
+            except Exception as e:
+                entry = dict(entry,
+                             result=repr(entry['result']),
+                             error="Result could not be pickled: {}".format(e))
+            safe_results.append(entry)
+        return pickle.dumps(safe_results, protocol=2)
+
+
 def server_launch(service, ip, port, config):
     """
     Target for the multiprocessing Pycryptoki service.
@@ -498,6 +706,17 @@ if __name__ == '__main__':
                         dest="logfile",
                         help="Specifies a logfile to output to. Will perform log rotation based "
                              "on file size. If specified, will NOT output to stdout.")
+    parser.add_argument("--slots",
+                        type=lambda x: [int(slot) for slot in x.split(",")],
+                        help="Supervisor mode: comma separated slots to run a worker process "
+                             "for. Workers listen on the ports following --port.")
+    parser.add_argument("--libraries",
+                        type=lambda x: x.split(","),
+                        help="Supervisor mode: comma separated PKCS11 libraries to run a worker "
+                             "process for.")
+    parser.add_argument("--stats-interval", dest="stats_interval",
+                        type=float, default=60,
+                        help="Supervisor mode: how often to log per-worker stats, in seconds.")
     args = parser.parse_args()
     ip = args.i
     port = args.p
@@ -516,7 +735,15 @@ if __name__ == '__main__':
                                ip, port,
                                server_config))
 
-    if args.forked:
+    if args.slots or args.libraries:
+        from pycryptoki.daemon.supervisor import PycryptokiSupervisor
+
+        logger.info("Starting PycryptokiServer in supervisor mode...")
+        PycryptokiSupervisor(ip, port, server_config,
+                             slots=args.slots,
+                             libraries=args.libraries).run(stats_interval=args.stats_interval)
+
+    elif args.forked:
         logger.info("Starting PycryptokiServer in a separate process...")
         server = create_server_subprocess(**server_kwargs)
         if server.exitcode is not None and not server.is_alive():
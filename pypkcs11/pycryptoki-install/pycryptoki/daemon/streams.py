@@ -0,0 +1,196 @@
+"""
+Streaming multipart operations for the pycryptoki daemon.
+
+A stream wraps a multipart encrypt or decrypt operation on the daemon: the client opens it,
+pushes chunks one at a time and gets the output of each chunk back right away, then closes
+it to get the final block. Neither side ever holds more than a few chunks in memory, so
+multi-GB data can be processed remotely::
+
+    for data in client.encrypt_stream(h_session, h_key, mechanism, chunks):
+        out_file.write(data)
+
+See :py:meth:`~pycryptoki.pycryptoki_client.RemotePycryptokiClient.encrypt_stream` for the
+client side.
+"""
+import itertools
+import logging
+import threading
+
+from ..encryption import (c_encrypt_init_ex, c_encrypt_update_ex, c_encrypt_final,
+                          c_encrypt_final_ex, c_decrypt_init_ex, c_decrypt_update_ex,
+                          c_decrypt_final, c_decrypt_final_ex)
+from ..exceptions import LunaException
+
+LOG = logging.getLogger(__name__)
+
+#: Largest chunk accepted by :py:meth:`StreamTable.push`, in bytes.
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+#: Maximum number of streams open at the same time on one daemon connection.
+MAX_OPEN_STREAMS = 16
+
+# operation: (init, update, final, final without error check for aborts)
+STREAM_OPS = {'encrypt': (c_encrypt_init_ex, c_encrypt_update_ex, c_encrypt_final_ex,
+                          c_encrypt_final),
+              'decrypt': (c_decrypt_init_ex, c_decrypt_update_ex, c_decrypt_final_ex,
+                          c_decrypt_final)}
+
+
+class StreamException(LunaException):
+    """
+    Exception raised on invalid stream usage (unknown stream, out of order or oversized
+    chunks, too many open streams).
+    """
+    pass
+
+
+class _Stream(object):
+    """
+    State of one open stream.
+    """
+
+    def __init__(self, operation, h_session):
+        self.operation = operation
+        self.h_session = h_session
+        self.next_seq = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+class StreamTable(object):
+    """
+    Open streams of one daemon connection.
+
+    :param int max_streams: Maximum number of streams open at the same time.
+    :param int max_chunk_size: Largest chunk accepted, in bytes.
+    """
+
+    def __init__(self, max_streams=MAX_OPEN_STREAMS, max_chunk_size=MAX_CHUNK_SIZE):
+        self.max_streams = max_streams
+        self.max_chunk_size = max_chunk_size
+        self._streams = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._streams)
+
+    def open(self, operation, h_session, h_key, mechanism):
+        """
+        Start a multipart operation & register a stream for it.
+
+        :param str operation: One of ``STREAM_OPS`` (``encrypt``, ``decrypt``)
+        :param int h_session: Session handle
+        :param int h_key: Key handle
+        :param mechanism: See :py:func:`~pycryptoki.mechanism.parse_mechanism`
+        :return: Stream ID
+        """
+        if operation not in STREAM_OPS:
+            raise StreamException("Unknown stream operation '{}'".format(operation))
+        with self._lock:
+            if len(self._streams) >= self.max_streams:
+                raise StreamException("Too many open streams (max {})".format(self.max_streams))
+            for stream in self._streams.values():
+                if stream.h_session == h_session and stream.operation == operation:
+                    raise StreamException("Session {} already has an open {} stream"
+                                          .format(h_session, operation))
+            STREAM_OPS[operation][0](h_session, h_key, mechanism)
+            stream_id = next(self._ids)
+            self._streams[stream_id] = _Stream(operation, h_session)
+        LOG.debug("Opened %s stream %s on session %s", operation, stream_id, h_session)
+        return stream_id
+
+    def _get(self, stream_id):
+        try:
+            return self._streams[stream_id]
+        except KeyError:
+            raise StreamException("No open stream with ID {}".format(stream_id))
+
+    def push(self, stream_id, seq, chunk):
+        """
+        Feed one chunk to a stream.
+
+        :param int stream_id: Stream ID returned by :py:meth:`open`
+        :param int seq: Sequence number of the chunk, starting at 0. Chunks must arrive in
+            order.
+        :param bytes chunk: Data
+        :return: bytes output for this chunk (may be empty for block ciphers)
+        """
+        stream = self._get(stream_id)
+        if seq != stream.next_seq:
+            self.abort(stream_id)
+            raise StreamException("Stream {} got chunk {}, expected {}"
+                                  .format(stream_id, seq, stream.next_seq))
+        if len(chunk) > self.max_chunk_size:
+            self.abort(stream_id)
+            raise StreamException("Chunk of {} bytes is larger than the maximum of {}"
+                                  .format(len(chunk), self.max_chunk_size))
+        try:
+            output = STREAM_OPS[stream.operation][1](stream.h_session, chunk)
+        except Exception:
+            self.abort(stream_id)
+            raise
+        stream.next_seq += 1
+        stream.bytes_in += len(chunk)
+        stream.bytes_out += len(output)
+        return output
+
+    def close(self, stream_id):
+        """
+        Finish the operation & forget the stream.
+
+        :param int stream_id: Stream ID returned by :py:meth:`open`
+        :return: bytes output of the final block
+        """
+        stream = self._get(stream_id)
+        with self._lock:
+            del self._streams[stream_id]
+        output = STREAM_OPS[stream.operation][2](stream.h_session)
+        LOG.debug("Closed %s stream %s: %s chunks, %s bytes in, %s bytes out",
+                  stream.operation, stream_id, stream.next_seq, stream.bytes_in,
+                  stream.bytes_out + len(output))
+        return output
+
+    def abort(self, stream_id):
+        """
+        Finalize the operation without checking its result & forget the stream. Unknown
+        streams are ignored.
+
+        :param int stream_id: Stream ID returned by :py:meth:`open`
+        """
+        with self._lock:
+            stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            STREAM_OPS[stream.operation][3](stream.h_session)
+            LOG.debug("Aborted %s stream %s", stream.operation, stream_id)
+
+    def abort_all(self):
+        """
+        Abort every open stream.
+        """
+        for stream_id in list(self._streams):
+            self.abort(stream_id)
+
+
+def run_stream(table, operation, h_session, h_key, mechanism, chunks):
+    """
+    Generator running a whole stream in-process; yields the non-empty output of each chunk,
+    then the final block.
+
+    :param StreamTable table: Table to open the stream in.
+    :param str operation: One of ``STREAM_OPS``
+    :param int h_session: Session handle
+    :param int h_key: Key handle
+    :param mechanism: See :py:func:`~pycryptoki.mechanism.parse_mechanism`
+    :param chunks: Iterable of bytes
+    """
+    stream_id = table.open(operation, h_session, h_key, mechanism)
+    try:
+        for seq, chunk in enumerate(chunks):
+            output = table.push(stream_id, seq, chunk)
+            if output:
+                yield output
+        output = table.close(stream_id)
+        if output:
+            yield output
+    finally:
+        table.abort(stream_id)
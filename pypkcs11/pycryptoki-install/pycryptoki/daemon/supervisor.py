@@ -0,0 +1,325 @@
+"""
+Supervisor mode for the pycryptoki daemon.
+
+Instead of one :py:class:`~rpyc.utils.server.ThreadedServer` shared by every client, the
+supervisor spawns one worker process per slot (or per PKCS11 library), each running its own
+daemon on its own port. A crash in the vendor library only takes down the worker that owns
+the slot; the supervisor restarts it on the same port.
+
+Calls are not proxied through the supervisor: clients ask it which worker owns a slot, then
+talk to that worker directly, which saves a hop on every call::
+
+    client = RemotePycryptokiClient.from_supervisor(ip, port, slot=1)
+
+To keep the crash isolation, a slot worker rejects calls that name another slot (``slot``,
+``slot_num`` or ``slot_id`` argument). Calls on a session handle are left through: sessions
+are per process, so a worker only knows the sessions opened on its own slot.
+
+Start via ``rpyc_pycryptoki.py -p <port> --slots 0,1,2`` or
+``rpyc_pycryptoki.py -p <port> --libraries /usr/lib/libA.so,/usr/lib/libB.so``. Workers
+listen on ``<port> + 1``, ``<port> + 2``...
+"""
+import inspect
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from functools import wraps
+
+import rpyc
+from rpyc.utils.server import ThreadedServer
+
+from pycryptoki import defaults
+from pycryptoki.daemon.rpyc_pycryptoki import PycryptokiService, server_launch
+from pycryptoki.exceptions import unwrap_function
+
+LOG = logging.getLogger(__name__)
+
+#: Argument names pycryptoki functions take a slot as.
+SLOT_ARGS = ("slot", "slot_num", "slot_id")
+
+
+def _call_slot(func, args, kwargs):
+    """
+    Find the slot passed explicitly to a pycryptoki call, if any. Defaults don't count:
+    e.g. ``login(h_session)`` works on the session's slot whatever its ``slot_num`` default.
+
+    :return: Slot or None
+    """
+    for name in SLOT_ARGS:
+        if name in kwargs:
+            return kwargs[name]
+    func = unwrap_function(func)
+    code = getattr(getattr(func, "__func__", func), "__code__", None)
+    if code is None:
+        return None
+    arg_names = code.co_varnames[:code.co_argcount]
+    if inspect.ismethod(func):
+        arg_names = arg_names[1:]
+    for name in SLOT_ARGS:
+        if name in arg_names and arg_names.index(name) < len(args):
+            return args[arg_names.index(name)]
+    return None
+
+
+class WorkerStats(object):
+    """
+    Counters shared between a worker process and the supervisor.
+    """
+
+    def __init__(self):
+        self.calls = multiprocessing.Value('L', 0)
+        self.errors = multiprocessing.Value('L', 0)
+        self.in_flight = multiprocessing.Value('l', 0)
+
+
+class MeteredPycryptokiService(PycryptokiService):
+    """
+    Pycryptoki service that counts the calls it serves into a :py:class:`WorkerStats`, and
+    rejects calls for another slot than the one its worker owns.
+
+    ``in_flight`` counts the calls received but not finished yet. The worker's
+    ThreadedServer runs each call in the connection's thread as soon as it arrives: there
+    is no queue, so this is the number of concurrent calls, not a backlog.
+    """
+    stats = None
+    #: Slot of the worker, None for per-library workers.
+    slot = None
+
+    def _rpyc_getattr(self, name):
+        attr = super(MeteredPycryptokiService, self)._rpyc_getattr(name)
+        stats, slot = self.stats, self.slot
+        if stats is None or not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def metered(*args, **kwargs):
+            """Count the call & keep track of the calls in progress."""
+            with stats.in_flight.get_lock():
+                stats.in_flight.value += 1
+            try:
+                call_slot = _call_slot(attr, args, kwargs) if slot is not None else None
+                if call_slot is not None and call_slot != slot:
+                    raise ValueError("Worker for slot {} can't serve {} on slot {}"
+                                     .format(slot, name, call_slot))
+                return attr(*args, **kwargs)
+            except Exception:
+                with stats.errors.get_lock():
+                    stats.errors.value += 1
+                raise
+            finally:
+                with stats.in_flight.get_lock():
+                    stats.in_flight.value -= 1
+                with stats.calls.get_lock():
+                    stats.calls.value += 1
+
+        metered.__wrapped__ = attr
+        return metered
+
+
+def worker_launch(service, ip, port, config, stats, library=None, slot=None):
+    """
+    Target for a worker process.
+
+    :param service: Service class to run, should be a :py:class:`MeteredPycryptokiService`
+    :param ip: IP address to listen on
+    :param port: Port of this worker
+    :param config: RPyC protocol config
+    :param WorkerStats stats: Counters shared with the supervisor
+    :param str library: PKCS11 library this worker loads, if not the default one.
+    :param int slot: Slot this worker owns; calls for other slots are rejected.
+    """
+    if library is not None:
+        defaults.CHRYSTOKI_DLL_FILE = library
+    service.stats = stats
+    service.slot = slot
+    server_launch(service, ip, port, config)
+
+
+class Worker(object):
+    """
+    Supervisor-side handle of a worker process.
+    """
+
+    def __init__(self, port, slot=None, library=None):
+        self.port = port
+        self.slot = slot
+        self.library = library
+        self.stats = WorkerStats()
+        self.process = None
+        self.restarts = 0
+        self.started_at = None
+        self._last_calls = 0
+        self._last_sample = None
+
+    @property
+    def name(self):
+        """Human-readable worker name."""
+        if self.library is not None:
+            return "library {}".format(self.library)
+        return "slot {}".format(self.slot)
+
+    def start(self, service, ip, config):
+        """
+        Spawn the worker process.
+        """
+        self.stats.in_flight.value = 0
+        self.process = multiprocessing.Process(target=worker_launch,
+                                               args=(service, ip, self.port, config,
+                                                     self.stats, self.library, self.slot))
+        self.process.daemon = True
+        self.process.start()
+        self.started_at = time.time()
+        LOG.info("Started worker for %s on port %s w/ PID %s", self.name, self.port,
+                 self.process.pid)
+
+    def report(self):
+        """
+        :return: dict of this worker's state & counters. ``in_flight`` is the number of
+            calls being served right now, ``throughput`` the number of calls per second
+            since the previous report (or since the worker started).
+        """
+        now = time.time()
+        calls = self.stats.calls.value
+        since = self._last_sample or self.started_at or now
+        throughput = (calls - self._last_calls) / (now - since) if now > since else 0.0
+        self._last_calls, self._last_sample = calls, now
+        return {'slot': self.slot,
+                'library': self.library,
+                'port': self.port,
+                'pid': self.process.pid if self.process else None,
+                'alive': bool(self.process and self.process.is_alive()),
+                'restarts': self.restarts,
+                'calls': calls,
+                'errors': self.stats.errors.value,
+                'in_flight': self.stats.in_flight.value,
+                'throughput': round(throughput, 2)}
+
+
+class SupervisorService(rpyc.Service):
+    """
+    Service exposed by the supervisor on the main daemon port, used by clients to find
+    the worker that owns a slot or library.
+    """
+    supervisor = None
+
+    def exposed_worker_address(self, slot=None, library=None):
+        """
+        :return: (ip, port) of the worker owning ``slot`` or ``library``.
+        """
+        worker = self.supervisor.worker_for(slot=slot, library=library)
+        return self.supervisor.ip, worker.port
+
+    def exposed_stats(self):
+        """
+        :return: JSON list of per-worker stats, see :py:meth:`Worker.report`.
+        """
+        return json.dumps(self.supervisor.stats())
+
+
+class PycryptokiSupervisor(object):
+    """
+    Spawn one daemon worker per slot or per library, restart crashed workers and report
+    per-worker stats.
+
+    :param str ip: IP address to listen on.
+    :param int port: Supervisor port. Workers use the following ports.
+    :param dict config: RPyC protocol config for the workers.
+    :param list slots: Slots to create a worker for.
+    :param list libraries: PKCS11 libraries to create a worker for.
+    :param service: Service class run by the workers.
+    """
+
+    def __init__(self, ip, port, config, slots=None, libraries=None,
+                 service=MeteredPycryptokiService):
+        if not slots and not libraries:
+            raise ValueError("Supervisor needs at least one slot or library")
+        self.ip = ip
+        self.port = port
+        self.config = config
+        self.service = service
+        self.workers = ([Worker(port + 1 + index, slot=slot)
+                         for index, slot in enumerate(slots or [])] +
+                        [Worker(port + 1 + len(slots or []) + index, library=library)
+                         for index, library in enumerate(libraries or [])])
+        self._lock = threading.Lock()
+        self._server = None
+        self._stopping = False
+
+    def worker_for(self, slot=None, library=None):
+        """
+        :return: The :py:class:`Worker` owning the slot or library.
+        :raises LookupError: If no worker owns it.
+        """
+        for worker in self.workers:
+            if (library is not None and worker.library == library) or \
+                    (library is None and worker.slot == slot):
+                return worker
+        raise LookupError("No worker for slot={} library={}".format(slot, library))
+
+    def start(self):
+        """
+        Spawn all workers & start the supervisor's own RPyC service in a thread.
+        """
+        for worker in self.workers:
+            worker.start(self.service, self.ip, self.config)
+
+        SupervisorService.supervisor = self
+        self._server = ThreadedServer(SupervisorService, hostname=self.ip, port=self.port,
+                                      protocol_config={'allow_public_attrs': True})
+        thread = threading.Thread(target=self._server.start)
+        thread.daemon = True
+        thread.start()
+
+    def check_workers(self):
+        """
+        Restart any worker that died.
+        """
+        if self._stopping:
+            return
+        for worker in self.workers:
+            if worker.process.is_alive():
+                continue
+            LOG.error("Worker for %s died w/ exit code %s! Possible segfault",
+                      worker.name, worker.process.exitcode)
+            worker.restarts += 1
+            worker.start(self.service, self.ip, self.config)
+
+    def stats(self):
+        """
+        :return: list of per-worker stats dictionaries.
+        """
+        with self._lock:
+            return [worker.report() for worker in self.workers]
+
+    def run(self, poll_interval=0.5, stats_interval=60):
+        """
+        Start everything and supervise the workers until interrupted.
+
+        :param float poll_interval: How often to check for dead workers, in seconds.
+        :param float stats_interval: How often to log worker stats, in seconds. 0 disables.
+        """
+        self.start()
+        last_report = time.time()
+        try:
+            while True:
+                self.check_workers()
+                if stats_interval and time.time() - last_report >= stats_interval:
+                    for report in self.stats():
+                        LOG.info("Worker stats: %s", report)
+                    last_report = time.time()
+                time.sleep(poll_interval)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stop the supervisor service and terminate all workers.
+        """
+        self._stopping = True
+        if self._server is not None:
+            self._server.close()
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
@@ -0,0 +1,187 @@
+"""
+Binary framing used by the daemon's bulk-data endpoints.
+
+Large payloads (data to encrypt/sign, SIM blobs) are sent as a single contiguous frame
+instead of going through RPyC's default argument handling, where lists become netrefs and
+every element access is another round trip.
+
+A frame is laid out as::
+
+    | magic (4) | flags (1) | meta length (4) | payload length (8) | meta | payload |
+
+``meta`` is a small pickled dictionary (the remaining call arguments, chunk sizes of a
+multipart payload, return codes...) and ``payload`` is the raw data, zlib-compressed when it
+is larger than the compression threshold and compression actually helps.
+"""
+import inspect
+import pickle
+import struct
+import zlib
+
+from six import binary_type
+
+from ..exceptions import LunaException, unwrap_function
+
+FRAME_MAGIC = b"PKB1"
+FRAME_HEADER = struct.Struct("!4sBIQ")
+FLAG_COMPRESSED = 0x01
+
+#: Payloads larger than this (in bytes) are compressed, if that makes them smaller.
+COMPRESSION_THRESHOLD = 64 * 1024
+COMPRESSION_LEVEL = 1
+# Compression is skipped when a sample of the payload doesn't shrink by at least 10%
+# (random or already encrypted data), so we don't pay for compressing all of it.
+COMPRESSION_SAMPLE_SIZE = 16 * 1024
+COMPRESSION_MIN_RATIO = 0.9
+
+
+class BulkTransportException(LunaException):
+    """
+    Exception raised when a bulk-data frame can't be decoded.
+    """
+    pass
+
+
+def encode_frame(payload, meta=None, threshold=COMPRESSION_THRESHOLD):
+    """
+    Pack a payload & its metadata into a single binary frame.
+
+    :param payload: bytes, or a list/tuple of bytes (multipart data). A list is sent as one
+        contiguous buffer and split back into chunks by :py:func:`decode_frame`.
+    :param dict meta: Picklable metadata sent alongside the payload.
+    :param int threshold: Compress payloads larger than this. None disables compression.
+    :return: bytes
+    """
+    meta = dict(meta or {})
+    if payload is None:
+        payload = b""
+    elif isinstance(payload, (list, tuple)):
+        meta['chunks'] = [len(chunk) for chunk in payload]
+        payload = b"".join(payload)
+
+    flags = 0
+    if threshold is not None and len(payload) > threshold and _is_compressible(payload):
+        compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_COMPRESSED
+
+    meta_data = pickle.dumps(meta, protocol=2)
+    return b"".join([FRAME_HEADER.pack(FRAME_MAGIC, flags, len(meta_data), len(payload)),
+                     meta_data,
+                     payload])
+
+
+def _is_compressible(payload):
+    """
+    Check whether a sample from the start of the payload compresses well enough.
+
+    :param bytes payload: Data to check
+    :return: bool
+    """
+    sample = payload[:COMPRESSION_SAMPLE_SIZE]
+    return len(zlib.compress(sample, COMPRESSION_LEVEL)) < len(sample) * COMPRESSION_MIN_RATIO
+
+
+def decode_frame(frame):
+    """
+    Unpack a frame created by :py:func:`encode_frame`.
+
+    :param bytes frame: Binary frame
+    :return: (payload, meta) -- payload is bytes, or a list of bytes for multipart data.
+    """
+    if not isinstance(frame, binary_type) or len(frame) < FRAME_HEADER.size:
+        raise BulkTransportException("Invalid bulk frame: expected at least {} bytes"
+                                     .format(FRAME_HEADER.size))
+
+    magic, flags, meta_len, payload_len = FRAME_HEADER.unpack_from(frame)
+    if magic != FRAME_MAGIC:
+        raise BulkTransportException("Invalid bulk frame magic: {!r}".format(magic))
+    if len(frame) != FRAME_HEADER.size + meta_len + payload_len:
+        raise BulkTransportException("Truncated bulk frame: got {} bytes, expected {}"
+                                     .format(len(frame),
+                                             FRAME_HEADER.size + meta_len + payload_len))
+
+    view = memoryview(frame)
+    offset = FRAME_HEADER.size
+    meta = pickle.loads(view[offset:offset + meta_len].tobytes())
+    offset += meta_len
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(view[offset:].tobytes())
+    else:
+        payload = view[offset:].tobytes()
+
+    chunks = meta.pop('chunks', None)
+    if chunks is not None:
+        split, start = [], 0
+        for size in chunks:
+            split.append(payload[start:start + size])
+            start += size
+        payload = split
+    return payload, meta
+
+
+def encode_call(func, payload_arg, args, kwargs, threshold=COMPRESSION_THRESHOLD):
+    """
+    Encode a call to a pycryptoki function, sending ``payload_arg`` as the frame payload.
+
+    :param func: pycryptoki function that will be called on the other side; only used to
+        map positional arguments to names.
+    :param str payload_arg: Name of the argument holding the bulk data.
+    :param tuple args: Positional arguments
+    :param dict kwargs: Keyword arguments
+    :param int threshold: Compression threshold for the payload.
+    :return: bytes
+    """
+    call_args = inspect.getcallargs(unwrap_function(func), *args, **kwargs)
+    payload = call_args.pop(payload_arg)
+    return encode_frame(payload, {'kwargs': call_args,
+                                  'payload_arg': payload_arg,
+                                  'threshold': threshold}, threshold)
+
+
+def decode_call(frame):
+    """
+    Decode a frame created by :py:func:`encode_call`.
+
+    :param bytes frame: Binary frame
+    :return: (kwargs, threshold) -- the keyword arguments for the call, including the
+        payload, and the compression threshold requested for the response.
+    """
+    payload, meta = decode_frame(frame)
+    kwargs = meta['kwargs']
+    kwargs[meta['payload_arg']] = payload
+    return kwargs, meta.get('threshold', COMPRESSION_THRESHOLD)
+
+
+def encode_result(result, threshold=COMPRESSION_THRESHOLD):
+    """
+    Encode the return value of a pycryptoki function. Bytes returned either directly
+    (``_ex`` functions) or as the second half of a ``(retcode, data)`` tuple are sent as
+    the payload; anything else is pickled in the frame metadata.
+
+    :param result: Return value of the function
+    :param int threshold: Compression threshold for the payload.
+    :return: bytes
+    """
+    if isinstance(result, binary_type):
+        return encode_frame(result, {'layout': 'bytes'}, threshold)
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], binary_type):
+        return encode_frame(result[1], {'layout': 'ret_bytes', 'ret': result[0]}, threshold)
+    return encode_frame(None, {'layout': 'object', 'result': result}, threshold)
+
+
+def decode_result(frame):
+    """
+    Decode a frame created by :py:func:`encode_result`.
+
+    :param bytes frame: Binary frame
+    :return: The original return value, with plain ``bytes`` for any data.
+    """
+    payload, meta = decode_frame(frame)
+    layout = meta['layout']
+    if layout == 'bytes':
+        return payload
+    if layout == 'ret_bytes':
+        return meta['ret'], payload
+    return meta['result']
@@ -18,12 +18,14 @@ from .defines import CKR_OK
 from .exceptions import make_error_handle_function
 from .lookup_dicts import ret_vals_dictionary
 from .mechanism import parse_mechanism
+from .tracing import traced
 
 MAX_BUFFER = 0xffff
 
 LOG = logging.getLogger(__name__)
 
 
+@traced
 def c_encrypt(h_session, h_key, data, mechanism, output_buffer=None):
     """Encrypts data with a given key and encryption flavor
     encryption flavors
@@ -129,6 +131,7 @@ def _get_string_from_list(list_of_strings):
     return b"".join(list_of_strings)
 
 
+@traced
 def c_decrypt(h_session, h_key, encrypted_data, mechanism, output_buffer=None):
     """Decrypt given data with the given key and mechanism.
 
@@ -252,18 +255,8 @@ def do_multipart_operation(h_session,
     error = None
 
     for index, chunk in enumerate(input_data_list):
-        if output_buffer:
-            out_data_len = CK_ULONG(output_buffer[index])
-            out_data = cast(create_string_buffer(b'', output_buffer[index]), CK_BYTE_PTR)
-        else:
-            out_data_len = CK_ULONG()
-            out_data = None
-        data_chunk, data_chunk_len = to_byte_array(from_bytestring(chunk))
-        data_chunk = cast(data_chunk, POINTER(c_ubyte))
-
-        ret = c_update_function(h_session,
-                                data_chunk, data_chunk_len,
-                                out_data, byref(out_data_len))
+        ret, out_data = _multipart_update(h_session, c_update_function, chunk,
+                                          output_buffer[index] if output_buffer else None)
         if ret != CKR_OK:
             LOG.debug("%s call on chunk %.20s (%s/%s) Failed w/ ret %s (%s)",
                       c_update_function.__name__,
@@ -272,63 +265,210 @@ def do_multipart_operation(h_session,
             error = ret
             break
 
-        if not output_buffer:
-            # Need a second call to actually get the data.
-            LOG.debug("Creating cipher data buffer of size %s", out_data_len.value)
-            out_data = create_string_buffer(b'', out_data_len.value)
-            ret = c_update_function(h_session,
-                                    data_chunk, data_chunk_len,
-                                    cast(out_data, CK_BYTE_PTR), byref(out_data_len))
-            if ret != CKR_OK:
-                LOG.debug("%s call on chunk %.20s (%s/%s) Failed w/ ret %s (%s)",
-                          c_update_function.__name__,
-                          chunk, index + 1, len(input_data_list),
-                          ret_vals_dictionary.get(ret, "Unknown retcode"), str(hex(ret)))
-                error = ret
-                break
-
-        # Get the output
-        python_data.append(string_at(out_data, out_data_len.value))
+        python_data.append(out_data)
 
     if error:
-        # Make sure we finalize the operation -- don't want to leave any operations active.
-        ret = c_finalize_function(h_session,
-                                  cast(create_string_buffer(b'', MAX_BUFFER), CK_BYTE_PTR),
-                                  CK_ULONG(MAX_BUFFER))
-        LOG.debug("%s call after a %s failure returned: %s (%s)",
-                  c_finalize_function.__name__,
-                  c_update_function.__name__,
-                  ret_vals_dictionary.get(ret, "Unknown retcode"), str(hex(ret)))
+        _abort_multipart(h_session, c_update_function, c_finalize_function)
         return error, b"".join(python_data)
 
+    ret, fin_out_data = _multipart_final(h_session, c_finalize_function,
+                                         max(output_buffer) if output_buffer else None)
+    python_data.append(fin_out_data)
+    return ret, b"".join(python_data)
+
+
+def _multipart_update(h_session, c_update_function, chunk, output_buffer=None):
+    """
+    Call a C_<NAME>Update function on a single chunk of data.
+
+    :param int h_session: Session handle
+    :param c_update_function: C_<NAME>Update function to call.
+    :param bytes chunk: Data to pass to the update function.
+    :param int output_buffer: Size of the output buffer to use. By default will query with a
+        NULL pointer buffer to get the required size.
+    :return: (retcode, output bytes)
+    """
     if output_buffer:
-        fin_out_data_len = CK_ULONG(max(output_buffer))
+        out_data_len = CK_ULONG(output_buffer)
+        out_data = cast(create_string_buffer(b'', output_buffer), CK_BYTE_PTR)
+    else:
+        out_data_len = CK_ULONG()
+        out_data = None
+    data_chunk, data_chunk_len = to_byte_array(from_bytestring(chunk))
+    data_chunk = cast(data_chunk, POINTER(c_ubyte))
+
+    ret = c_update_function(h_session,
+                            data_chunk, data_chunk_len,
+                            out_data, byref(out_data_len))
+    if ret != CKR_OK:
+        return ret, b""
+
+    if not output_buffer:
+        # Need a second call to actually get the data.
+        LOG.debug("Creating cipher data buffer of size %s", out_data_len.value)
+        out_data = create_string_buffer(b'', out_data_len.value)
+        ret = c_update_function(h_session,
+                                data_chunk, data_chunk_len,
+                                cast(out_data, CK_BYTE_PTR), byref(out_data_len))
+        if ret != CKR_OK:
+            return ret, b""
+
+    return ret, string_at(out_data, out_data_len.value)
+
+
+def _multipart_final(h_session, c_finalize_function, output_buffer=None):
+    """
+    Call a C_<NAME>Final function to finish a multipart operation.
+
+    :param int h_session: Session handle
+    :param c_finalize_function: C_<NAME>Final function to call.
+    :param int output_buffer: Size of the output buffer to use. By default will query with a
+        NULL pointer buffer to get the required size.
+    :return: (retcode, output bytes)
+    """
+    if output_buffer:
+        fin_out_data_len = CK_ULONG(output_buffer)
         fin_out_data = create_string_buffer(b"", fin_out_data_len.value)
 
         ret = c_finalize_function(h_session, cast(fin_out_data, CK_BYTE_PTR),
                                   byref(fin_out_data_len))
         if ret != CKR_OK:
-            return ret, b"".join(python_data)
+            return ret, b""
     else:
         # Finalizing multipart decrypt operation
         fin_out_data_len = CK_ULONG()
         # Get buffer size for data
         ret = c_finalize_function(h_session, None, byref(fin_out_data_len))
         if ret != CKR_OK:
-            return ret, b"".join(python_data)
+            return ret, b""
 
         fin_out_data = create_string_buffer(b"", fin_out_data_len.value)
         output = cast(fin_out_data, CK_BYTE_PTR)
         ret = c_finalize_function(h_session, output, byref(fin_out_data_len))
         if ret != CKR_OK:
-            return ret, b"".join(python_data)
+            return ret, b""
 
-    if fin_out_data_len.value > 0:
-        python_data.append(string_at(fin_out_data, fin_out_data_len.value))
+    return ret, string_at(fin_out_data, fin_out_data_len.value)
 
-    return ret, b"".join(python_data)
+
+def _abort_multipart(h_session, c_update_function, c_finalize_function):
+    """
+    Finalize a multipart operation after a failure -- don't want to leave any operations active.
+
+    :param int h_session: Session handle
+    :param c_update_function: C_<NAME>Update function that failed, used for logging.
+    :param c_finalize_function: C_<NAME>Final function to call.
+    """
+    ret = c_finalize_function(h_session,
+                              cast(create_string_buffer(b'', MAX_BUFFER), CK_BYTE_PTR),
+                              CK_ULONG(MAX_BUFFER))
+    LOG.debug("%s call after a %s failure returned: %s (%s)",
+              c_finalize_function.__name__,
+              c_update_function.__name__,
+              ret_vals_dictionary.get(ret, "Unknown retcode"), str(hex(ret)))
+
+
+def c_encrypt_init(h_session, h_key, mechanism):
+    """Start a multipart encrypt operation, to be fed with :py:func:`c_encrypt_update` and
+    finished with :py:func:`c_encrypt_final`.
+
+    Use this instead of passing a list to :py:func:`c_encrypt` when the data doesn't fit in
+    memory at once.
+
+    :param int h_session: Current session
+    :param int h_key: The key handle to encrypt the data with
+    :param mechanism: See the :py:func:`~pycryptoki.mechanism.parse_mechanism` function
+        for possible values.
+    :returns: Retcode
+    """
+    LOG.debug("Starting multipart encrypt with mechanism:\n%s", _coerce_mech_to_str(mechanism))
+    mech = parse_mechanism(mechanism)
+    return C_EncryptInit(h_session, byref(mech), CK_ULONG(h_key))
+
+
+c_encrypt_init_ex = make_error_handle_function(c_encrypt_init)
+
+
+def c_encrypt_update(h_session, data, output_buffer=None):
+    """Encrypt one chunk of a multipart encrypt operation.
+
+    :param int h_session: Current session
+    :param bytes data: Chunk of data to encrypt
+    :param int output_buffer: Size of the output buffer. By default will query with a NULL
+        pointer buffer to get the required size.
+    :returns: (Retcode, Python bytestring of encrypted data)
+    :rtype: tuple
+    """
+    return _multipart_update(h_session, C_EncryptUpdate, data, output_buffer)
+
+
+c_encrypt_update_ex = make_error_handle_function(c_encrypt_update)
+
+
+def c_encrypt_final(h_session, output_buffer=None):
+    """Finish a multipart encrypt operation.
+
+    :param int h_session: Current session
+    :param int output_buffer: Size of the output buffer. By default will query with a NULL
+        pointer buffer to get the required size.
+    :returns: (Retcode, Python bytestring of the remaining encrypted data)
+    :rtype: tuple
+    """
+    return _multipart_final(h_session, C_EncryptFinal, output_buffer)
+
+
+c_encrypt_final_ex = make_error_handle_function(c_encrypt_final)
+
+
+def c_decrypt_init(h_session, h_key, mechanism):
+    """Start a multipart decrypt operation, to be fed with :py:func:`c_decrypt_update` and
+    finished with :py:func:`c_decrypt_final`.
+
+    :param int h_session: Current session
+    :param int h_key: The key handle to decrypt the data with
+    :param mechanism: See the :py:func:`~pycryptoki.mechanism.parse_mechanism` function
+        for possible values.
+    :returns: Retcode
+    """
+    mech = parse_mechanism(mechanism)
+    return C_DecryptInit(h_session, mech, CK_ULONG(h_key))
+
+
+c_decrypt_init_ex = make_error_handle_function(c_decrypt_init)
+
+
+def c_decrypt_update(h_session, encrypted_data, output_buffer=None):
+    """Decrypt one chunk of a multipart decrypt operation.
+
+    :param int h_session: Current session
+    :param bytes encrypted_data: Chunk of data to decrypt
+    :param int output_buffer: Size of the output buffer. By default will query with a NULL
+        pointer buffer to get the required size.
+    :returns: (Retcode, Python bytestring of decrypted data)
+    :rtype: tuple
+    """
+    return _multipart_update(h_session, C_DecryptUpdate, encrypted_data, output_buffer)
+
+
+c_decrypt_update_ex = make_error_handle_function(c_decrypt_update)
+
+
+def c_decrypt_final(h_session, output_buffer=None):
+    """Finish a multipart decrypt operation.
+
+    :param int h_session: Current session
+    :param int output_buffer: Size of the output buffer. By default will query with a NULL
+        pointer buffer to get the required size.
+    :returns: (Retcode, Python bytestring of the remaining decrypted data)
+    :rtype: tuple
+    """
+    return _multipart_final(h_session, C_DecryptFinal, output_buffer)
+
+
+c_decrypt_final_ex = make_error_handle_function(c_decrypt_final)
 
 
+@traced
 def c_wrap_key(h_session, h_wrapping_key, h_key, mechanism, output_buffer=None):
     """Wrap a key off the HSM into an encrypted data blob.
 
@@ -370,6 +510,7 @@ def c_wrap_key(h_session, h_wrapping_key, h_key, mechanism, output_buffer=None):
 c_wrap_key_ex = make_error_handle_function(c_wrap_key)
 
 
+@traced
 def c_unwrap_key(h_session, h_unwrapping_key, wrapped_key, key_template, mechanism):
     """Unwrap a key from an encrypted data blob.
 
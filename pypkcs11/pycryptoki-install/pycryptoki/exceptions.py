@@ -80,6 +80,8 @@ def make_error_handle_function(luna_function):
         check_luna_exception(ret, luna_function, args, kwargs)
         return return_data
 
+    luna_function_exception_handle.__wrapped__ = luna_function
+
     luna_function_exception_handle.__doc__ = """Executes :py:func:`{}`, and checks the
 retcode; raising an exception if the return code is not CKR_OK.
 
@@ -102,6 +104,19 @@ retcode; raising an exception if the return code is not CKR_OK.
     return luna_function_exception_handle
 
 
+def unwrap_function(func):
+    """
+    Follow the ``__wrapped__`` chain of a decorated pycryptoki function (``_ex`` exception
+    handling, tracing...) back to the original function, to inspect its signature.
+
+    :param func: Function
+    :return: The innermost function
+    """
+    while getattr(func, "__wrapped__", None) is not None:
+        func = func.__wrapped__
+    return func
+
+
 def check_luna_exception(ret, luna_function, args, kwargs):
     """
     Check the return code from cryptoki.dll, and if it's non-zero raise an
@@ -112,7 +127,7 @@ def check_luna_exception(ret, luna_function, args, kwargs):
     :param args: Arguments passed to the pycryptoki function.
     """
     log_list = []
-    all_args = inspect.getcallargs(luna_function, *args, **kwargs)
+    all_args = inspect.getcallargs(unwrap_function(luna_function), *args, **kwargs)
     for key, value in all_args.items():
         if "template" in key and isinstance(value, dict):
             # Means it's a template, so let's perform a lookup on all of the objects within
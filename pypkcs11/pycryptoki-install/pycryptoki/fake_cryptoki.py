@@ -0,0 +1,597 @@
+"""
+In-process fake of the PKCS11 library, for running pycryptoki without an HSM.
+
+:py:class:`FakeCryptoki` implements the library functions as ctypes callbacks built from
+the prototypes in :py:mod:`pycryptoki.cryptoki`, and plugs into
+:py:class:`~pycryptoki.cryptoki_helpers.CryptokiDLLSingleton` in place of the loaded
+library, so calls go through the same ctypes conversions as with a real one::
+
+    from pycryptoki.fake_cryptoki import FakeCryptoki
+
+    with FakeCryptoki(latency=0.0005):
+        c_initialize_ex()
+        h_session = c_open_session_ex(1)
+        ...
+
+Supported: initialization, slot/token info, sessions & login, objects (create, generate,
+destroy, find, get/set attributes), random, digest (real hashes), encrypt/decrypt (a toy,
+length-preserving keystream cipher: any mechanism, no padding) and sign/verify (HMAC-SHA256
+over the key's secret, whatever the mechanism). Every other function returns
+``CKR_FUNCTION_NOT_SUPPORTED``. It is not a security boundary in any way -- only meant for
+tests & benchmarks.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import struct
+import threading
+import time
+from collections import Counter
+from ctypes import CFUNCTYPE, addressof, c_void_p, sizeof, string_at, memmove, _CFuncPtr
+
+from . import cryptoki
+from .cryptoki import CK_ULONG
+from .cryptoki_helpers import CryptokiDLLSingleton, CRYSTOKI_CONF_DLL
+from .defines import CKR_OK, CKR_BUFFER_TOO_SMALL, CKR_OPERATION_ACTIVE, \
+    CKR_OPERATION_NOT_INITIALIZED, CKR_SESSION_HANDLE_INVALID, CKR_OBJECT_HANDLE_INVALID, \
+    CKR_SLOT_ID_INVALID, CKR_MECHANISM_INVALID, CKR_SIGNATURE_INVALID, \
+    CKR_FUNCTION_NOT_SUPPORTED, CKR_GENERAL_ERROR, CKR_CRYPTOKI_NOT_INITIALIZED, \
+    CKR_CRYPTOKI_ALREADY_INITIALIZED, CKR_PIN_INCORRECT, CKR_USER_ALREADY_LOGGED_IN, \
+    CKR_USER_NOT_LOGGED_IN, CKR_ATTRIBUTE_TYPE_INVALID, CKR_KEY_HANDLE_INVALID, \
+    CKF_TOKEN_INITIALIZED, CKF_USER_PIN_INITIALIZED, CKF_RNG, CKF_LOGIN_REQUIRED, \
+    CKF_TOKEN_PRESENT, CKF_RW_SESSION, CKS_RW_PUBLIC_SESSION, CKS_RO_PUBLIC_SESSION, \
+    CKS_RW_USER_FUNCTIONS, CKS_RW_SO_FUNCTIONS, CKU_SO, CKM_MD5, CKM_SHA_1, CKM_SHA224, \
+    CKM_SHA256, CKM_SHA384, CKM_SHA512, CKA_CLASS, CKA_TOKEN, CKA_VALUE_LEN, CKA_VALUE, \
+    CKA_LOCAL, CKO_SECRET_KEY, CKO_PUBLIC_KEY, CKO_PRIVATE_KEY
+
+LOG = logging.getLogger(__name__)
+
+CK_UNAVAILABLE_INFORMATION = CK_ULONG(-1).value
+DEFAULT_KEY_LENGTH = 32
+
+DIGESTS = {CKM_MD5: "md5",
+           CKM_SHA_1: "sha1",
+           CKM_SHA224: "sha224",
+           CKM_SHA256: "sha256",
+           CKM_SHA384: "sha384",
+           CKM_SHA512: "sha512"}
+
+_TRUE = b"\x01"
+
+
+class _CryptokiError(Exception):
+    """Raised by function implementations to return an error code."""
+
+    def __init__(self, ret):
+        super(_CryptokiError, self).__init__(ret)
+        self.ret = ret
+
+
+def _ulong_bytes(value):
+    """:return: ``value`` encoded as a CK_ULONG attribute value."""
+    value = CK_ULONG(value)
+    return string_at(addressof(value), sizeof(value))
+
+
+def _set_text(structure, field, text):
+    """Set a blank padded character array field of a structure."""
+    size = sizeof(getattr(structure, field))
+    memmove(addressof(structure) + getattr(type(structure), field).offset,
+            text.ljust(size)[:size], size)
+
+
+def _read(pointer, length):
+    """:return: ``length`` bytes at ``pointer``, b"" for a NULL pointer."""
+    if not pointer or not length:
+        return b""
+    return string_at(pointer, length)
+
+
+def _write_output(data, out_pointer, out_length):
+    """
+    Standard PKCS11 output convention: with a NULL buffer, only return the size needed.
+
+    :return: True if the data was written, False for a size query.
+    """
+    if not out_pointer:
+        out_length[0] = len(data)
+        return False
+    if out_length[0] < len(data):
+        out_length[0] = len(data)
+        raise _CryptokiError(CKR_BUFFER_TOO_SMALL)
+    memmove(out_pointer, data, len(data))
+    out_length[0] = len(data)
+    return True
+
+
+def _read_template(template, count):
+    """:return: dict of attribute type to raw value of a CK_ATTRIBUTE array."""
+    return {template[index].type: _read(template[index].pValue, template[index].usValueLen)
+            for index in range(count)}
+
+
+def _keystream(secret, iv, offset, length):
+    """:return: ``length`` bytes of the toy cipher's keystream, starting at ``offset``."""
+    block_size = hashlib.sha256().digest_size
+    first, stream = offset // block_size, b""
+    for counter in range(first, (offset + length) // block_size + 1):
+        stream += hashlib.sha256(secret + iv + struct.pack(">Q", counter)).digest()
+    start = offset - first * block_size
+    return stream[start:start + length]
+
+
+def _xor(data, stream):
+    return bytes(bytearray(a ^ b for a, b in zip(bytearray(data), bytearray(stream))))
+
+
+class _Operation(object):
+    """An active crypto operation of a session."""
+
+    def __init__(self, mechanism, secret=b"", parameter=b""):
+        self.mechanism = mechanism
+        self.secret = secret
+        self.parameter = parameter
+        self.offset = 0
+        self.state = None
+
+
+class FakeCryptoki(object):
+    """
+    Fake PKCS11 library.
+
+    :param slots: Slot IDs with a token present.
+    :param float latency: Artificial delay added to every call, in seconds.
+    :param dict latencies: Per-function delays (by ``C_*`` name), overriding ``latency``.
+    :param bytes password: PIN expected by C_Login, any PIN is accepted if None.
+    :param str label: Token label.
+    """
+
+    def __init__(self, slots=(1,), latency=0.0, latencies=None, password=None,
+                 label="FakeToken"):
+        self.slots = list(slots)
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.password = password
+        self.label = label
+        #: Number of calls, by function name.
+        self.call_counts = Counter()
+        self._functions = {}
+        self._lock = threading.RLock()
+        self._previous = None
+        self.reset()
+
+    def reset(self):
+        """Drop all sessions & objects, back to an uninitialized library."""
+        with self._lock:
+            self.initialized = False
+            self.sessions = {}
+            self.objects = {}
+            self.logged_in = {}
+            self._next_handle = 1
+
+    # Plumbing
+
+    def install(self):
+        """
+        Make :py:class:`~pycryptoki.cryptoki_helpers.CryptokiDLLSingleton` return this library.
+        """
+        self._previous = CryptokiDLLSingleton._instance_map.get(CRYSTOKI_CONF_DLL)
+        singleton = object.__new__(CryptokiDLLSingleton)
+        singleton.dll_path = "<fake>"
+        singleton.loaded_dll_library = self
+        CryptokiDLLSingleton._instance_map[CRYSTOKI_CONF_DLL] = singleton
+        return self
+
+    def uninstall(self):
+        """Restore the library loaded before :py:meth:`install`."""
+        if self._previous is None:
+            CryptokiDLLSingleton._instance_map.pop(CRYSTOKI_CONF_DLL, None)
+        else:
+            CryptokiDLLSingleton._instance_map[CRYSTOKI_CONF_DLL] = self._previous
+        self._previous = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uninstall()
+
+    def __getattr__(self, name):
+        """Look up a library function, like ``CDLL.<name>``."""
+        if name.startswith("_"):
+            raise AttributeError(name)
+        function = self._functions.get(name)
+        if function is None:
+            prototype = getattr(cryptoki, name, None)
+            if prototype is None or not hasattr(prototype, "argtypes"):
+                raise AttributeError("fake library has no function '{}'".format(name))
+            function = self._functions[name] = self._make_function(name, prototype)
+        return function
+
+    def _make_function(self, name, prototype):
+        """Build a ctypes callback for ``name`` with the argument types of its prototype."""
+        implementation = getattr(self, "_" + name, None)
+        # Function pointer arguments (C_OpenSession's notify) aren't used, take them as is.
+        argtypes = [c_void_p if isinstance(argtype, type) and issubclass(argtype, _CFuncPtr)
+                    else argtype for argtype in prototype.argtypes or []]
+
+        def call(*args):
+            delay = self.latencies.get(name, self.latency)
+            if delay:
+                time.sleep(delay)
+            with self._lock:
+                self.call_counts[name] += 1
+                if implementation is None:
+                    return CKR_FUNCTION_NOT_SUPPORTED
+                try:
+                    if name not in ("C_Initialize", "C_GetFunctionList") and \
+                            not self.initialized:
+                        raise _CryptokiError(CKR_CRYPTOKI_NOT_INITIALIZED)
+                    implementation(*args)
+                    return CKR_OK
+                except _CryptokiError as error:
+                    return error.ret
+                except Exception:
+                    LOG.exception("Fake %s failed", name)
+                    return CKR_GENERAL_ERROR
+
+        function = CFUNCTYPE(prototype.restype or CK_ULONG, *argtypes)(call)
+        function.__name__ = name
+        return function
+
+    def _new_handle(self):
+        handle, self._next_handle = self._next_handle, self._next_handle + 1
+        return handle
+
+    def _session(self, h_session):
+        session = self.sessions.get(h_session)
+        if session is None:
+            raise _CryptokiError(CKR_SESSION_HANDLE_INVALID)
+        return session
+
+    def _object(self, h_object, ret=CKR_OBJECT_HANDLE_INVALID):
+        obj = self.objects.get(h_object)
+        if obj is None:
+            raise _CryptokiError(ret)
+        return obj
+
+    def _add_object(self, h_session, attributes, secret=b""):
+        handle = self._new_handle()
+        self.objects[handle] = {'attributes': attributes,
+                                'secret': secret,
+                                'session': None if attributes.get(CKA_TOKEN) == _TRUE
+                                else h_session}
+        return handle
+
+    def _start(self, h_session, kind, mechanism, h_key=None):
+        """Start an operation of the given kind on a session."""
+        session = self._session(h_session)
+        if kind in session['operations']:
+            raise _CryptokiError(CKR_OPERATION_ACTIVE)
+        secret = self._object(h_key, CKR_KEY_HANDLE_INVALID)['secret'] \
+            if h_key is not None else b""
+        mechanism = mechanism.contents
+        operation = _Operation(mechanism.mechanism, secret,
+                               _read(mechanism.pParameter, mechanism.usParameterLen))
+        session['operations'][kind] = operation
+        return operation
+
+    def _operation(self, h_session, kind):
+        operation = self._session(h_session)['operations'].get(kind)
+        if operation is None:
+            raise _CryptokiError(CKR_OPERATION_NOT_INITIALIZED)
+        return operation
+
+    def _finish(self, h_session, kind):
+        self._session(h_session)['operations'].pop(kind, None)
+
+    # General purpose & slots
+
+    def _C_Initialize(self, init_args):
+        if self.initialized:
+            raise _CryptokiError(CKR_CRYPTOKI_ALREADY_INITIALIZED)
+        self.initialized = True
+
+    def _C_Finalize(self, reserved):
+        self.reset()
+
+    def _C_GetInfo(self, info):
+        info = info.contents
+        info.cryptokiVersion.major, info.cryptokiVersion.minor = 2, 20
+        _set_text(info, "manufacturerID", b"pycryptoki")
+        _set_text(info, "libraryDescription", b"Fake cryptoki")
+
+    def _C_GetSlotList(self, token_present, slot_list, count):
+        if slot_list:
+            if count[0] < len(self.slots):
+                count[0] = len(self.slots)
+                raise _CryptokiError(CKR_BUFFER_TOO_SMALL)
+            for index, slot in enumerate(self.slots):
+                slot_list[index] = slot
+        count[0] = len(self.slots)
+
+    def _check_slot(self, slot):
+        if slot not in self.slots:
+            raise _CryptokiError(CKR_SLOT_ID_INVALID)
+
+    def _C_GetSlotInfo(self, slot, info):
+        self._check_slot(slot)
+        info = info.contents
+        _set_text(info, "slotDescription", b"Fake slot")
+        _set_text(info, "manufacturerID", b"pycryptoki")
+        info.flags = CKF_TOKEN_PRESENT
+
+    def _C_GetTokenInfo(self, slot, info):
+        self._check_slot(slot)
+        sessions = [session for session in self.sessions.values() if session['slot'] == slot]
+        info = info.contents
+        _set_text(info, "label", self.label.encode("ascii"))
+        _set_text(info, "manufacturerID", b"pycryptoki")
+        _set_text(info, "model", b"Fake")
+        _set_text(info, "serialNumber", str(slot).encode("ascii").rjust(16, b"0"))
+        info.flags = CKF_TOKEN_INITIALIZED | CKF_USER_PIN_INITIALIZED | CKF_RNG | \
+            CKF_LOGIN_REQUIRED
+        info.usMaxSessionCount = info.usMaxRwSessionCount = CK_UNAVAILABLE_INFORMATION
+        info.usSessionCount = len(sessions)
+        info.usRwSessionCount = len([session for session in sessions
+                                     if session['flags'] & CKF_RW_SESSION])
+        info.usMaxPinLen, info.usMinPinLen = 255, 1
+
+    # Sessions
+
+    def _C_OpenSession(self, slot, flags, application, notify, h_session):
+        self._check_slot(slot)
+        handle = self._new_handle()
+        self.sessions[handle] = {'slot': slot, 'flags': flags, 'operations': {}, 'find': None}
+        h_session[0] = handle
+
+    def _C_CloseSession(self, h_session):
+        slot = self._session(h_session)['slot']
+        del self.sessions[h_session]
+        for handle in [handle for handle, obj in self.objects.items()
+                       if obj['session'] == h_session]:
+            del self.objects[handle]
+        if not any(session['slot'] == slot for session in self.sessions.values()):
+            self.logged_in.pop(slot, None)
+
+    def _C_CloseAllSessions(self, slot):
+        self._check_slot(slot)
+        for handle in [handle for handle, session in self.sessions.items()
+                       if session['slot'] == slot]:
+            self._C_CloseSession(handle)
+
+    def _C_GetSessionInfo(self, h_session, info):
+        session = self._session(h_session)
+        user = self.logged_in.get(session['slot'])
+        info = info.contents
+        info.slotID = session['slot']
+        info.flags = session['flags']
+        if user is None:
+            info.state = CKS_RW_PUBLIC_SESSION if session['flags'] & CKF_RW_SESSION \
+                else CKS_RO_PUBLIC_SESSION
+        else:
+            info.state = CKS_RW_SO_FUNCTIONS if user == CKU_SO else CKS_RW_USER_FUNCTIONS
+
+    def _C_Login(self, h_session, user_type, pin, pin_length):
+        slot = self._session(h_session)['slot']
+        if slot in self.logged_in:
+            raise _CryptokiError(CKR_USER_ALREADY_LOGGED_IN)
+        if self.password is not None and _read(pin, pin_length) != self.password:
+            raise _CryptokiError(CKR_PIN_INCORRECT)
+        self.logged_in[slot] = user_type
+
+    def _C_Logout(self, h_session):
+        if self.logged_in.pop(self._session(h_session)['slot'], None) is None:
+            raise _CryptokiError(CKR_USER_NOT_LOGGED_IN)
+
+    # Objects
+
+    def _C_CreateObject(self, h_session, template, count, h_object):
+        self._session(h_session)
+        attributes = _read_template(template, count)
+        h_object[0] = self._add_object(h_session, attributes, attributes.get(CKA_VALUE, b""))
+
+    def _C_DestroyObject(self, h_session, h_object):
+        self._session(h_session)
+        self._object(h_object)
+        del self.objects[h_object]
+
+    def _C_GenerateKey(self, h_session, mechanism, template, count, h_key):
+        self._session(h_session)
+        attributes = _read_template(template, count)
+        length = DEFAULT_KEY_LENGTH
+        if len(attributes.get(CKA_VALUE_LEN, b"")) == sizeof(CK_ULONG):
+            length = CK_ULONG.from_buffer_copy(attributes[CKA_VALUE_LEN]).value
+        attributes.setdefault(CKA_CLASS, _ulong_bytes(CKO_SECRET_KEY))
+        attributes[CKA_LOCAL] = _TRUE
+        h_key[0] = self._add_object(h_session, attributes, os.urandom(length))
+
+    def _C_GenerateKeyPair(self, h_session, mechanism, public_template, public_count,
+                           private_template, private_count, h_public, h_private):
+        self._session(h_session)
+        secret = os.urandom(DEFAULT_KEY_LENGTH)
+        for template, count, key_class, handle in (
+                (public_template, public_count, CKO_PUBLIC_KEY, h_public),
+                (private_template, private_count, CKO_PRIVATE_KEY, h_private)):
+            attributes = _read_template(template, count)
+            attributes[CKA_CLASS] = _ulong_bytes(key_class)
+            attributes[CKA_LOCAL] = _TRUE
+            handle[0] = self._add_object(h_session, attributes, secret)
+
+    def _C_GetAttributeValue(self, h_session, h_object, template, count):
+        self._session(h_session)
+        attributes = self._object(h_object)['attributes']
+        ret = CKR_OK
+        for index in range(count):
+            attribute = template[index]
+            value = attributes.get(attribute.type)
+            if value is None:
+                attribute.usValueLen = CK_UNAVAILABLE_INFORMATION
+                ret = CKR_ATTRIBUTE_TYPE_INVALID
+            elif not attribute.pValue:
+                attribute.usValueLen = len(value)
+            elif attribute.usValueLen < len(value):
+                attribute.usValueLen = CK_UNAVAILABLE_INFORMATION
+                ret = ret or CKR_BUFFER_TOO_SMALL
+            else:
+                memmove(attribute.pValue, value, len(value))
+                attribute.usValueLen = len(value)
+        if ret != CKR_OK:
+            raise _CryptokiError(ret)
+
+    def _C_SetAttributeValue(self, h_session, h_object, template, count):
+        self._session(h_session)
+        self._object(h_object)['attributes'].update(_read_template(template, count))
+
+    def _C_FindObjectsInit(self, h_session, template, count):
+        session = self._session(h_session)
+        if session['find'] is not None:
+            raise _CryptokiError(CKR_OPERATION_ACTIVE)
+        wanted = _read_template(template, count)
+        session['find'] = [handle for handle, obj in sorted(self.objects.items())
+                           if obj['session'] in (None, h_session) and
+                           all(obj['attributes'].get(key) == value
+                               for key, value in wanted.items())]
+
+    def _C_FindObjects(self, h_session, handles, max_count, count):
+        session = self._session(h_session)
+        if session['find'] is None:
+            raise _CryptokiError(CKR_OPERATION_NOT_INITIALIZED)
+        found, session['find'] = session['find'][:max_count], session['find'][max_count:]
+        for index, handle in enumerate(found):
+            handles[index] = handle
+        count[0] = len(found)
+
+    def _C_FindObjectsFinal(self, h_session):
+        session = self._session(h_session)
+        if session['find'] is None:
+            raise _CryptokiError(CKR_OPERATION_NOT_INITIALIZED)
+        session['find'] = None
+
+    # Random & digest
+
+    def _C_GenerateRandom(self, h_session, data, length):
+        self._session(h_session)
+        memmove(data, os.urandom(length), length)
+
+    def _C_SeedRandom(self, h_session, seed, length):
+        self._session(h_session)
+
+    def _C_DigestInit(self, h_session, mechanism):
+        name = DIGESTS.get(mechanism.contents.mechanism)
+        if name is None:
+            raise _CryptokiError(CKR_MECHANISM_INVALID)
+        self._start(h_session, 'digest', mechanism).state = hashlib.new(name)
+
+    def _C_Digest(self, h_session, data, length, digest, digest_length):
+        operation = self._operation(h_session, 'digest')
+        state = operation.state.copy()
+        state.update(_read(data, length))
+        if _write_output(state.digest(), digest, digest_length):
+            self._finish(h_session, 'digest')
+
+    def _C_DigestUpdate(self, h_session, data, length):
+        self._operation(h_session, 'digest').state.update(_read(data, length))
+
+    def _C_DigestFinal(self, h_session, digest, digest_length):
+        operation = self._operation(h_session, 'digest')
+        if _write_output(operation.state.digest(), digest, digest_length):
+            self._finish(h_session, 'digest')
+
+    # Encrypt & decrypt, with the toy keystream cipher
+
+    def _cipher(self, operation, data):
+        return _xor(data, _keystream(operation.secret, operation.parameter, operation.offset,
+                                     len(data)))
+
+    def _crypt_init(self, kind, h_session, mechanism, h_key):
+        self._start(h_session, kind, mechanism, h_key)
+
+    def _crypt(self, kind, h_session, data, length, output, output_length):
+        operation = self._operation(h_session, kind)
+        if _write_output(self._cipher(operation, _read(data, length)), output, output_length):
+            self._finish(h_session, kind)
+
+    def _crypt_update(self, kind, h_session, data, length, output, output_length):
+        operation = self._operation(h_session, kind)
+        data = _read(data, length)
+        if _write_output(self._cipher(operation, data), output, output_length):
+            operation.offset += len(data)
+
+    def _crypt_final(self, kind, h_session, output, output_length):
+        self._operation(h_session, kind)
+        if _write_output(b"", output, output_length):
+            self._finish(h_session, kind)
+
+    def _C_EncryptInit(self, *args):
+        self._crypt_init('encrypt', *args)
+
+    def _C_Encrypt(self, *args):
+        self._crypt('encrypt', *args)
+
+    def _C_EncryptUpdate(self, *args):
+        self._crypt_update('encrypt', *args)
+
+    def _C_EncryptFinal(self, *args):
+        self._crypt_final('encrypt', *args)
+
+    def _C_DecryptInit(self, *args):
+        self._crypt_init('decrypt', *args)
+
+    def _C_Decrypt(self, *args):
+        self._crypt('decrypt', *args)
+
+    def _C_DecryptUpdate(self, *args):
+        self._crypt_update('decrypt', *args)
+
+    def _C_DecryptFinal(self, *args):
+        self._crypt_final('decrypt', *args)
+
+    # Sign & verify, with HMAC-SHA256
+
+    def _mac_init(self, kind, h_session, mechanism, h_key):
+        operation = self._start(h_session, kind, mechanism, h_key)
+        operation.state = hmac.new(operation.secret, digestmod=hashlib.sha256)
+
+    def _mac(self, operation, data=b""):
+        state = operation.state.copy()
+        state.update(data)
+        return state.digest()
+
+    def _C_SignInit(self, *args):
+        self._mac_init('sign', *args)
+
+    def _C_Sign(self, h_session, data, length, signature, signature_length):
+        operation = self._operation(h_session, 'sign')
+        if _write_output(self._mac(operation, _read(data, length)), signature,
+                         signature_length):
+            self._finish(h_session, 'sign')
+
+    def _C_SignUpdate(self, h_session, data, length):
+        self._operation(h_session, 'sign').state.update(_read(data, length))
+
+    def _C_SignFinal(self, h_session, signature, signature_length):
+        operation = self._operation(h_session, 'sign')
+        if _write_output(self._mac(operation), signature, signature_length):
+            self._finish(h_session, 'sign')
+
+    def _C_VerifyInit(self, *args):
+        self._mac_init('verify', *args)
+
+    def _verify(self, h_session, expected, signature, signature_length):
+        self._finish(h_session, 'verify')
+        if not hmac.compare_digest(expected, _read(signature, signature_length)):
+            raise _CryptokiError(CKR_SIGNATURE_INVALID)
+
+    def _C_Verify(self, h_session, data, length, signature, signature_length):
+        operation = self._operation(h_session, 'verify')
+        self._verify(h_session, self._mac(operation, _read(data, length)), signature,
+                     signature_length)
+
+    def _C_VerifyUpdate(self, h_session, data, length):
+        self._operation(h_session, 'verify').state.update(_read(data, length))
+
+    def _C_VerifyFinal(self, h_session, signature, signature_length):
+        operation = self._operation(h_session, 'verify')
+        self._verify(h_session, self._mac(operation), signature, signature_length)
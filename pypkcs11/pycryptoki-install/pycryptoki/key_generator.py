@@ -12,8 +12,10 @@ from .default_templates import CKM_DES_KEY_GEN_TEMP, \
 from .defines import CKM_DES_KEY_GEN, CKM_RSA_PKCS_KEY_PAIR_GEN
 from .mechanism import parse_mechanism
 from .exceptions import make_error_handle_function
+from .tracing import traced
 
 
+@traced
 def c_destroy_object(h_session, h_object_value):
     """Deletes the object corresponsing to the passed in object handle
 
@@ -52,6 +54,7 @@ def c_copy_object(h_session, h_object, template=None):
 c_copy_object_ex = make_error_handle_function(c_copy_object)
 
 
+@traced
 def c_generate_key(h_session, mechanism=None, template=None):
     """
     Generates a symmetric key of a given flavor given the correct template.
@@ -86,6 +89,7 @@ def c_generate_key(h_session, mechanism=None, template=None):
 c_generate_key_ex = make_error_handle_function(c_generate_key)
 
 
+@traced
 def c_generate_key_pair(h_session,
                         mechanism=None,
                         pbkey_template=None,
@@ -128,6 +132,7 @@ def c_generate_key_pair(h_session,
 c_generate_key_pair_ex = make_error_handle_function(c_generate_key_pair)
 
 
+@traced
 def c_derive_key(h_session, h_base_key, template, mechanism=None):
     """Derives a key from another key.
 
@@ -1,18 +1,45 @@
+"""
+Multi-threaded load generation against a token.
+
+Runs one or more workloads (session churn, key generation, sign, encrypt, find objects,
+token info...) from several threads, optionally in several processes, for a given duration,
+and reports throughput, latency percentiles and errors per workload::
+
+    python -m pycryptoki.luna_threading --slot 1 --password userpin \\
+        --workloads sign,encrypt --threads 8 --processes 2 --duration 60 -o results.json
+
+Workloads are classes deriving from :py:class:`Workload`, registered with
+:py:func:`register_workload`.
+"""
+import json
 import logging
+import multiprocessing
+import os
+import socket
 import sys
 import threading
 import time
+from argparse import ArgumentParser
+from timeit import default_timer
+
+from six.moves.queue import Empty
 
-from .default_templates import CKM_DES_KEY_GEN_TEMP, \
+from .call_stats import LatencyHistogram
+from .default_templates import CKM_DES_KEY_GEN_TEMP, CKM_AES_KEY_GEN_TEMP, \
     CKM_RSA_PKCS_KEY_PAIR_GEN_PUBTEMP, CKM_RSA_PKCS_KEY_PAIR_GEN_PRIVTEMP
 from .defaults import ADMIN_PARTITION_LABEL, MANUFACTURER_ID, MODEL
-from .defines import CKM_DES_KEY_GEN, CKM_RSA_PKCS_KEY_PAIR_GEN, \
-    CKR_OK
-from .key_generator import c_generate_key_ex, c_generate_key_pair_ex
-from .return_values import ret_vals_dictionary
+from .defines import CKM_DES_KEY_GEN, CKM_RSA_PKCS_KEY_PAIR_GEN, CKM_AES_KEY_GEN, \
+    CKM_AES_CBC, CKM_SHA256_RSA_PKCS, CKA_TOKEN, CKA_CLASS, CKO_SECRET_KEY, CKR_OK, CKU_USER, \
+    CKR_USER_ALREADY_LOGGED_IN
+from .encryption import c_encrypt_ex
+from .exceptions import LunaCallException
+from .key_generator import c_generate_key_ex, c_generate_key_pair_ex, c_destroy_object_ex
+from .lookup_dicts import ret_vals_dictionary
+from .object_attr_lookup import c_find_objects_ex
 from .session_management import c_open_session_ex, c_get_token_info_ex, \
-    c_open_session, c_close_session
-from .exceptions import verify_object_attributes
+    c_open_session, c_close_session, c_close_session_ex, c_initialize_ex, login, c_logout_ex
+from .sign_verify import c_sign_ex
+from .test_functions import verify_object_attributes
 from .token_management import get_token_by_label_ex, \
     c_get_mechanism_list_ex, c_get_mechanism_info_ex
 
@@ -23,6 +50,402 @@ OPEN_AND_CLOSE_SESSIONS = 3
 GET_TOKEN_INFO = 4
 GET_MECHANISM_INFO = 5
 
+#: Latency percentiles reported for each workload.
+REPORT_PERCENTILES = (50, 95, 99)
+
+#: Seconds a worker process gets beyond the run's duration to initialize, log in & report.
+PROCESS_MARGIN = 60
+#: Seconds between checks for worker processes that exited without reporting.
+PROCESS_POLL_INTERVAL = 1.0
+
+WORKLOADS = {}
+
+
+def register_workload(cls):
+    """
+    Class decorator registering a :py:class:`Workload` under its ``name``.
+    """
+    WORKLOADS[cls.name] = cls
+    return cls
+
+
+def _session_template(template):
+    """Copy of a default template for a session (non-token) object."""
+    template = dict(template)
+    template[CKA_TOKEN] = False
+    return template
+
+
+class Workload(object):
+    """
+    An operation run in a loop by a load generation thread.
+
+    :py:meth:`setup` runs once per thread before the timed loop, :py:meth:`run_once` is the
+    timed operation and :py:meth:`teardown` runs once at the end.
+
+    :param int slot: Slot to run on
+    :param bytes password: User password the run was logged in with, or None. Login state is
+        shared by all the sessions of the process, so :py:func:`run_threads` logs in once
+        before starting the threads.
+    """
+    name = None
+
+    def __init__(self, slot, password=None):
+        self.slot = slot
+        self.password = password
+        self.h_session = None
+
+    def setup(self):
+        """Open the thread's session."""
+        self.h_session = c_open_session_ex(self.slot)
+
+    def run_once(self):
+        """Run the operation once. Raise on failure."""
+        raise NotImplementedError
+
+    def teardown(self):
+        """Close the thread's session."""
+        if self.h_session is not None:
+            c_close_session_ex(self.h_session)
+            self.h_session = None
+
+
+@register_workload
+class SessionChurn(Workload):
+    """Open & close a session."""
+    name = "session_churn"
+
+    def run_once(self):
+        c_close_session_ex(c_open_session_ex(self.slot))
+
+
+@register_workload
+class KeyGeneration(Workload):
+    """Generate & destroy an AES session key."""
+    name = "keygen"
+
+    def run_once(self):
+        key = c_generate_key_ex(self.h_session, CKM_AES_KEY_GEN,
+                                _session_template(CKM_AES_KEY_GEN_TEMP))
+        c_destroy_object_ex(self.h_session, key)
+
+
+@register_workload
+class Sign(Workload):
+    """Sign 1 KB of data with an RSA session key."""
+    name = "sign"
+    data = b"\x01" * 1024
+
+    def setup(self):
+        super(Sign, self).setup()
+        _, self.h_key = c_generate_key_pair_ex(
+            self.h_session, CKM_RSA_PKCS_KEY_PAIR_GEN,
+            _session_template(CKM_RSA_PKCS_KEY_PAIR_GEN_PUBTEMP),
+            _session_template(CKM_RSA_PKCS_KEY_PAIR_GEN_PRIVTEMP))
+
+    def run_once(self):
+        c_sign_ex(self.h_session, self.h_key, self.data, CKM_SHA256_RSA_PKCS)
+
+
+@register_workload
+class Encrypt(Workload):
+    """Encrypt 1 KB of data with AES-CBC."""
+    name = "encrypt"
+    data = b"\x01" * 1024
+
+    def setup(self):
+        super(Encrypt, self).setup()
+        self.h_key = c_generate_key_ex(self.h_session, CKM_AES_KEY_GEN,
+                                       _session_template(CKM_AES_KEY_GEN_TEMP))
+
+    def run_once(self):
+        c_encrypt_ex(self.h_session, self.h_key, self.data, CKM_AES_CBC)
+
+
+@register_workload
+class FindObjects(Workload):
+    """Find up to 100 secret keys."""
+    name = "find_objects"
+
+    def run_once(self):
+        c_find_objects_ex(self.h_session, {CKA_CLASS: CKO_SECRET_KEY}, 100)
+
+
+@register_workload
+class GetTokenInfo(Workload):
+    """Read the token info."""
+    name = "token_info"
+
+    def setup(self):
+        pass
+
+    def run_once(self):
+        c_get_token_info_ex(self.slot)
+
+    def teardown(self):
+        pass
+
+
+def _error_key(exc):
+    """Name an error is counted under: return code name for cryptoki errors, else type."""
+    if isinstance(exc, LunaCallException):
+        return ret_vals_dictionary.get(exc.error_code, hex(exc.error_code))
+    return type(exc).__name__
+
+
+class WorkloadResult(object):
+    """
+    Latencies & errors of one workload, possibly merged from several threads/processes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = LatencyHistogram()
+        self.errors = {}
+
+    def record_error(self, exc):
+        """Count a failure, see :py:func:`_error_key`."""
+        key = _error_key(exc)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def merge(self, other):
+        """Add another result for the same workload to this one."""
+        self.latency.merge(other.latency)
+        for key, count in other.errors.items():
+            self.errors[key] = self.errors.get(key, 0) + count
+
+    def report(self, duration):
+        """
+        :param float duration: Wall clock duration of the run, in seconds
+        :return: dict with ops, throughput (ops/s), latency percentiles (ms) & errors.
+        """
+        ops = self.latency.count
+        report = {'ops': ops,
+                  'throughput': ops / duration if duration else 0.0,
+                  'errors': dict(self.errors),
+                  'error_count': sum(self.errors.values())}
+        for percentile in REPORT_PERCENTILES:
+            value = self.latency.percentile(percentile)
+            report['p{}_ms'.format(percentile)] = value * 1000 if value is not None else None
+        return report
+
+
+def _run_workload(workload, deadline, result):
+    """
+    Thread target: run a workload until the deadline, recording into ``result``. Failed
+    iterations are recorded as errors & don't count towards the latencies.
+    """
+    try:
+        workload.setup()
+    except Exception as exc:
+        logger.exception("Setup of workload %s failed", workload.name)
+        result.record_error(exc)
+        return
+    try:
+        while time.time() < deadline:
+            start = default_timer()
+            try:
+                workload.run_once()
+            except Exception as exc:
+                result.record_error(exc)
+            else:
+                result.latency.record(default_timer() - start)
+    finally:
+        try:
+            workload.teardown()
+        except Exception:
+            logger.exception("Teardown of workload %s failed", workload.name)
+
+
+def _login(slot, password):
+    """
+    Log the process into the slot, once for all the threads.
+
+    :return: tuple of the session keeping the login alive (None without a password) and
+        whether this call logged in, False if the process already was.
+    """
+    if password is None:
+        return None, False
+    h_session = c_open_session_ex(slot)
+    ret = login(h_session, slot, password, CKU_USER)
+    if ret == CKR_USER_ALREADY_LOGGED_IN:
+        return h_session, False
+    if ret != CKR_OK:
+        c_close_session_ex(h_session)
+        raise LunaCallException(ret, "login", "(slot_num: {})".format(slot))
+    return h_session, True
+
+
+def _logout(h_session, logged_in):
+    """Undo :py:func:`_login`."""
+    if h_session is None:
+        return
+    try:
+        if logged_in:
+            c_logout_ex(h_session)
+    finally:
+        c_close_session_ex(h_session)
+
+
+def run_threads(workload_names, slot, password, threads, duration):
+    """
+    Run every workload from ``threads`` threads each, for ``duration`` seconds.
+
+    :return: dict of workload name to :py:class:`WorkloadResult`
+    """
+    h_login_session, logged_in = _login(slot, password)
+    try:
+        results = _run_threads(workload_names, slot, password, threads, duration)
+    finally:
+        _logout(h_login_session, logged_in)
+
+    merged = {}
+    for name, thread_results in results.items():
+        merged[name] = WorkloadResult(name)
+        for result in thread_results:
+            merged[name].merge(result)
+    return merged
+
+
+def _run_threads(workload_names, slot, password, threads, duration):
+    """Start & join the threads; return the results of each thread, by workload name."""
+    deadline = time.time() + duration
+    workers, results = [], {}
+    for name in workload_names:
+        for index in range(threads):
+            result = WorkloadResult(name)
+            workers.append(threading.Thread(target=_run_workload,
+                                            name="{}-{}".format(name, index),
+                                            args=(WORKLOADS[name](slot, password), deadline,
+                                                  result)))
+            results.setdefault(name, []).append(result)
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def _failed_results(workload_names, error):
+    """Results of a process that failed before reporting: ``error`` counted once per workload."""
+    results = {}
+    for name in workload_names:
+        results[name] = WorkloadResult(name)
+        results[name].errors[error] = 1
+    return results
+
+
+def _process_main(queue, workload_names, slot, password, threads, duration):
+    """
+    Process target: initialize the library & run the threads; send the results back, or
+    the failure counted as an error of every workload.
+    """
+    try:
+        c_initialize_ex()
+        results = run_threads(workload_names, slot, password, threads, duration)
+    except Exception as exc:
+        logger.exception("Load generation process %s failed", os.getpid())
+        results = _failed_results(workload_names, _error_key(exc))
+    queue.put((os.getpid(), results))
+
+
+def _collect_results(queue, workers, workload_names, timeout):
+    """
+    Merge the results sent by the worker processes. A process that exits without reporting
+    (crash in the library, killed...) or doesn't report within ``timeout`` seconds is
+    counted as an error of every workload instead of blocking the run.
+    """
+    results = {name: WorkloadResult(name) for name in workload_names}
+    pending = dict((worker.pid, worker) for worker in workers)
+    deadline = time.time() + timeout
+    while pending:
+        # Processes that exited before the get() can't report anymore once it times out
+        exited = [pid for pid, worker in pending.items() if worker.exitcode is not None]
+        try:
+            pid, process_results = queue.get(timeout=PROCESS_POLL_INTERVAL)
+        except Empty:
+            failed = {pid: "process exited with code {}".format(pending[pid].exitcode)
+                      for pid in exited}
+            if time.time() > deadline:
+                failed.update((pid, "process timed out") for pid in pending if pid not in failed)
+            for pid, error in failed.items():
+                logger.error("Load generation process %s didn't report: %s", pid, error)
+                worker = pending.pop(pid)
+                if worker.is_alive():
+                    worker.terminate()
+                process_results = _failed_results(workload_names, error)
+                for name, result in process_results.items():
+                    results[name].merge(result)
+            continue
+        pending.pop(pid, None)
+        for name, result in process_results.items():
+            results[name].merge(result)
+    return results
+
+
+def run_load(workload_names, slot, password=None, threads=1, processes=1, duration=10.0):
+    """
+    Run a load generation and return the report.
+
+    :param list workload_names: Names of registered workloads, see :py:data:`WORKLOADS`
+    :param int slot: Slot to run on
+    :param bytes password: User password, or None to run on unauthenticated sessions
+    :param int threads: Threads per workload & per process
+    :param int processes: Processes to spread the threads over. With 1, threads run in
+        the current process, which must have initialized the library. A process that fails
+        or doesn't report within ``duration`` + :py:data:`PROCESS_MARGIN` seconds is counted
+        as an error of every workload.
+    :param float duration: Seconds to run for
+    :return: dict with the run's configuration and a report per workload, see
+        :py:meth:`WorkloadResult.report`
+    """
+    for name in workload_names:
+        if name not in WORKLOADS:
+            raise ValueError("Unknown workload '{}', available: {}"
+                             .format(name, ", ".join(sorted(WORKLOADS))))
+
+    start = time.time()
+    if processes <= 1:
+        results = run_threads(workload_names, slot, password, threads, duration)
+    else:
+        queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_process_main,
+                                           args=(queue, workload_names, slot, password,
+                                                 threads, duration))
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        results = _collect_results(queue, workers, workload_names, duration + PROCESS_MARGIN)
+        for worker in workers:
+            worker.join()
+    elapsed = time.time() - start
+
+    return {'timestamp': start,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'slot': slot,
+            'threads': threads,
+            'processes': processes,
+            'duration': elapsed,
+            'workloads': {name: result.report(elapsed) for name, result in results.items()}}
+
+
+def format_report(report):
+    """
+    :return: Human-readable table of a :py:func:`run_load` report.
+    """
+    lines = ["{:<15} {:>8} {:>10} {:>9} {:>9} {:>9} {:>7}".format(
+        "workload", "ops", "ops/s", "p50 ms", "p95 ms", "p99 ms", "errors")]
+    for name in sorted(report['workloads']):
+        result = report['workloads'][name]
+        lines.append("{:<15} {:>8} {:>10.1f} {:>9} {:>9} {:>9} {:>7}".format(
+            name, result['ops'], result['throughput'],
+            *["{:.2f}".format(result[key]) if result[key] is not None else "-"
+              for key in ("p50_ms", "p95_ms", "p99_ms")] + [result['error_count']]))
+        for error, count in sorted(result['errors'].items()):
+            lines.append("    {}: {}".format(error, count))
+    return "\n".join(lines)
+
 
 class TestThread(threading.Thread):
     """A member of the threading class which, when given the proper parameters, will
@@ -30,7 +453,7 @@ class TestThread(threading.Thread):
     reported when all the
     threads finish.
 
-
+    For throughput & latency measurements, use :py:func:`run_load` instead.
     """
 
     def __init__(self, queue, thread_name, token_label, thread_type, max_time=60):  # 60 seconds
@@ -60,9 +483,7 @@ class TestThread(threading.Thread):
         try:
             # For a given amount of time run the operations in a separate thread
             start_time = time.time()
-            while ((time.time() - start_time) < self.max_time) and (
-                        (not self.starting_slot >= self.ending_slot) or (
-                            self.starting_slot == -1 and self.ending_slot == -1)):
+            while (time.time() - start_time) < self.max_time:
                 if self.thread_type == CREATE_AND_REMOVE_KEYS:
                     self.create_and_remove_keys()
                 elif self.thread_type == OPEN_AND_CLOSE_SESSIONS:
@@ -150,3 +571,32 @@ class TestThread(threading.Thread):
             assert (
                        mech_info.ulMinKeySize > 0 or mech_info.ulMaxKeySize > 0 or
                        mech_info.flags > 0) and mech_info.ulMinKeySize <= mech_info.ulMaxKeySize, "Verifing that all fields are not 0 should be good enough for now"
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Multi-threaded load generation against a token.")
+    parser.add_argument("-s", "--slot", type=int, required=True, help="Slot to run on")
+    parser.add_argument("--password", help="User password to log the sessions in with")
+    parser.add_argument("-w", "--workloads", default="token_info",
+                        type=lambda x: x.split(","),
+                        help="Comma separated workloads, from: {}".format(
+                            ", ".join(sorted(WORKLOADS))))
+    parser.add_argument("-t", "--threads", type=int, default=4,
+                        help="Threads per workload (and per process)")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help="Processes to run the threads in")
+    parser.add_argument("-d", "--duration", type=float, default=10.0,
+                        help="Duration of the run, in seconds")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.processes <= 1:
+        c_initialize_ex()
+    run_report = run_load(args.workloads, args.slot,
+                          args.password.encode() if args.password else None,
+                          args.threads, args.processes, args.duration)
+    print(format_report(run_report))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(run_report, output, indent=2, sort_keys=True)
@@ -29,8 +29,10 @@ from .defines import CKR_OK
 from .exceptions import make_error_handle_function
 from .mechanism import parse_mechanism
 from .sign_verify import do_multipart_sign_or_digest
+from .tracing import traced
 
 
+@traced
 def c_generate_random(h_session, length):
     """Generates a sequence of random numbers
 
@@ -71,6 +73,7 @@ def c_seed_random(h_session, seed):
 c_seed_random_ex = make_error_handle_function(c_seed_random)
 
 
+@traced
 def c_digest(h_session, data_to_digest, digest_flavor, mechanism=None, output_buffer=None):
     """Digests some data
 
@@ -171,6 +174,7 @@ def c_digestkey(h_session, h_key, digest_flavor, mechanism=None):
 c_digestkey_ex = make_error_handle_function(c_digestkey)
 
 
+@traced
 def c_create_object(h_session, template):
     """Creates an object based on a given python template
 
@@ -9,10 +9,12 @@ from .cryptoki import CK_OBJECT_HANDLE, C_FindObjectsInit, CK_ULONG, \
     C_FindObjects, C_FindObjectsFinal, C_GetAttributeValue, C_SetAttributeValue
 from .defines import CKR_OK
 from .exceptions import make_error_handle_function
+from .tracing import traced
 
 LOG = logging.getLogger(__name__)
 
 
+@traced
 def c_find_objects(h_session, template, num_entries):
     """Calls c_find_objects and c_find_objects_init to get a python dictionary
     of the objects found.
@@ -42,6 +44,43 @@ def c_find_objects(h_session, template, num_entries):
 c_find_objects_ex = make_error_handle_function(c_find_objects)
 
 
+@traced
+def c_find_all_objects(h_session, template, page_size=100):
+    """Calls C_FindObjects until the search is exhausted, to get every object matching
+    the template regardless of how many there are.
+
+    :param int h_session: Session handle
+    :param template: A python dictionary of the object template to look for
+    :param int page_size: The number of handles requested per C_FindObjects call
+    :returns: Returns a list of handles of objects found
+
+    """
+    struct = Attributes(template).get_c_struct()
+    ret = C_FindObjectsInit(h_session, struct, CK_ULONG(len(template)))
+    if ret != CKR_OK:
+        return ret, None
+
+    handles = []
+    h_ary = (CK_OBJECT_HANDLE * page_size)()
+    us_total = CK_ULONG(page_size)
+    while True:
+        ret = C_FindObjects(h_session, h_ary, CK_ULONG(page_size), byref(us_total))
+        if ret != CKR_OK:
+            C_FindObjectsFinal(h_session)
+            return ret, None
+        handles.extend(h_ary[i] for i in range(us_total.value))
+        if us_total.value < page_size:
+            break
+
+    ret = C_FindObjectsFinal(h_session)
+
+    return ret, handles
+
+
+c_find_all_objects_ex = make_error_handle_function(c_find_all_objects)
+
+
+@traced
 def c_get_attribute_value(h_session, h_object, template, to_hex=True):
     """Calls C_GetAttrributeValue to get an attribute value based on a python template
 
@@ -80,6 +119,7 @@ def c_get_attribute_value(h_session, h_object, template, to_hex=True):
 c_get_attribute_value_ex = make_error_handle_function(c_get_attribute_value)
 
 
+@traced
 def c_set_attribute_value(h_session, h_object, template):
     """Calls C_SetAttributeValue to set an attribute value based on a python template
 
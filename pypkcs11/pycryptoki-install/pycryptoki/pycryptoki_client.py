@@ -9,7 +9,10 @@ Contains both a local and remote pycryptoki client
 """
 import inspect
 import logging
+import pickle
 import socket
+import threading
+from collections import deque
 from functools import wraps
 
 import rpyc
@@ -17,11 +20,22 @@ import time
 
 from rpyc.core.protocol import PingError
 
+from . import tracing
 from .daemon import rpyc_pycryptoki
+from .daemon.streams import StreamTable, run_stream
+from .daemon.transport import COMPRESSION_THRESHOLD, encode_call, decode_result
+from .defines import CKR_OK
+from .exceptions import unwrap_function
 from .lookup_dicts import ATTR_NAME_LOOKUP, ret_vals_dictionary
 
 LOG = logging.getLogger(__name__)
 
+# Renamed from `async` in newer RPyC versions.
+rpyc_async = getattr(rpyc, "async_", None) or getattr(rpyc, "async")
+
+#: Number of chunks sent to the daemon ahead of the output being read back.
+STREAM_WINDOW = 4
+
 
 # from https://github.com/saltycrane/retry-decorator/blob/master/decorators.py
 def retry(ExceptionToCheck, tries=4, delay=3, backoff=2, logger=None):
@@ -143,14 +157,38 @@ class RemotePycryptokiClient(object):
 
     :param ip: IP Address of the client the remote daemon is running on.
     :param port: What Port the daemon is running on.
+    :param int bulk_compression_threshold: Payload size above which :py:meth:`bulk_call`
+        compresses data sent to and from the daemon.
     """
 
-    def __init__(self, ip=None, port=None):
+    def __init__(self, ip=None, port=None, bulk_compression_threshold=COMPRESSION_THRESHOLD):
         self.ip = ip
         self.port = port
+        self.bulk_compression_threshold = bulk_compression_threshold
         self.connection = None
         self.server = None
 
+    @classmethod
+    def from_supervisor(cls, ip, port, slot=None, library=None, **kwargs):
+        """
+        Create a client connected to the worker owning ``slot`` (or ``library``) of a daemon
+        running in supervisor mode, see :py:mod:`pycryptoki.daemon.supervisor`.
+
+        :param ip: IP Address of the supervisor.
+        :param port: Port of the supervisor.
+        :param int slot: Slot to route calls to.
+        :param str library: PKCS11 library to route calls to, for per-library workers.
+        :return: :py:class:`RemotePycryptokiClient`
+        """
+        connection = rpyc.connect(ip, port)
+        try:
+            worker_ip, worker_port = connection.root.worker_address(slot=slot, library=library)
+        finally:
+            connection.close()
+        LOG.info("Supervisor at %s:%s routed slot=%s library=%s to port %s",
+                 ip, port, slot, library, worker_port)
+        return cls(worker_ip, worker_port, **kwargs)
+
     def kill(self):
         """
         Close out the local RPYC connection.
@@ -191,6 +229,114 @@ class RemotePycryptokiClient(object):
             self.server = None
             return False
 
+    @connection_test
+    def batch(self, calls, stop_on_error=False):
+        """
+        Run several pycryptoki calls on the daemon in a single round trip::
+
+            results = client.batch([("c_open_session_ex", (slot,)),
+                                    ("c_generate_random_ex", (h_session, 16))])
+
+        :param calls: List of ``(function_name, args, kwargs)`` tuples. ``args`` and ``kwargs``
+            can be omitted.
+        :param bool stop_on_error: Stop on the first call that raises; the remaining calls
+            are not executed.
+        :return: list of result dictionaries, see
+            :py:func:`~pycryptoki.daemon.rpyc_pycryptoki.run_batch`
+        """
+        calls = list(calls)
+        LOG.debug("Remote pycryptoki batch: %s",
+                  ", ".join("{}()".format(call[0]) for call in calls))
+        payload = pickle.dumps(calls, protocol=2)
+        results = pickle.loads(self.server.batch(payload, stop_on_error))
+        for entry in results:
+            if entry['error'] is not None:
+                LOG.debug("Remote batch call '%s' failed: %s", entry['name'], entry['error'])
+        return results
+
+    @connection_test
+    def bulk_call(self, name, *args, **kwargs):
+        """
+        Call a pycryptoki function through the daemon's bulk-data endpoint. The data
+        argument is sent as a single binary frame, and data in the return value comes back
+        as plain ``bytes``::
+
+            ret, enc_data = client.bulk_call("c_encrypt", h_session, h_key, data, mechanism)
+            signature = client.bulk_call("c_sign_ex", h_session, h_key, data, mechanism)
+
+        :param str name: One of ``c_encrypt``, ``c_sign``, ``ca_sim_insert`` or their
+            ``_ex`` variants.
+        :return: Same return value as the regular pycryptoki function.
+        """
+        if name not in rpyc_pycryptoki.BULK_OPS:
+            raise AttributeError("'{}' has no bulk-data endpoint".format(name))
+        func, payload_arg = rpyc_pycryptoki.BULK_OPS[name]
+        frame = encode_call(func, payload_arg, args, kwargs, self.bulk_compression_threshold)
+        LOG.debug("Remote pycryptoki bulk command: %s() with a %s byte frame", name, len(frame))
+        return decode_result(self.server.bulk_call(name, frame))
+
+    @connection_test
+    def encrypt_stream(self, h_session, h_key, mechanism, chunks, window=STREAM_WINDOW):
+        """
+        Encrypt data chunk by chunk on the daemon, yielding the encrypted data as it comes
+        back. Only ``window`` chunks are in flight at any time, so memory use stays bounded
+        on both ends whatever the total size::
+
+            with open(path, "rb") as in_file:
+                chunks = iter(lambda: in_file.read(1024 * 1024), b"")
+                for data in client.encrypt_stream(h_session, h_key, mechanism, chunks):
+                    out_file.write(data)
+
+        :param int h_session: Session handle
+        :param int h_key: Key handle
+        :param mechanism: See :py:func:`~pycryptoki.mechanism.parse_mechanism`
+        :param chunks: Iterable of bytes, at most
+            :py:data:`~pycryptoki.daemon.streams.MAX_CHUNK_SIZE` each.
+        :param int window: Number of chunks pushed ahead of reading the output back.
+        :return: Generator of bytes
+        """
+        stream_id = self.server.encrypt_stream_open(h_session, h_key, mechanism)
+        return self._run_stream(stream_id, chunks, window)
+
+    @connection_test
+    def decrypt_stream(self, h_session, h_key, mechanism, chunks, window=STREAM_WINDOW):
+        """
+        Decrypt data chunk by chunk on the daemon, see :py:meth:`encrypt_stream`.
+
+        :return: Generator of bytes
+        """
+        stream_id = self.server.decrypt_stream_open(h_session, h_key, mechanism)
+        return self._run_stream(stream_id, chunks, window)
+
+    def _run_stream(self, stream_id, chunks, window):
+        """
+        Push chunks to an open stream using async requests, keeping at most ``window`` of
+        them pending, and yield the non-empty outputs in order.
+        """
+        push = rpyc_async(self.server.stream_push)
+        pending = deque()
+        closed = False
+        try:
+            for seq, chunk in enumerate(chunks):
+                pending.append(push(stream_id, seq, chunk))
+                if len(pending) >= window:
+                    output = pending.popleft().value
+                    if output:
+                        yield output
+            while pending:
+                output = pending.popleft().value
+                if output:
+                    yield output
+            closed = True
+            output = self.server.stream_close(stream_id)
+            if output:
+                yield output
+        finally:
+            if not closed and not self.connection.closed:
+                for result in pending:
+                    result.wait()
+                self.server.stream_abort(stream_id)
+
     @connection_test
     def __getattr__(self, name):
         """
@@ -210,10 +356,13 @@ class RemotePycryptokiClient(object):
                     will_raise = True
                 else:
                     func = getattr(self.server, name)
-                nice_args = inspect.getcallargs(func, *args, **kwargs)
+                # Decorated functions (tracing, the supervisor's metering...) keep the real
+                # function around so we can still log proper argument names.
+                nice_args = inspect.getcallargs(unwrap_function(func), *args, **kwargs)
 
                 log_args(name, nice_args)
-                ret = getattr(self.server, name)(*args, **kwargs)
+                with tracing.span(name, kind="rpyc", daemon="{}:{}".format(self.ip, self.port)):
+                    ret = getattr(self.server, name)(*args, **kwargs)
                 # Two major calling types for pycryptoki:
                 # 1. with _ex appended, which will raise an exception if retcode != 0
                 # 2. without _ex, which will return either just the retcode, or a tuple where the
@@ -232,6 +381,295 @@ class RemotePycryptokiClient(object):
             raise AttributeError(name)
 
 
+def _split_call(call):
+    """
+    Normalise a batch call tuple to ``(name, args, kwargs)``.
+    """
+    name, args, kwargs = (tuple(call) + ((), {}))[:3]
+    return name, tuple(args), dict(kwargs)
+
+
+class PooledRemotePycryptokiClient(object):
+    """Pool of connections to a remote Pycryptoki RPYC daemon, for concurrent callers.
+
+    Behaves like a :py:class:`RemotePycryptokiClient`. Each call goes to the least busy
+    connection, except calls on a session handle: those always go to the connection that
+    opened the session (through ``c_open_session``). A stream keeps its connection
+    reserved until the stream is exhausted or closed. Connections are checked with a ping
+    every ``health_check_interval`` seconds and reconnected if they died -- sessions opened
+    on them are dropped from the affinity map, since the daemon closed them.
+
+    :param ip: IP Address of the client the remote daemon is running on.
+    :param port: What Port the daemon is running on.
+    :param int size: Number of connections.
+    :param float health_check_interval: Seconds between health checks of a connection.
+    :param client_kwargs: Passed on to each :py:class:`RemotePycryptokiClient`.
+    """
+
+    def __init__(self, ip=None, port=None, size=4, health_check_interval=30, **client_kwargs):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.ip = ip
+        self.port = port
+        self.health_check_interval = health_check_interval
+        self.clients = [RemotePycryptokiClient(ip, port, **client_kwargs) for _ in range(size)]
+        self._lock = threading.Lock()
+        self._in_use = [0] * size
+        self._calls = [0] * size
+        self._reconnects = [0] * size
+        self._last_check = [0.0] * size
+        # Serialise health checks & reconnects of each connection
+        self._check_locks = [threading.Lock() for _ in range(size)]
+        # h_session: (connection index, slot)
+        self._sessions = {}
+
+    def start(self):
+        """
+        Start all the connections of the pool.
+        """
+        for client in self.clients:
+            client.start()
+        self._last_check = [time.time()] * len(self.clients)
+
+    def kill(self):
+        """
+        Close all the connections of the pool.
+        """
+        for client in self.clients:
+            client.kill()
+        with self._lock:
+            self._sessions.clear()
+
+    def cleanup(self):
+        """ """
+        pass
+
+    @property
+    def started(self):
+        """
+        Check if at least one connection of the pool is alive.
+
+        :return: boolean
+        """
+        return any(client.started for client in self.clients)
+
+    def check_health(self, index=None):
+        """
+        Ping connections and reconnect the dead ones.
+
+        :param int index: Connection to check. All connections by default.
+        """
+        for idx in ([index] if index is not None else range(len(self.clients))):
+            with self._check_locks[idx]:
+                self._check_connection(idx)
+
+    def _check_connection(self, idx):
+        """
+        Reconnect connection ``idx`` if it died. Called with its check lock held, so a
+        thread that waited for another's reconnect finds the connection started again.
+        """
+        client = self.clients[idx]
+        was_connected = self._last_check[idx] > 0
+        self._last_check[idx] = time.time()
+        if client.started:
+            return
+        with self._lock:
+            lost = [h_session for h_session, (conn, _) in self._sessions.items()
+                    if conn == idx]
+            for h_session in lost:
+                del self._sessions[h_session]
+        if was_connected:
+            LOG.warning("Pooled connection %s is down, reconnecting. Sessions lost: %s",
+                        idx, lost)
+            self._reconnects[idx] += 1
+        client.start()
+
+    def _acquire(self, index=None):
+        """
+        Reserve a connection: ``index`` if given, otherwise the least busy one.
+
+        :return: Connection index
+        """
+        with self._lock:
+            if index is None:
+                index = min(range(len(self.clients)),
+                            key=lambda idx: (self._in_use[idx], self._calls[idx]))
+            self._in_use[index] += 1
+            self._calls[index] += 1
+        if time.time() - self._last_check[index] >= self.health_check_interval:
+            self.check_health(index)
+        return index
+
+    def _release(self, index):
+        with self._lock:
+            self._in_use[index] -= 1
+
+    def _session_of(self, name, args, kwargs):
+        """
+        Find the session handle a pycryptoki call works on, if any.
+
+        :return: Session handle or None
+        """
+        name = name.rsplit("_ex", 1)[0] if name.endswith("_ex") else name
+        func = getattr(rpyc_pycryptoki.PycryptokiService, "exposed_" + name, None)
+        if func is None:
+            return None
+        try:
+            call_args = inspect.getcallargs(unwrap_function(func), *args, **kwargs)
+        except TypeError:
+            return None
+        return call_args.get('h_session', call_args.get('session'))
+
+    def _track_sessions(self, name, index, args, kwargs, ret):
+        """
+        Update the session affinity map after a session was opened or closed.
+        """
+        base_name = name.rsplit("_ex", 1)[0] if name.endswith("_ex") else name
+        with self._lock:
+            if base_name == "c_open_session":
+                if name.endswith("_ex"):
+                    h_session = ret
+                else:
+                    h_session = ret[1] if ret[0] == CKR_OK else None
+                if h_session is not None:
+                    slot = args[0] if args else kwargs.get('slot_num')
+                    self._sessions[h_session] = (index, slot)
+            elif base_name == "c_close_session":
+                self._sessions.pop(args[0] if args else kwargs.get('h_session'), None)
+            elif base_name == "c_close_all_sessions":
+                slot = args[0] if args else kwargs.get('slot')
+                for h_session, (_, session_slot) in list(self._sessions.items()):
+                    if session_slot == slot:
+                        del self._sessions[h_session]
+            elif base_name == "c_finalize":
+                self._sessions.clear()
+
+    def _call(self, h_session, func_name, name, args, kwargs):
+        """
+        Run ``name`` (or the client method ``func_name`` on ``name``, e.g. ``bulk_call``)
+        on the connection owning ``h_session``, or on the least busy one.
+        """
+        with self._lock:
+            affinity = self._sessions.get(h_session)
+        index = self._acquire(affinity[0] if affinity else None)
+        try:
+            client = self.clients[index]
+            if func_name is None:
+                ret = getattr(client, name)(*args, **kwargs)
+            else:
+                ret = getattr(client, func_name)(name, *args, **kwargs)
+        finally:
+            self._release(index)
+        self._track_sessions(name, index, args, kwargs, ret)
+        return ret
+
+    def batch(self, calls, stop_on_error=False):
+        """
+        Run several calls in a single round trip, see :py:meth:`RemotePycryptokiClient.batch`.
+        The batch runs on the connection owning the first session handle it uses.
+        """
+        calls = [_split_call(call) for call in calls]
+        h_session = None
+        for name, args, kwargs in calls:
+            h_session = self._session_of(name, args, kwargs)
+            if h_session is not None:
+                break
+        with self._lock:
+            affinity = self._sessions.get(h_session)
+        index = self._acquire(affinity[0] if affinity else None)
+        try:
+            results = self.clients[index].batch(calls, stop_on_error)
+        finally:
+            self._release(index)
+        for (name, args, kwargs), entry in zip(calls, results):
+            if entry['error'] is None:
+                self._track_sessions(name, index, args, kwargs, entry['result'])
+        return results
+
+    def bulk_call(self, name, *args, **kwargs):
+        """
+        Call a bulk-data function, see :py:meth:`RemotePycryptokiClient.bulk_call`.
+        """
+        return self._call(self._session_of(name, args, kwargs), "bulk_call", name,
+                          args, kwargs)
+
+    def encrypt_stream(self, h_session, *args, **kwargs):
+        """
+        Stream an encrypt operation, see :py:meth:`RemotePycryptokiClient.encrypt_stream`.
+        """
+        return self._stream("encrypt_stream", h_session, args, kwargs)
+
+    def decrypt_stream(self, h_session, *args, **kwargs):
+        """
+        Stream a decrypt operation, see :py:meth:`RemotePycryptokiClient.decrypt_stream`.
+        """
+        return self._stream("decrypt_stream", h_session, args, kwargs)
+
+    def _stream(self, name, h_session, args, kwargs):
+        """
+        Open a stream on the connection owning ``h_session``. The connection stays reserved
+        until the returned generator is exhausted or closed.
+        """
+        with self._lock:
+            affinity = self._sessions.get(h_session)
+        index = self._acquire(affinity[0] if affinity else None)
+        try:
+            stream = getattr(self.clients[index], name)(h_session, *args, **kwargs)
+        except BaseException:
+            self._release(index)
+            raise
+        return self._reserved_stream(stream, index)
+
+    def _reserved_stream(self, stream, index):
+        try:
+            for output in stream:
+                yield output
+        finally:
+            try:
+                stream.close()
+            finally:
+                self._release(index)
+
+    def pool_stats(self):
+        """
+        Utilisation of the pool.
+
+        :return: dict with the overall ``utilisation`` (share of connections busy right now),
+            the number of ``sessions`` tracked, and per-connection ``connections`` stats
+            (``in_use``, ``calls``, ``sessions``, ``reconnects``).
+        """
+        with self._lock:
+            sessions = [0] * len(self.clients)
+            for index, _ in self._sessions.values():
+                sessions[index] += 1
+            connections = [{'in_use': self._in_use[idx],
+                            'calls': self._calls[idx],
+                            'sessions': sessions[idx],
+                            'reconnects': self._reconnects[idx]}
+                           for idx in range(len(self.clients))]
+            busy = sum(1 for in_use in self._in_use if in_use)
+            return {'size': len(self.clients),
+                    'utilisation': float(busy) / len(self.clients),
+                    'sessions': len(self._sessions),
+                    'connections': connections}
+
+    def __getattr__(self, name):
+        """
+        Forward pycryptoki calls to one of the pooled connections.
+        """
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def wrapper(*args, **kwargs):
+            """
+            Route the call by session handle, see :py:class:`PooledRemotePycryptokiClient`.
+            """
+            return self._call(self._session_of(name, args, kwargs), None, name,
+                              args, kwargs)
+
+        return wrapper
+
+
 class LocalPycryptokiClient(object):
     """Class forwards calls to pycryptoki to local client but looks identical to remote
     client
@@ -241,7 +679,25 @@ class LocalPycryptokiClient(object):
 
     def __init__(self):
         """Nothing really to do"""
-        pass
+        self.streams = StreamTable()
+
+    def encrypt_stream(self, h_session, h_key, mechanism, chunks, window=None):
+        """
+        Encrypt data chunk by chunk, yielding the encrypted data as it's produced.
+        ``window`` is only used by the remote client.
+
+        :return: Generator of bytes
+        """
+        return run_stream(self.streams, 'encrypt', h_session, h_key, mechanism, chunks)
+
+    def decrypt_stream(self, h_session, h_key, mechanism, chunks, window=None):
+        """
+        Decrypt data chunk by chunk, yielding the decrypted data as it's produced.
+        ``window`` is only used by the remote client.
+
+        :return: Generator of bytes
+        """
+        return run_stream(self.streams, 'decrypt', h_session, h_key, mechanism, chunks)
 
     def __getattr__(self, name):
         """
@@ -251,6 +707,20 @@ class LocalPycryptokiClient(object):
         LOG.info("Running local pycryptoki command: {0}".format(name))
         return getattr(rpyc_pycryptoki, name)
 
+    def batch(self, calls, stop_on_error=False):
+        """
+        Run several pycryptoki calls, mirroring :py:meth:`RemotePycryptokiClient.batch`.
+        """
+        return rpyc_pycryptoki.run_batch(calls, stop_on_error)
+
+    def bulk_call(self, name, *args, **kwargs):
+        """
+        Call a bulk-data function, mirroring :py:meth:`RemotePycryptokiClient.bulk_call`.
+        """
+        if name not in rpyc_pycryptoki.BULK_OPS:
+            raise AttributeError("'{}' has no bulk-data endpoint".format(name))
+        return rpyc_pycryptoki.BULK_OPS[name][0](*args, **kwargs)
+
     def kill(self):
         """ """
         # nothing to do here, maybe we should unload and reload the dll
@@ -24,6 +24,7 @@ from .cryptoki import (CK_ULONG,
 # Cryptoki Functions
 from .cryptoki import (C_Initialize,
                        C_GetSlotList,
+                       C_WaitForSlotEvent,
                        C_GetSlotInfo,
                        C_CloseAllSessions,
                        C_GetSessionInfo,
@@ -45,12 +46,14 @@ from .cryptoki import (C_Initialize,
                        JC_KT2_SetSignaturePIN,
                        JC_KT2_ChangeSignaturePIN)
 
-from .defines import CKR_OK, CKF_RW_SESSION, CKF_SERIAL_SESSION
+from .defines import CKR_OK, CKF_RW_SESSION, CKF_SERIAL_SESSION, CKF_DONT_BLOCK
 from .exceptions import make_error_handle_function, LunaCallException
+from .tracing import traced
 
 LOG = logging.getLogger(__name__)
 
 
+@traced
 def c_initialize(flags=None, init_struct=None):
     """Initializes current process for use with PKCS11.
 
@@ -82,6 +85,7 @@ def c_initialize(flags=None, init_struct=None):
 c_initialize_ex = make_error_handle_function(c_initialize)
 
 
+@traced
 def c_finalize():
     """Finalizes PKCS11 library.
 
@@ -95,6 +99,7 @@ def c_finalize():
 c_finalize_ex = make_error_handle_function(c_finalize)
 
 
+@traced
 def c_open_session(slot_num, flags=(CKF_SERIAL_SESSION | CKF_RW_SESSION)):
     """Opens a session on the given slot
 
@@ -120,6 +125,7 @@ def c_open_session(slot_num, flags=(CKF_SERIAL_SESSION | CKF_RW_SESSION)):
 c_open_session_ex = make_error_handle_function(c_open_session)
 
 
+@traced
 def login(h_session, slot_num=1, password=None, user_type=1):
     """Login to the given session.
 
@@ -204,6 +210,22 @@ def c_get_slot_list(token_present=True):
 c_get_slot_list_ex = make_error_handle_function(c_get_slot_list)
 
 
+def c_wait_for_slot_event(flags=CKF_DONT_BLOCK):
+    """
+    Check for (or, without CKF_DONT_BLOCK, wait for) a slot event such as
+    token insertion or removal.
+
+    :param int flags: CKF_DONT_BLOCK to return CKR_NO_EVENT instead of blocking
+    :return: (retcode, slot id of the event)
+    """
+    slot = CK_SLOT_ID()
+    ret = C_WaitForSlotEvent(CK_FLAGS(flags), byref(slot), None)
+    return ret, slot.value
+
+
+c_wait_for_slot_event_ex = make_error_handle_function(c_wait_for_slot_event)
+
+
 def c_get_slot_info(slot):
     """
     Get information about the given slot number.
@@ -323,6 +345,7 @@ def get_slot_dict(token_present=False):
 get_slot_dict_ex = make_error_handle_function(get_slot_dict)
 
 
+@traced
 def c_close_session(h_session):
     """Closes a session
 
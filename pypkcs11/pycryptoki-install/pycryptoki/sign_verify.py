@@ -19,10 +19,12 @@ from .encryption import MAX_BUFFER
 from .exceptions import make_error_handle_function
 from .lookup_dicts import ret_vals_dictionary
 from .mechanism import parse_mechanism
+from .tracing import traced
 
 LOG = logging.getLogger(__name__)
 
 
+@traced
 def c_sign(h_session, h_key, data_to_sign, mechanism, output_buffer=None):
     """Signs the given data with given key and mechanism.
 
@@ -204,6 +206,7 @@ def do_multipart_verify(h_session, input_data_list, signature):
     return ret
 
 
+@traced
 def c_verify(h_session, h_key, data_to_verify, signature, mechanism):
     """Verifies data with the given signature, key and mechanism.
 
@@ -0,0 +1,328 @@
+"""
+Optional tracing of pycryptoki operations.
+
+When enabled, each call to a high-level pycryptoki function decorated with :py:func:`traced`
+(``c_encrypt``, ``login``, ``c_find_objects``...) produces a span, and each underlying
+``C_*``/``CA_*`` library call a child span of it. Spans carry attributes like the mechanism
+name, slot, data size and return code, and are written by a local exporter -- no collector
+needed::
+
+    from pycryptoki import tracing
+
+    tracing.enable(tracing.ChromeTraceExporter("trace.json"))
+    ...
+    tracing.disable()   # Writes trace.json, open it in chrome://tracing or Perfetto.
+
+Use :py:func:`span` to group calls under a span of your own (a test step, for instance).
+When tracing is disabled, decorated functions only pay for a single ``is None`` check.
+"""
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from timeit import default_timer
+
+from six import binary_type, integer_types
+
+from .cryptoki_helpers import register_call_hook, unregister_call_hook
+from .exceptions import unwrap_function
+from .lookup_dicts import MECH_NAME_LOOKUP, ret_vals_dictionary
+
+# Arguments recorded as span attributes, by argument name.
+SLOT_ARGS = ('slot', 'slot_num', 'slot_id')
+MECHANISM_ARGS = ('mechanism', 'digest_flavor')
+DATA_ARGS = ('data', 'encrypted_data', 'data_to_sign', 'data_to_verify', 'data_to_digest',
+             'wrapped_key')
+
+_exporter = None
+_local = threading.local()
+_span_ids = itertools.count(1)
+
+
+class Span(object):
+    """
+    A timed operation. ``kind`` is ``pycryptoki`` for decorated functions, ``cryptoki`` for
+    library calls, or anything passed to :py:func:`span`.
+    """
+
+    def __init__(self, name, kind, parent=None, start=None):
+        self.name = name
+        self.kind = kind
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.start = time.time() if start is None else start
+        self.duration = None
+        self.attributes = {}
+        self.pid = os.getpid()
+        self.thread_id = threading.current_thread().ident
+        self._timer = default_timer()
+
+    def finish(self):
+        """Record the span's duration."""
+        self.duration = default_timer() - self._timer
+
+    def to_dict(self):
+        """
+        :return: dict representation of the span, times in seconds.
+        """
+        return {'name': self.name,
+                'kind': self.kind,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'start': self.start,
+                'duration': self.duration,
+                'pid': self.pid,
+                'thread_id': self.thread_id,
+                'attributes': self.attributes}
+
+
+class JsonLinesExporter(object):
+    """
+    Write each finished span as one JSON object per line.
+
+    :param str path: File to append to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        """Write a finished span."""
+        line = json.dumps(span.to_dict(), default=repr)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        """Close the file."""
+        with self._lock:
+            self._file.close()
+
+
+class ChromeTraceExporter(object):
+    """
+    Collect spans and write them in the Chrome trace event format on :py:meth:`close`.
+    Load the file in ``chrome://tracing`` or https://ui.perfetto.dev.
+
+    :param str path: File to write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        """Add a finished span as a complete ("X") event."""
+        event = {'name': span.name,
+                 'cat': span.kind,
+                 'ph': 'X',
+                 'ts': span.start * 1e6,
+                 'dur': span.duration * 1e6,
+                 'pid': span.pid,
+                 'tid': span.thread_id,
+                 'args': span.attributes}
+        with self._lock:
+            self.events.append(event)
+
+    def close(self):
+        """Write the trace file."""
+        with self._lock:
+            with open(self.path, "w") as trace_file:
+                json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, trace_file,
+                          default=repr)
+
+
+def enable(exporter):
+    """
+    Start tracing.
+
+    :param exporter: Object with ``export(span)`` and ``close()`` methods, e.g.
+        :py:class:`JsonLinesExporter` or :py:class:`ChromeTraceExporter`.
+    """
+    global _exporter
+    disable()
+    _exporter = exporter
+    register_call_hook(_trace_library_call)
+
+
+def disable():
+    """
+    Stop tracing and close the exporter.
+    """
+    global _exporter
+    exporter, _exporter = _exporter, None
+    unregister_call_hook(_trace_library_call)
+    if exporter is not None:
+        exporter.close()
+
+
+def is_enabled():
+    """
+    :return: True if tracing is enabled.
+    """
+    return _exporter is not None
+
+
+def current_span():
+    """
+    :return: The innermost open span of this thread, or None.
+    """
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def _start_span(name, kind):
+    span = Span(name, kind, parent=current_span())
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    _local.stack.append(span)
+    return span
+
+
+def _end_span(span):
+    span.finish()
+    _local.stack.remove(span)
+    exporter = _exporter
+    if exporter is not None:
+        exporter.export(span)
+
+
+@contextmanager
+def span(name, kind="user", **attributes):
+    """
+    Context manager creating a span around a block of code. Does nothing when tracing is
+    disabled.
+
+    :param str name: Span name
+    :param str kind: Span kind
+    :param attributes: Span attributes
+    :return: The :py:class:`Span`, or None if tracing is disabled.
+    """
+    if _exporter is None:
+        yield None
+        return
+    new_span = _start_span(name, kind)
+    new_span.attributes.update(attributes)
+    try:
+        yield new_span
+    except Exception as exc:
+        new_span.attributes['error'] = repr(exc)
+        raise
+    finally:
+        _end_span(new_span)
+
+
+def _mechanism_name(mechanism):
+    """
+    :return: Name of a mechanism given as an int, a dict, a Mechanism or a CK_MECHANISM.
+    """
+    if isinstance(mechanism, dict):
+        mechanism = mechanism.get('mech_type')
+    elif not isinstance(mechanism, integer_types):
+        mechanism = getattr(mechanism, 'mech_type', getattr(mechanism, 'mechanism', None))
+    if isinstance(mechanism, integer_types):
+        return MECH_NAME_LOOKUP.get(mechanism, hex(mechanism))
+    return None
+
+
+def _data_size(data):
+    """
+    :return: Size in bytes of data given as bytes or a list of bytes, or None.
+    """
+    if isinstance(data, binary_type):
+        return len(data)
+    if isinstance(data, (list, tuple)) and all(isinstance(chunk, binary_type) for chunk in data):
+        return sum(len(chunk) for chunk in data)
+    return None
+
+
+def call_attributes(func, args, kwargs):
+    """
+    Extract span attributes from the arguments of a pycryptoki function call.
+
+    :return: dict of attributes
+    """
+    try:
+        call_args = inspect.getcallargs(unwrap_function(func), *args, **kwargs)
+    except TypeError:
+        return {}
+    attributes = {}
+    if isinstance(call_args.get('h_session'), integer_types):
+        attributes['session'] = call_args['h_session']
+    for name in SLOT_ARGS:
+        if isinstance(call_args.get(name), integer_types):
+            attributes['slot'] = call_args[name]
+    for name in MECHANISM_ARGS:
+        mechanism = _mechanism_name(call_args.get(name))
+        if mechanism is not None:
+            attributes['mechanism'] = mechanism
+    for name in DATA_ARGS:
+        size = _data_size(call_args.get(name))
+        if size is not None:
+            attributes['data_size'] = size
+            if isinstance(call_args[name], (list, tuple)):
+                attributes['chunks'] = len(call_args[name])
+    return attributes
+
+
+def _set_return_code(span, ret):
+    """Record the return code of a function returning ``ret`` or ``(ret, ...)``."""
+    if isinstance(ret, tuple) and ret:
+        ret = ret[0]
+    if isinstance(ret, integer_types):
+        span.attributes['ret'] = ret
+        span.attributes['ret_name'] = ret_vals_dictionary.get(ret, "Unknown retcode")
+
+
+def traced(func):
+    """
+    Decorator creating a span for every call of a pycryptoki function while tracing is
+    enabled.
+
+    :param func: Function to trace
+    """
+
+    @wraps(func)
+    def traced_function(*args, **kwargs):
+        """
+        Call the function inside a span.
+        """
+        if _exporter is None:
+            return func(*args, **kwargs)
+        new_span = _start_span(func.__name__, "pycryptoki")
+        new_span.attributes.update(call_attributes(func, args, kwargs))
+        try:
+            result = func(*args, **kwargs)
+            _set_return_code(new_span, result)
+            return result
+        except Exception as exc:
+            new_span.attributes['error'] = repr(exc)
+            raise
+        finally:
+            _end_span(new_span)
+
+    traced_function.__wrapped__ = func
+    return traced_function
+
+
+def _trace_library_call(function_name, args, return_value, start, duration, exception):
+    """Call hook adding a span for a PKCS11 library call, under the current span."""
+    exporter = _exporter
+    if exporter is None:
+        return
+    library_span = Span(function_name, "cryptoki", parent=current_span(), start=start)
+    library_span.duration = duration
+    if exception is not None:
+        library_span.attributes['error'] = repr(exception)
+    else:
+        _set_return_code(library_span, return_value)
+    exporter.export(library_span)
@@ -0,0 +1,46 @@
+"""
+Unit tests for the micro-benchmark runner & its regression gating.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "benchmarks"))
+import run_benchmarks  # noqa: E402
+from run_benchmarks import compare  # noqa: E402
+
+
+class TestCompare(object):
+
+    def test_regression(self):
+        regressions = compare({'fast': 1.0, 'slow': 1.5}, {'fast': 1.0, 'slow': 1.0}, 0.25)
+        assert regressions == [('slow', 1.5, 1.0, pytest.approx(0.5))]
+
+    def test_within_threshold(self):
+        assert compare({'bench': 1.2, 'faster': 0.5}, {'bench': 1.0, 'faster': 1.0}, 0.25) == []
+
+    def test_missing_baseline(self):
+        assert compare({'new': 2.0, 'zero': 1.0}, {'zero': 0.0}, 0.25) == []
+
+
+class TestRun(object):
+
+    def test_benchmarks_are_isolated(self, monkeypatch):
+        sizes = []
+
+        def count_objects(session):
+            sizes.append(len(run_benchmarks.c_find_objects_ex(session, {}, 5000)))
+            return lambda: None
+
+        monkeypatch.setattr(run_benchmarks, "BENCHMARKS",
+                            [run_benchmarks.find_objects_page_10, run_benchmarks.encrypt_single_part,
+                             count_objects])
+        results = run_benchmarks.run(min_time=0.001, repeat=1)
+        assert set(results) == {"find_objects_page_10", "encrypt_single_part", "count_objects"}
+        assert sizes == [0]
+
+    def test_subset(self):
+        results = run_benchmarks.run(["find_objects_page_1000"], min_time=0.001, repeat=1)
+        assert list(results) == ["find_objects_page_1000"]
+        assert results["find_objects_page_1000"] > 0
@@ -0,0 +1,80 @@
+"""
+Unit tests for the per-function PKCS11 call statistics.
+"""
+import json
+
+import pytest
+import mock
+from hypothesis import given
+from hypothesis.strategies import integers
+
+from pycryptoki import call_stats, cryptoki_helpers
+from pycryptoki.call_stats import LatencyHistogram
+from pycryptoki.cryptoki_helpers import CryptokiDLLException, make_late_binding_function
+
+
+@pytest.fixture
+def stats():
+    dll = mock.Mock()
+    dll.C_GetTokenInfo.return_value = 0
+    dll.C_Login.return_value = 0x000000A0
+    dll.C_Broken.side_effect = OSError("segfault-ish")
+    with mock.patch.object(cryptoki_helpers, "CryptokiDLLSingleton") as singleton:
+        singleton.return_value.get_dll.return_value = dll
+        call_stats.reset()
+        call_stats.enable()
+        try:
+            yield call_stats
+        finally:
+            call_stats.disable()
+            call_stats.reset()
+
+
+def _function(name):
+    func = make_late_binding_function(name)
+    func.restype = None
+    func.argtypes = None
+    return func
+
+
+class TestCallStats(object):
+
+    @given(integers(min_value=0, max_value=10 ** 9))
+    def test_bucket_bounds(self, value):
+        lowest, highest = LatencyHistogram.bucket_bounds(LatencyHistogram.bucket_index(value))
+        assert lowest <= value <= highest
+        assert highest - lowest <= max(1, value // 16)
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for micros in range(1, 1001):
+            histogram.record(micros / 1e6)
+        assert histogram.percentile(50) == pytest.approx(500e-6, rel=0.07)
+        assert histogram.percentile(99) == pytest.approx(990e-6, rel=0.07)
+        assert histogram.percentile(100) == pytest.approx(1000e-6)
+
+    def test_records_calls(self, stats):
+        _function("C_GetTokenInfo")(1)
+        _function("C_GetTokenInfo")(2)
+        _function("C_Login")(1)
+        with pytest.raises(CryptokiDLLException):
+            _function("C_Broken")()
+
+        result = json.loads(stats.to_json())
+        assert result["C_GetTokenInfo"]["count"] == 2
+        assert result["C_GetTokenInfo"]["errors"] == 0
+        assert result["C_Login"]["errors"] == 1
+        assert result["C_Broken"]["errors"] == 1
+
+    def test_disabled(self, stats):
+        stats.disable()
+        _function("C_GetTokenInfo")(1)
+        assert stats.get_stats() == {}
+
+    def test_prometheus(self, stats):
+        _function("C_GetTokenInfo")(1)
+        text = stats.to_prometheus()
+        assert 'pycryptoki_call_duration_seconds_count{function="C_GetTokenInfo"} 1' in text
+        assert 'pycryptoki_call_duration_seconds_bucket{function="C_GetTokenInfo",le="+Inf"} 1' \
+            in text
+        assert 'pycryptoki_call_errors_total{function="C_GetTokenInfo"} 0' in text
@@ -0,0 +1,63 @@
+"""
+Unit tests for the batch endpoint of the pycryptoki daemon.
+"""
+import pickle
+
+import mock
+
+from pycryptoki.daemon import rpyc_pycryptoki
+from pycryptoki.daemon.rpyc_pycryptoki import PycryptokiService, run_batch
+from pycryptoki.exceptions import LunaCallException
+
+
+def _raise_luna(*args, **kwargs):
+    raise LunaCallException(0x00000005, "c_generate_random", "()")
+
+
+class TestBatch(object):
+
+    def test_results_in_order(self):
+        with mock.patch.object(PycryptokiService, "exposed_c_generate_random_ex",
+                               staticmethod(lambda h_session, length: b"\x00" * length)):
+            results = run_batch([("c_generate_random_ex", (1, 4)),
+                                 ("c_generate_random_ex", (), {"h_session": 1, "length": 2})])
+
+        assert [entry['result'] for entry in results] == [b"\x00" * 4, b"\x00" * 2]
+        assert all(entry['error'] is None for entry in results)
+
+    def test_error_recorded_and_continues(self):
+        with mock.patch.object(PycryptokiService, "exposed_c_generate_random_ex",
+                               staticmethod(_raise_luna)):
+            results = run_batch([("c_generate_random_ex", (1, 4)),
+                                 ("not_a_function",),
+                                 ("to_bool", (True,))])
+
+        assert len(results) == 3
+        assert results[0]['error_code'] == 0x00000005
+        assert "LunaCallException" in results[0]['error']
+        assert "AttributeError" in results[1]['error']
+        assert results[2]['error'] is None
+
+    def test_stop_on_error(self):
+        with mock.patch.object(PycryptokiService, "exposed_c_generate_random_ex",
+                               staticmethod(_raise_luna)):
+            results = run_batch([("to_bool", (True,)),
+                                 ("c_generate_random_ex", (1, 4)),
+                                 ("to_bool", (True,))],
+                                stop_on_error=True)
+
+        assert len(results) == 2
+        assert results[-1]['name'] == "c_generate_random_ex"
+
+    def test_exposed_batch_pickled_round_trip(self):
+        payload = pickle.dumps([("c_get_slot_list_ex",)], protocol=2)
+        with mock.patch.object(PycryptokiService, "exposed_c_get_slot_list_ex",
+                               staticmethod(lambda: [0, 1])):
+            results = pickle.loads(PycryptokiService().exposed_batch(payload))
+        assert results == [{'name': "c_get_slot_list_ex", 'result': [0, 1],
+                            'error': None, 'error_code': None}]
+
+    def test_unpicklable_result(self):
+        results = [{'name': 'func', 'result': lambda: None, 'error': None, 'error_code': None}]
+        decoded = pickle.loads(rpyc_pycryptoki._encode_batch_results(results))
+        assert "could not be pickled" in decoded[0]['error']
@@ -0,0 +1,138 @@
+"""
+Unit tests for the fake PKCS11 library, run through the regular pycryptoki functions.
+"""
+import hashlib
+import time
+
+import pytest
+
+from pycryptoki.cryptoki_helpers import CryptokiDLLSingleton, CRYSTOKI_CONF_DLL
+from pycryptoki.default_templates import CKM_AES_KEY_GEN_TEMP, \
+    CKM_RSA_PKCS_KEY_PAIR_GEN_PUBTEMP, CKM_RSA_PKCS_KEY_PAIR_GEN_PRIVTEMP
+from pycryptoki.defines import CKM_AES_KEY_GEN, CKM_AES_CBC, CKM_RSA_PKCS_KEY_PAIR_GEN, \
+    CKM_SHA256_RSA_PKCS, CKM_SHA256, CKA_CLASS, CKA_LABEL, CKA_TOKEN, CKO_SECRET_KEY, CKU_USER, \
+    CKR_OK, CKR_PIN_INCORRECT, CKR_SIGNATURE_INVALID, CKR_SESSION_HANDLE_INVALID, \
+    CKR_CRYPTOKI_NOT_INITIALIZED, CKR_FUNCTION_NOT_SUPPORTED
+from pycryptoki.encryption import c_encrypt_ex, c_decrypt_ex
+from pycryptoki.exceptions import LunaCallException
+from pycryptoki.fake_cryptoki import FakeCryptoki
+from pycryptoki.key_generator import c_generate_key_ex, c_generate_key_pair_ex, \
+    c_destroy_object_ex
+from pycryptoki.misc import c_digest_ex, c_generate_random_ex
+from pycryptoki.object_attr_lookup import c_find_objects_ex, c_get_attribute_value_ex, \
+    c_set_attribute_value_ex, c_find_all_objects_ex
+from pycryptoki.session_management import c_initialize_ex, c_finalize_ex, \
+    c_open_session_ex, c_close_session_ex, c_get_token_info_ex, login, login_ex, \
+    c_get_session_info, c_close_session
+from pycryptoki.sign_verify import c_sign_ex, c_verify
+from pycryptoki.token_management import c_get_mechanism_list
+
+
+@pytest.fixture
+def fake():
+    with FakeCryptoki(password=b"userpin") as fake_library:
+        c_initialize_ex()
+        yield fake_library
+
+
+@pytest.fixture
+def session(fake):
+    h_session = c_open_session_ex(1)
+    login_ex(h_session, 1, b"userpin", CKU_USER)
+    return h_session
+
+
+class TestFakeCryptoki(object):
+
+    def test_install(self):
+        previous = CryptokiDLLSingleton._instance_map.get(CRYSTOKI_CONF_DLL)
+        with FakeCryptoki() as fake_library:
+            assert CryptokiDLLSingleton().get_dll() is fake_library
+        assert CryptokiDLLSingleton._instance_map.get(CRYSTOKI_CONF_DLL) is previous
+
+    def test_not_initialized(self):
+        with FakeCryptoki():
+            with pytest.raises(LunaCallException) as excinfo:
+                c_open_session_ex(1)
+            assert excinfo.value.error_code == CKR_CRYPTOKI_NOT_INITIALIZED
+
+    def test_token_info(self, fake):
+        c_open_session_ex(1)
+        info = c_get_token_info_ex(1)
+        assert info['label'] == b"FakeToken"
+        assert info['ulSessionCount'] == 1
+
+    def test_sessions(self, fake):
+        h_session = c_open_session_ex(1)
+        assert login(h_session, 1, b"wrong", CKU_USER) == CKR_PIN_INCORRECT
+        c_close_session_ex(h_session)
+        assert c_close_session(h_session) == CKR_SESSION_HANDLE_INVALID
+        assert c_get_session_info(h_session)[0] == CKR_SESSION_HANDLE_INVALID
+        c_finalize_ex()
+        assert not fake.initialized
+
+    def test_objects(self, session):
+        key = c_generate_key_ex(session, CKM_AES_KEY_GEN, CKM_AES_KEY_GEN_TEMP)
+        other = c_generate_key_ex(session, CKM_AES_KEY_GEN, CKM_AES_KEY_GEN_TEMP)
+        assert c_get_attribute_value_ex(session, key, {CKA_LABEL: None}) == \
+            {CKA_LABEL: CKM_AES_KEY_GEN_TEMP[CKA_LABEL]}
+        c_set_attribute_value_ex(session, key, {CKA_LABEL: b"renamed"})
+        assert c_find_objects_ex(session, {CKA_LABEL: b"renamed"}, 10) == [key]
+        assert c_find_objects_ex(session, {CKA_CLASS: CKO_SECRET_KEY}, 1) == [key]
+        c_destroy_object_ex(session, key)
+        assert c_find_objects_ex(session, {CKA_CLASS: CKO_SECRET_KEY}, 10) == [other]
+
+    def test_session_objects_go_with_session(self, session):
+        template = dict(CKM_AES_KEY_GEN_TEMP)
+        template[CKA_LABEL] = b"ephemeral"
+        template[CKA_TOKEN] = False
+        c_generate_key_ex(session, CKM_AES_KEY_GEN, template)
+        other = c_open_session_ex(1)
+        assert c_find_objects_ex(other, {CKA_LABEL: b"ephemeral"}, 10) == []
+        c_close_session_ex(session)
+        assert c_find_objects_ex(other, {CKA_LABEL: b"ephemeral"}, 10) == []
+
+    def test_find_all_objects(self, session):
+        template = dict(CKM_AES_KEY_GEN_TEMP)
+        template[CKA_LABEL] = b"paged"
+        keys = [c_generate_key_ex(session, CKM_AES_KEY_GEN, template) for _ in range(25)]
+        assert len(c_find_objects_ex(session, {CKA_LABEL: b"paged"}, 10)) == 10
+        for page_size in (1, 10, 25, 100):
+            assert c_find_all_objects_ex(session, {CKA_LABEL: b"paged"}, page_size) == keys
+        assert c_find_all_objects_ex(session, {CKA_LABEL: b"none"}) == []
+
+    def test_random_and_digest(self, session):
+        assert len(c_generate_random_ex(session, 32)) == 32
+        assert c_digest_ex(session, b"abc", CKM_SHA256) == hashlib.sha256(b"abc").digest()
+        assert c_digest_ex(session, [b"a", b"bc"], CKM_SHA256) == \
+            hashlib.sha256(b"abc").digest()
+
+    def test_encrypt(self, session):
+        key = c_generate_key_ex(session, CKM_AES_KEY_GEN, CKM_AES_KEY_GEN_TEMP)
+        data = b"x" * 100
+        encrypted = c_encrypt_ex(session, key, data, CKM_AES_CBC)
+        assert encrypted != data and len(encrypted) == len(data)
+        assert c_encrypt_ex(session, key, [data[:30], data[30:]], CKM_AES_CBC) == encrypted
+        assert c_decrypt_ex(session, key, encrypted, CKM_AES_CBC) == data
+        assert c_decrypt_ex(session, key, [encrypted[:64], encrypted[64:]],
+                            CKM_AES_CBC) == data
+
+    def test_sign(self, session):
+        public, private = c_generate_key_pair_ex(session, CKM_RSA_PKCS_KEY_PAIR_GEN,
+                                                 CKM_RSA_PKCS_KEY_PAIR_GEN_PUBTEMP,
+                                                 CKM_RSA_PKCS_KEY_PAIR_GEN_PRIVTEMP)
+        signature = c_sign_ex(session, private, b"data", CKM_SHA256_RSA_PKCS)
+        assert c_sign_ex(session, private, [b"da", b"ta"], CKM_SHA256_RSA_PKCS) == signature
+        assert c_verify(session, public, b"data", signature, CKM_SHA256_RSA_PKCS) == CKR_OK
+        assert c_verify(session, public, b"atad", signature,
+                        CKM_SHA256_RSA_PKCS) == CKR_SIGNATURE_INVALID
+
+    def test_unsupported(self, fake):
+        assert c_get_mechanism_list(1)[0] == CKR_FUNCTION_NOT_SUPPORTED
+
+    def test_latency(self):
+        with FakeCryptoki(latencies={'C_Initialize': 0.05}) as fake_library:
+            start = time.time()
+            c_initialize_ex()
+            assert time.time() - start >= 0.05
+            assert fake_library.call_counts['C_Initialize'] == 1
@@ -0,0 +1,165 @@
+"""
+Unit tests for the load generator.
+"""
+import itertools
+import json
+import os
+import time
+
+import pytest
+
+from pycryptoki import luna_threading
+from pycryptoki.call_stats import LatencyHistogram
+from pycryptoki.defines import CKR_SESSION_HANDLE_INVALID, CKU_USER
+from pycryptoki.exceptions import LunaCallException
+from pycryptoki.fake_cryptoki import FakeCryptoki
+from pycryptoki.luna_threading import Workload, WorkloadResult, run_load, format_report
+from pycryptoki.session_management import c_initialize_ex, c_open_session_ex, login_ex
+
+
+class FakeWorkload(Workload):
+    """Fails every third iteration with a cryptoki error, and every fifth with a ValueError."""
+    name = "fake"
+
+    def __init__(self, slot, password=None):
+        super(FakeWorkload, self).__init__(slot, password)
+        self.iterations = itertools.count(1)
+        self.torn_down = False
+
+    def setup(self):
+        pass
+
+    def run_once(self):
+        iteration = next(self.iterations)
+        if iteration % 3 == 0:
+            raise LunaCallException(CKR_SESSION_HANDLE_INVALID, "C_Fake", ())
+        if iteration % 5 == 0:
+            raise ValueError("bad")
+
+    def teardown(self):
+        self.torn_down = True
+
+
+@pytest.fixture
+def fake_workload():
+    luna_threading.register_workload(FakeWorkload)
+    yield FakeWorkload
+    del luna_threading.WORKLOADS[FakeWorkload.name]
+
+
+class TestLoadGeneration(object):
+
+    def test_report(self, fake_workload):
+        report = run_load(["fake"], slot=1, threads=3, duration=0.2)
+        result = report['workloads']['fake']
+        assert report['threads'] == 3
+        assert result['ops'] > 0
+        assert result['throughput'] > 0
+        assert result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+        assert set(result['errors']) == {"CKR_SESSION_HANDLE_INVALID", "ValueError"}
+        assert result['error_count'] == sum(result['errors'].values())
+        json.dumps(report)
+        assert "CKR_SESSION_HANDLE_INVALID" in format_report(report)
+
+    def test_unknown_workload(self):
+        with pytest.raises(ValueError):
+            run_load(["nope"], slot=1, duration=0)
+
+    def test_setup_failure(self, fake_workload):
+        def setup(self):
+            raise RuntimeError("no token")
+
+        fake_workload.setup = setup
+        try:
+            result = run_load(["fake"], slot=1, threads=2, duration=0.05)['workloads']['fake']
+        finally:
+            del fake_workload.setup
+        assert result['ops'] == 0
+        assert result['errors'] == {"RuntimeError": 2}
+        assert result['p50_ms'] is None
+
+    def test_logged_in_threads(self):
+        with FakeCryptoki(password=b"userpin") as fake:
+            c_initialize_ex()
+            report = run_load(["encrypt", "token_info"], 1, b"userpin", threads=4,
+                              duration=0.1)
+            assert not fake.logged_in
+            assert not fake.sessions
+        for result in report['workloads'].values():
+            assert result['ops'] > 0
+            assert result['errors'] == {}
+
+    def test_already_logged_in(self):
+        with FakeCryptoki(password=b"userpin") as fake:
+            c_initialize_ex()
+            h_session = c_open_session_ex(1)
+            login_ex(h_session, 1, b"userpin", CKU_USER)
+            report = run_load(["encrypt"], 1, b"userpin", threads=2, duration=0.05)
+            assert fake.logged_in == {1: CKU_USER}
+        assert report['workloads']['encrypt']['errors'] == {}
+
+    def test_wrong_password(self):
+        with FakeCryptoki(password=b"userpin") as fake:
+            c_initialize_ex()
+            with pytest.raises(LunaCallException):
+                run_load(["encrypt"], 1, b"wrong", threads=2, duration=0.05)
+            assert not fake.sessions
+
+    def test_processes(self, fake_workload):
+        with FakeCryptoki():
+            report = run_load(["fake"], 1, threads=2, processes=2, duration=0.1)
+        assert report['workloads']['fake']['ops'] > 0
+        assert set(report['workloads']['fake']['errors']) == {"CKR_SESSION_HANDLE_INVALID",
+                                                              "ValueError"}
+
+    def test_process_initialize_failure(self, fake_workload):
+        # Without the fake, the child can't load the library
+        report = run_load(["fake"], 1, processes=2, duration=0.05)
+        result = report['workloads']['fake']
+        assert result['ops'] == 0
+        assert result['error_count'] == 2
+
+    def test_process_crash(self, fake_workload, monkeypatch):
+        monkeypatch.setattr(fake_workload, "run_once", lambda self: os._exit(3), raising=False)
+        with FakeCryptoki():
+            report = run_load(["fake"], 1, processes=2, duration=0.05)
+        assert report['workloads']['fake']['errors'] == {"process exited with code 3": 2}
+
+    def test_process_timeout(self, fake_workload, monkeypatch):
+        monkeypatch.setattr(fake_workload, "run_once", lambda self: time.sleep(60), raising=False)
+        monkeypatch.setattr(luna_threading, "PROCESS_MARGIN", 0.5)
+        with FakeCryptoki():
+            report = run_load(["fake"], 1, processes=2, duration=0.05)
+        assert report['workloads']['fake']['errors'] == {"process timed out": 2}
+        assert report['duration'] < 30
+
+    def test_merge(self):
+        first, second = WorkloadResult("x"), WorkloadResult("x")
+        for duration in (0.001, 0.002):
+            first.latency.record(duration)
+        second.latency.record(0.5)
+        second.record_error(ValueError())
+        first.merge(second)
+        assert first.latency.count == 3
+        assert first.latency.max == 0.5
+        assert first.latency.min == 0.001
+        assert first.errors == {"ValueError": 1}
+
+
+class TestHistogramMerge(object):
+
+    def test_merge_matches_single_histogram(self):
+        values = [i / 10000.0 for i in range(1, 200)]
+        single, left, right = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for index, value in enumerate(values):
+            single.record(value)
+            (left if index % 2 else right).record(value)
+        left.merge(right)
+        assert left.counts == single.counts
+        assert left.percentile(99) == single.percentile(99)
+
+    def test_merge_empty(self):
+        histogram = LatencyHistogram()
+        histogram.merge(LatencyHistogram())
+        assert histogram.count == 0
+        assert histogram.min is None
@@ -0,0 +1,141 @@
+"""
+Unit tests for the pooled remote pycryptoki client.
+"""
+import threading
+import time
+
+import pytest
+import mock
+
+from pycryptoki import pycryptoki_client
+from pycryptoki.defines import CKR_OK, CKR_TOKEN_NOT_PRESENT
+from pycryptoki.pycryptoki_client import PooledRemotePycryptokiClient
+
+
+class FakeClient(object):
+    """Stands in for a RemotePycryptokiClient; hands out unique session handles."""
+    handles = iter(range(1, 1000))
+
+    def __init__(self, ip=None, port=None):
+        self.started = True
+        self.calls = []
+        self.starts = 0
+
+    def start(self):
+        # Slow enough for concurrent health checks to overlap
+        time.sleep(0.05)
+        self.starts += 1
+        self.started = True
+
+    def kill(self):
+        self.started = False
+
+    def c_open_session_ex(self, slot_num, flags=None):
+        self.calls.append("c_open_session_ex")
+        return next(self.handles)
+
+    def c_open_session(self, slot_num, flags=None):
+        self.calls.append("c_open_session")
+        return (CKR_TOKEN_NOT_PRESENT, 0) if slot_num == 99 else (CKR_OK, next(self.handles))
+
+    def encrypt_stream(self, h_session, h_key, mechanism, chunks):
+        self.calls.append("encrypt_stream")
+        return (chunk.upper() for chunk in chunks)
+
+    def batch(self, calls, stop_on_error=False):
+        self.calls.append("batch")
+        return [{'name': name, 'result': next(self.handles), 'error': None, 'error_code': None}
+                for name, _, _ in calls]
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            return 0
+        return call
+
+
+@pytest.fixture
+def pool():
+    with mock.patch.object(pycryptoki_client, "RemotePycryptokiClient", FakeClient):
+        yield PooledRemotePycryptokiClient("localhost", 8001, size=3)
+
+
+class TestPooledClient(object):
+
+    def test_spreads_sessions(self, pool):
+        sessions = [pool.c_open_session_ex(0) for _ in range(3)]
+        assert [client.calls for client in pool.clients] == [["c_open_session_ex"]] * 3
+        assert pool.pool_stats()['sessions'] == 3
+        assert len(set(sessions)) == 3
+
+    def test_session_affinity(self, pool):
+        pool.c_open_session_ex(0)
+        h_session = pool.c_open_session_ex(0)
+        owner = pool.clients[1]
+        pool.c_generate_random_ex(h_session, 16)
+        pool.c_get_attribute_value(h_session=h_session, h_object=1, template={})
+        assert owner.calls == ["c_open_session_ex", "c_generate_random_ex",
+                               "c_get_attribute_value"]
+
+    def test_close_session(self, pool):
+        h_session = pool.c_open_session_ex(0)
+        other = pool.c_open_session_ex(1)
+        pool.c_close_session_ex(h_session)
+        assert pool.pool_stats()['sessions'] == 1
+        pool.c_close_all_sessions(1)
+        assert pool.pool_stats()['sessions'] == 0
+        assert other is not None
+
+    def test_dead_connection_drops_sessions(self, pool):
+        pool.health_check_interval = 0
+        h_session = pool.c_open_session_ex(0)
+        pool.clients[0].started = False
+        pool.c_generate_random_ex(h_session, 16)
+        stats = pool.pool_stats()
+        assert stats['sessions'] == 0
+        assert stats['connections'][0]['reconnects'] == 1
+        assert pool.clients[0].started
+
+    def test_batch_tracks_sessions(self, pool):
+        results = pool.batch([("c_open_session_ex", (0,))])
+        assert pool._sessions[results[0]['result']][0] == 0
+
+    def test_stats(self, pool):
+        pool.c_generate_random_ex(1, 16)
+        stats = pool.pool_stats()
+        assert stats['size'] == 3
+        assert stats['utilisation'] == 0.0
+        assert sum(conn['calls'] for conn in stats['connections']) == 1
+
+    def test_failed_open_not_tracked(self, pool):
+        assert pool.c_open_session(99)[0] == CKR_TOKEN_NOT_PRESENT
+        ret, h_session = pool.c_open_session(0)
+        assert ret == CKR_OK
+        assert list(pool._sessions) == [h_session]
+
+    def test_concurrent_reconnect(self, pool):
+        pool.clients[0].started = False
+        threads = [threading.Thread(target=pool.check_health, args=(0,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert pool.clients[0].starts == 1
+
+    def test_stream_reserves_connection(self, pool):
+        h_session = pool.c_open_session_ex(0)
+        stream = pool.encrypt_stream(h_session, 1, None, [b"a", b"b"])
+        assert next(stream) == b"A"
+        assert pool.pool_stats()['connections'][0]['in_use'] == 1
+        # The streaming connection isn't the least busy one anymore
+        pool.c_generate_random_ex(2, 16)
+        assert pool.clients[0].calls == ["c_open_session_ex", "encrypt_stream"]
+        assert list(stream) == [b"B"]
+        assert pool.pool_stats()['connections'][0]['in_use'] == 0
+
+    def test_closed_stream_released(self, pool):
+        stream = pool.encrypt_stream(1, 1, None, [b"a", b"b"])
+        next(stream)
+        assert pool.pool_stats()['utilisation'] > 0
+        stream.close()
+        assert pool.pool_stats()['utilisation'] == 0.0
@@ -0,0 +1,97 @@
+"""
+Unit tests for the daemon's streaming multipart operations.
+"""
+import pytest
+import mock
+from hypothesis import given
+from hypothesis.strategies import binary, lists
+
+from pycryptoki.daemon import streams
+from pycryptoki.daemon.rpyc_pycryptoki import PycryptokiService
+from pycryptoki.daemon.streams import StreamException, StreamTable, run_stream
+
+
+class FakeCipher(object):
+    """Reverses each chunk and emits a 1 byte final block; tracks active operations."""
+
+    def __init__(self):
+        self.active = set()
+
+    def init(self, h_session, h_key, mechanism):
+        self.active.add(h_session)
+        return 0
+
+    def update(self, h_session, data):
+        assert h_session in self.active
+        return data[::-1]
+
+    def final(self, h_session):
+        self.active.remove(h_session)
+        return b"!"
+
+    def abort(self, h_session):
+        self.active.discard(h_session)
+        return 0, b""
+
+    def ops(self):
+        return {'encrypt': (self.init, self.update, self.final, self.abort)}
+
+
+@pytest.fixture
+def cipher():
+    fake = FakeCipher()
+    with mock.patch.dict(streams.STREAM_OPS, fake.ops()):
+        yield fake
+
+
+class TestStreams(object):
+
+    @given(lists(binary(min_size=1), max_size=10))
+    def test_run_stream(self, chunks):
+        fake = FakeCipher()
+        with mock.patch.dict(streams.STREAM_OPS, fake.ops()):
+            table = StreamTable()
+            output = list(run_stream(table, 'encrypt', 1, 2, None, chunks))
+        assert output == [chunk[::-1] for chunk in chunks] + [b"!"]
+        assert len(table) == 0
+        assert not fake.active
+
+    def test_out_of_order_chunk(self, cipher):
+        table = StreamTable()
+        stream_id = table.open('encrypt', 1, 2, None)
+        table.push(stream_id, 0, b"ab")
+        with pytest.raises(StreamException):
+            table.push(stream_id, 2, b"cd")
+        assert len(table) == 0
+        assert not cipher.active
+
+    def test_limits(self, cipher):
+        table = StreamTable(max_streams=1, max_chunk_size=4)
+        stream_id = table.open('encrypt', 1, 2, None)
+        with pytest.raises(StreamException):
+            table.open('encrypt', 3, 2, None)
+        with pytest.raises(StreamException):
+            table.push(stream_id, 0, b"12345")
+        with pytest.raises(StreamException):
+            table.close(stream_id)
+
+    def test_one_stream_per_session(self, cipher):
+        table = StreamTable()
+        table.open('encrypt', 1, 2, None)
+        with pytest.raises(StreamException):
+            table.open('encrypt', 1, 2, None)
+
+    def test_abandoned_generator_aborts(self, cipher):
+        table = StreamTable()
+        gen = run_stream(table, 'encrypt', 1, 2, None, [b"ab", b"cd"])
+        assert next(gen) == b"ba"
+        gen.close()
+        assert len(table) == 0
+        assert not cipher.active
+
+    def test_service_disconnect_aborts(self, cipher):
+        service = PycryptokiService()
+        stream_id = service.exposed_encrypt_stream_open(1, 2, None)
+        assert service.exposed_stream_push(stream_id, 0, b"ab") == b"ba"
+        service.on_disconnect(None)
+        assert not cipher.active
@@ -0,0 +1,87 @@
+"""
+Unit tests for the daemon's supervisor mode.
+"""
+import pytest
+import mock
+
+from pycryptoki.daemon.supervisor import (MeteredPycryptokiService, PycryptokiSupervisor,
+                                          WorkerStats)
+from pycryptoki.exceptions import LunaCallException
+
+
+def _raise_luna(*args, **kwargs):
+    raise LunaCallException(0x00000005, "c_generate_random", "()")
+
+
+def _open_session(slot_num, flags=None):
+    return 0, slot_num
+
+
+def _login(h_session, slot_num=1, password=None, user_type=1):
+    return 0
+
+
+class TestSupervisor(object):
+
+    def test_worker_ports(self):
+        supervisor = PycryptokiSupervisor("localhost", 8001, {}, slots=[0, 3],
+                                          libraries=["/usr/lib/libOther.so"])
+        assert [worker.port for worker in supervisor.workers] == [8002, 8003, 8004]
+        assert supervisor.worker_for(slot=3).port == 8003
+        assert supervisor.worker_for(library="/usr/lib/libOther.so").port == 8004
+        with pytest.raises(LookupError):
+            supervisor.worker_for(slot=1)
+
+    def test_needs_workers(self):
+        with pytest.raises(ValueError):
+            PycryptokiSupervisor("localhost", 8001, {})
+
+    def test_metered_calls(self):
+        stats = WorkerStats()
+        with mock.patch.object(MeteredPycryptokiService, "stats", stats), \
+                mock.patch.object(MeteredPycryptokiService, "exposed_c_generate_random_ex",
+                                  staticmethod(_raise_luna), create=True):
+            service = MeteredPycryptokiService()
+            assert service._rpyc_getattr("to_bool")(True)
+            with pytest.raises(LunaCallException):
+                service._rpyc_getattr("c_generate_random_ex")(1, 4)
+
+        assert stats.calls.value == 2
+        assert stats.errors.value == 1
+        assert stats.in_flight.value == 0
+
+    def test_report(self):
+        supervisor = PycryptokiSupervisor("localhost", 8001, {}, slots=[0])
+        worker = supervisor.workers[0]
+        worker.stats.calls.value = 10
+        report = supervisor.stats()[0]
+        assert report['calls'] == 10
+        assert report['alive'] is False
+        assert report['in_flight'] == 0
+
+    def test_bound_slot(self):
+        stats = WorkerStats()
+        with mock.patch.object(MeteredPycryptokiService, "stats", stats), \
+                mock.patch.object(MeteredPycryptokiService, "slot", 3), \
+                mock.patch.object(MeteredPycryptokiService, "exposed_c_open_session",
+                                  staticmethod(_open_session)), \
+                mock.patch.object(MeteredPycryptokiService, "exposed_login",
+                                  staticmethod(_login)):
+            service = MeteredPycryptokiService()
+            assert service._rpyc_getattr("c_open_session")(3) == (0, 3)
+            assert service._rpyc_getattr("c_open_session")(slot_num=3) == (0, 3)
+            with pytest.raises(ValueError):
+                service._rpyc_getattr("c_open_session")(1)
+            with pytest.raises(ValueError):
+                service._rpyc_getattr("login")(5, slot_num=1, password=b"pin")
+            # Default slot_num & session handles aren't checked
+            assert service._rpyc_getattr("login")(5, password=b"pin") == 0
+        assert stats.errors.value == 2
+
+    def test_workers_bound_to_slot(self):
+        supervisor = PycryptokiSupervisor("localhost", 8001, {}, slots=[2],
+                                          libraries=["/usr/lib/libOther.so"])
+        with mock.patch("multiprocessing.Process") as process:
+            for worker in supervisor.workers:
+                worker.start(MeteredPycryptokiService, "localhost", {})
+        assert [call[1]['args'][-1] for call in process.call_args_list] == [2, None]
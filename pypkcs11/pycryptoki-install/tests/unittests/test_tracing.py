@@ -0,0 +1,111 @@
+"""
+Unit tests for pycryptoki tracing.
+"""
+import json
+
+import pytest
+import mock
+
+from pycryptoki import cryptoki_helpers, tracing
+from pycryptoki.cryptoki_helpers import make_late_binding_function
+from pycryptoki.defines import CKM_AES_CBC
+from pycryptoki.exceptions import LunaCallException, make_error_handle_function
+from pycryptoki.tracing import traced
+
+
+class ListExporter(object):
+
+    def __init__(self):
+        self.spans = []
+        self.closed = False
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def close(self):
+        self.closed = True
+
+
+def _library_function(name):
+    func = make_late_binding_function(name)
+    func.restype = None
+    func.argtypes = None
+    return func
+
+
+@traced
+def fake_encrypt(h_session, h_key, data, mechanism):
+    ret = _library_function("C_EncryptInit")(h_session)
+    if ret:
+        return ret, None
+    return _library_function("C_Encrypt")(h_session), data[::-1]
+
+
+fake_encrypt_ex = make_error_handle_function(fake_encrypt)
+
+
+@pytest.fixture
+def exporter():
+    dll = mock.Mock()
+    dll.C_EncryptInit.return_value = 0
+    dll.C_Encrypt.return_value = 0
+    spans = ListExporter()
+    with mock.patch.object(cryptoki_helpers, "CryptokiDLLSingleton") as singleton:
+        singleton.return_value.get_dll.return_value = dll
+        tracing.enable(spans)
+        try:
+            yield spans
+        finally:
+            tracing.disable()
+
+
+class TestTracing(object):
+
+    def test_nested_spans(self, exporter):
+        with tracing.span("step", test="encrypt"):
+            fake_encrypt(1, 2, b"data", {'mech_type': CKM_AES_CBC})
+
+        names = [span.name for span in exporter.spans]
+        assert names == ["C_EncryptInit", "C_Encrypt", "fake_encrypt", "step"]
+        by_name = {span.name: span for span in exporter.spans}
+        assert by_name["C_Encrypt"].parent_id == by_name["fake_encrypt"].span_id
+        assert by_name["fake_encrypt"].parent_id == by_name["step"].span_id
+        assert len(set(span.trace_id for span in exporter.spans)) == 1
+
+    def test_attributes(self, exporter):
+        fake_encrypt(1, 2, [b"da", b"ta"], CKM_AES_CBC)
+        attributes = exporter.spans[-1].attributes
+        assert attributes['mechanism'] == "CKM_AES_CBC"
+        assert attributes['data_size'] == 4
+        assert attributes['chunks'] == 2
+        assert attributes['session'] == 1
+        assert attributes['ret'] == 0
+        assert exporter.spans[0].attributes['ret_name'] == "CKR_OK"
+
+    def test_ex_function_args(self, exporter):
+        dll = cryptoki_helpers.CryptokiDLLSingleton.return_value.get_dll.return_value
+        dll.C_EncryptInit.return_value = 0x00000005
+        with pytest.raises(LunaCallException) as excinfo:
+            fake_encrypt_ex(1, 2, b"data", CKM_AES_CBC)
+        assert "h_key" in str(excinfo.value)
+        assert exporter.spans[-1].attributes['ret'] == 0x00000005
+
+    def test_disabled(self):
+        exporter = ListExporter()
+        tracing.enable(exporter)
+        tracing.disable()
+        assert exporter.closed
+        with tracing.span("nothing") as span:
+            assert span is None
+        assert fake_encrypt.__wrapped__ is not None
+
+    def test_chrome_exporter(self, tmpdir):
+        path = str(tmpdir.join("trace.json"))
+        tracing.enable(tracing.ChromeTraceExporter(path))
+        with tracing.span("step"):
+            pass
+        tracing.disable()
+        with open(path) as trace_file:
+            events = json.load(trace_file)['traceEvents']
+        assert events[0]['name'] == "step"
+        assert events[0]['ph'] == "X"
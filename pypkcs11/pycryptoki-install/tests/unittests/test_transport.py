@@ -0,0 +1,91 @@
+"""
+Unit tests for the daemon's bulk-data framing.
+"""
+import pytest
+from hypothesis import given
+from hypothesis.strategies import binary, lists
+import mock
+
+from pycryptoki.daemon import rpyc_pycryptoki
+from pycryptoki.daemon import transport
+from pycryptoki.daemon.rpyc_pycryptoki import PycryptokiService
+from pycryptoki.daemon.transport import (BulkTransportException, FLAG_COMPRESSED,
+                                         FRAME_HEADER, decode_frame, encode_frame)
+from pycryptoki.default_templates import CKM_AES_KEY_GEN_TEMP
+from pycryptoki.defines import CKM_AES_KEY_GEN, CKM_AES_CBC, CKU_USER
+from pycryptoki.encryption import c_encrypt_ex
+from pycryptoki.fake_cryptoki import FakeCryptoki
+from pycryptoki.key_generator import c_generate_key_ex
+from pycryptoki.session_management import c_initialize_ex, c_open_session_ex, login_ex
+
+
+def _fake_encrypt(h_session, h_key, data, mechanism, output_buffer=None):
+    if isinstance(data, list):
+        data = b"".join(data)
+    return 0, data[::-1]
+
+
+class TestTransport(object):
+
+    @given(binary())
+    def test_frame_round_trip(self, data):
+        payload, meta = decode_frame(encode_frame(data, {'key': 1}, threshold=16))
+        assert payload == data
+        assert meta == {'key': 1}
+
+    @given(lists(binary(), min_size=1))
+    def test_multipart_round_trip(self, chunks):
+        payload, _ = decode_frame(encode_frame(chunks))
+        assert payload == chunks
+
+    def test_compression_used_when_it_helps(self):
+        data = b"\x00" * (transport.COMPRESSION_THRESHOLD + 1)
+        frame = encode_frame(data)
+        assert FRAME_HEADER.unpack_from(frame)[1] & FLAG_COMPRESSED
+        assert len(frame) < len(data)
+        assert decode_frame(frame)[0] == data
+
+    def test_compression_skipped_below_threshold(self):
+        frame = encode_frame(b"\x00" * 10, threshold=100)
+        assert not FRAME_HEADER.unpack_from(frame)[1] & FLAG_COMPRESSED
+
+    @pytest.mark.parametrize("frame", [b"", b"XXXX" + b"\x00" * 17,
+                                       encode_frame(b"data")[:-1]])
+    def test_invalid_frames(self, frame):
+        with pytest.raises(BulkTransportException):
+            decode_frame(frame)
+
+    @pytest.mark.parametrize("result", [b"data", (0, b"data"), (0, None), (0, [1, 2]), 0])
+    def test_result_round_trip(self, result):
+        assert transport.decode_result(transport.encode_result(result)) == result
+
+    @pytest.mark.parametrize("data", [b"plaintext", [b"plain", b"text"]])
+    def test_bulk_call(self, data):
+        frame = transport.encode_call(_fake_encrypt, 'data', (1, 2, data), {'mechanism': 3})
+        with mock.patch.dict(rpyc_pycryptoki.BULK_OPS, {'c_encrypt': (_fake_encrypt, 'data')}):
+            result = PycryptokiService().exposed_bulk_call('c_encrypt', frame)
+        assert transport.decode_result(result) == (0, b"txetnialp")
+
+    @pytest.mark.parametrize("name", sorted(rpyc_pycryptoki.BULK_OPS))
+    def test_encode_call_names_arguments(self, name):
+        # _ex functions only expose (*args, **kwargs): the original signature must be used
+        func, payload_arg = rpyc_pycryptoki.BULK_OPS[name]
+        args = (1, b"bulk", 3) if name.startswith('ca_sim_insert') else (1, 2, b"bulk", 3)
+        kwargs, _ = transport.decode_call(transport.encode_call(func, payload_arg, args, {}))
+        assert kwargs[payload_arg] == b"bulk"
+        assert kwargs['h_session'] == 1
+        assert 'args' not in kwargs and 'kwargs' not in kwargs
+
+    def test_bulk_call_ex(self):
+        with FakeCryptoki(password=b"userpin"):
+            c_initialize_ex()
+            h_session = c_open_session_ex(1)
+            login_ex(h_session, 1, b"userpin", CKU_USER)
+            h_key = c_generate_key_ex(h_session, CKM_AES_KEY_GEN, CKM_AES_KEY_GEN_TEMP)
+            mechanism = {'mech_type': CKM_AES_CBC, 'params': {'iv': list(range(16))}}
+            data = [b"\x01" * 16, b"\x02" * 16]
+            frame = transport.encode_call(c_encrypt_ex, 'data', (h_session, h_key, data),
+                                          {'mechanism': mechanism})
+            result = PycryptokiService().exposed_bulk_call('c_encrypt_ex', frame)
+            assert transport.decode_result(result) == \
+                c_encrypt_ex(h_session, h_key, data, mechanism)
@@ -0,0 +1,67 @@
+"""
+Unit tests for the utilization metrics collector.
+"""
+import os
+import time
+
+import mock
+
+from pycryptoki.ca_extensions import utilization_collector
+from pycryptoki.ca_extensions.utilization_collector import (RotatingCsvWriter,
+                                                            UtilizationCollector)
+
+
+def _counters(*snapshots):
+    return mock.patch.object(utilization_collector, "ca_read_all_utilization_counters_ex",
+                             side_effect=list(snapshots))
+
+
+class TestUtilizationCollector(object):
+
+    def test_rates(self, tmpdir):
+        path = str(tmpdir.join("utilization.csv"))
+        collector = UtilizationCollector(0, path=path)
+        with mock.patch.object(utilization_collector, "ca_read_utilization_metrics_ex"), \
+                _counters({'1234': {'SIGN': 10, 'VERIFY': 0}},
+                          {'1234': {'SIGN': 30, 'VERIFY': 5}},
+                          {'1234': {'SIGN': 4, 'VERIFY': 5}}):
+            assert collector.poll(now=100.0) == []
+            collector.poll(now=102.0)
+            assert collector.rates == {'1234': {'SIGN': 10.0, 'VERIFY': 2.5}}
+            collector.poll(now=103.0)
+            assert collector.rates['1234']['SIGN'] == 4.0
+        collector.writer.close()
+
+        with open(path) as csv_file:
+            lines = csv_file.read().splitlines()
+        assert lines[0] == "timestamp,partition,bin,count,delta,rate"
+        assert lines[1] == "102.000,1234,SIGN,30,20,10.000"
+        assert len(lines) == 5
+
+    def test_rotation(self, tmpdir):
+        path = str(tmpdir.join("series.csv"))
+        writer = RotatingCsvWriter(path, ("a", "b"), max_bytes=20, backup_count=2)
+        for index in range(6):
+            writer.write_rows([(index, "xxxxxx")])
+        writer.close()
+
+        assert os.path.exists(path + ".1")
+        assert os.path.exists(path + ".2")
+        assert not os.path.exists(path + ".3")
+        with open(path) as csv_file:
+            assert csv_file.readline() == "a,b\n"
+
+    def test_background_thread(self, tmpdir):
+        path = str(tmpdir.join("utilization.csv"))
+        with mock.patch.object(utilization_collector, "c_open_session_ex", return_value=5), \
+                mock.patch.object(utilization_collector, "login_ex") as login, \
+                mock.patch.object(utilization_collector, "c_close_session_ex") as close, \
+                mock.patch.object(utilization_collector, "ca_read_utilization_metrics_ex"), \
+                mock.patch.object(utilization_collector, "ca_read_all_utilization_counters_ex",
+                                  return_value={'1234': {'SIGN': 1}}):
+            with UtilizationCollector(0, password=b"sopin", path=path, interval=0.01) as coll:
+                while not coll.rates:
+                    time.sleep(0.01)
+        login.assert_called_once_with(5, 0, b"sopin", 0)
+        close.assert_called_once_with(5)
+        assert coll.failures == 0
@@ -1,14 +1,21 @@
 import abc
+import collections
 import time
 import typing
 
-from .constants import DICT_TEMPLATE
+from .constants import DICT_TEMPLATE, FIND_PAGE_SIZE
+from pycryptoki.cryptoki_helpers import CryptokiDLLException
 from pycryptoki.exceptions import LunaCallException
-from pycryptoki.object_attr_lookup import c_find_objects_ex
+from pycryptoki.object_attr_lookup import (
+    c_find_objects_ex,
+    c_find_all_objects_ex,
+    c_get_attribute_value_ex,
+)
 from pycryptoki.session_management import (
     c_initialize_ex,
     c_finalize_ex,
     c_get_slot_list_ex,
+    c_wait_for_slot_event,
     c_open_session_ex,
     login_ex,
     c_logout_ex,
@@ -20,7 +27,7 @@ from pycryptoki.session_management import (
 from pycryptoki.token_management import c_init_token_ex, jc_kt2_init_token_ex
 from pycryptoki import defaults
 from pycryptoki import defines
-from pycryptoki.key_generator import c_generate_key_pair_ex
+from pycryptoki.key_generator import c_generate_key_pair_ex, c_destroy_object_ex
 
 
 class FindSlotException(Exception):
@@ -91,18 +98,63 @@ class Applet(abc.ABC):
             ):
                 return slot
 
+    def _find_slot(self) -> typing.Optional[int]:
+        # Пока токен подключается, библиотека может отвечать ошибками - это не повод падать
+        try:
+            return self._slot_definition()
+        except (LunaCallException, CryptokiDLLException):
+            return None
+
+    def _slot_event(self) -> bool:
+        """Неблокирующая проверка событий слотов (C_WaitForSlotEvent c CKF_DONT_BLOCK)."""
+        try:
+            ret, _ = c_wait_for_slot_event()
+        except CryptokiDLLException:
+            return False
+        return ret == defines.CKR_OK
+
+    def _wait_slot(
+        self, present: bool, timeout: float, initial_delay: float, max_delay: float
+    ) -> float:
+        start = time.monotonic()
+        delay = initial_delay
+        while (self._find_slot() is not None) != present:
+            elapsed = time.monotonic() - start
+            if elapsed > timeout:
+                raise FindSlotException
+            # Было событие слота - проверяем сразу, иначе ждем с растущим интервалом
+            if self._slot_event():
+                continue
+            time.sleep(min(delay, timeout - elapsed))
+            delay = min(delay * 2, max_delay)
+        return time.monotonic() - start
+
+    def wait_ready(
+        self, timeout: float = 120, initial_delay: float = 0.1, max_delay: float = 2
+    ) -> float:
+        """
+        Ждет, пока токен появится в списке слотов и ответит на C_GetTokenInfo.
+        Опрос с экспоненциально растущим интервалом, не больше max_delay.
+
+        :return: время ожидания в секундах
+        """
+        return self._wait_slot(True, timeout, initial_delay, max_delay)
+
+    def wait_removed(
+        self, timeout: float = 60, initial_delay: float = 0.1, max_delay: float = 2
+    ) -> float:
+        """
+        Ждет, пока токен пропадет из списка слотов.
+
+        :return: время ожидания в секундах
+        """
+        return self._wait_slot(False, timeout, initial_delay, max_delay)
+
     # Необходимо, если несколько апплетов.
     # После инициализации токен может "отвалиться"
     def _check_slot(func) -> typing.Callable:
         def wrapped(self, *args, **kwargs):
-            timeout = 30
-            current_time = 0
-            start = time.time()
-            while not self._slot_definition():
-                time.sleep(1)
-                current_time = time.time() - start
-                if current_time > timeout:
-                    raise FindSlotException
+            self.wait_ready(timeout=30)
             func(self, *args, **kwargs)
 
         return wrapped
@@ -128,6 +180,82 @@ class Applet(abc.ABC):
 
         return dict_objects
 
+    def _object_key(self, session: int, object_class: int, handle: int) -> tuple:
+        """
+        Постоянные атрибуты объекта (CKA_CLASS, CKA_ID, CKA_LABEL): хендл действителен
+        только в сессии, в которой он получен, и не годится для сравнения со снимком.
+        """
+        key = [object_class]
+        for attribute in (defines.CKA_ID, defines.CKA_LABEL):
+            try:
+                value = c_get_attribute_value_ex(session, handle, {attribute: None})[attribute]
+            except LunaCallException:
+                # У объектов некоторых классов атрибута нет
+                value = None
+            key.append(tuple(value) if isinstance(value, list) else value)
+        return tuple(key)
+
+    def _find_objects(self, session: int) -> typing.Dict[tuple, typing.List[int]]:
+        objects = collections.defaultdict(list)
+        for value in DICT_TEMPLATE.values():
+            for handle in c_find_all_objects_ex(session, {defines.CKA_CLASS: value}, FIND_PAGE_SIZE):
+                objects[self._object_key(session, value, handle)].append(handle)
+        return objects
+
+    @staticmethod
+    def _count_objects(objects: typing.Dict[tuple, typing.List[int]]) -> typing.Counter[tuple]:
+        return collections.Counter({key: len(handles) for key, handles in objects.items()})
+
+    def snapshot(self, user_pin: str) -> typing.Counter[tuple]:
+        """
+        Снимок состояния токена: число видимых пользователю объектов
+        для каждого (CKA_CLASS, CKA_ID, CKA_LABEL).
+        """
+        slot = self._slot_definition()
+        if slot is None:
+            raise FindSlotException
+        try:
+            user_session = self._login(slot, user_pin)
+            objects = self._count_objects(self._find_objects(user_session))
+            self._logout(user_session)
+        except LunaCallException:
+            raise ErrorAppletException
+        return objects
+
+    def restore(self, baseline: typing.Counter[tuple], user_pin: str) -> int:
+        """
+        Удаляет объекты, созданные после снимка baseline, без форматирования.
+        Если состояние PIN неизвестно или после удаления токен не совпал со снимком -
+        ErrorAppletException, токен нужно форматировать.
+
+        :return: число удаленных объектов
+        """
+        slot = self._slot_definition()
+        if slot is None:
+            raise FindSlotException
+        try:
+            flags = c_get_token_info_ex(slot)["flags"]
+            if flags & (
+                defines.CKF_USER_PIN_LOCKED |
+                defines.CKF_USER_PIN_FINAL_TRY |
+                defines.CKF_USER_PIN_TO_BE_CHANGED
+            ):
+                raise ErrorAppletException
+            user_session = self._login(slot, user_pin)
+            destroyed = 0
+            for key, handles in self._find_objects(user_session).items():
+                # Объекты с одинаковыми атрибутами неразличимы: лишние сверх снимка удаляются
+                for handle in handles[baseline.get(key, 0):]:
+                    c_destroy_object_ex(user_session, handle)
+                    destroyed += 1
+            restored = self._count_objects(self._find_objects(user_session)) == baseline
+            self._logout(user_session)
+        except LunaCallException:
+            raise ErrorAppletException
+        if not restored:
+            raise ErrorAppletException
+        return destroyed
+
     def _get_token_info(self):
         slot = self._slot_definition()
         return c_get_token_info_ex(slot)
@@ -12,4 +12,6 @@ DICT_TEMPLATE = {
     "CKO_MECHANISM": defines.CKO_MECHANISM,
     "CKO_OTP_KEY": defines.CKO_OTP_KEY,
     "CKO_VENDOR_DEFINED": defines.CKO_VENDOR_DEFINED
-}
\ No newline at end of file
+}
+# Объектов за один вызов C_FindObjects при снимке состояния токена
+FIND_PAGE_SIZE = 256
@@ -145,6 +145,13 @@ def pytest_addoption(parser):
         required=False,
         help='Custom fields, example of writing - field1:item1,field2:item2'
     )
+    group.addoption(
+        '--tr-metadata-ttl',
+        action='store',
+        type=float,
+        default=None,
+        help='How many seconds plans and runs cached on disk (in the pytest cache directory) are reused without \
+              asking TestRail again, 0 to always revalidate them (config file: metadata_ttl in API section)')
 
 
 def pytest_configure(config):
@@ -181,12 +188,22 @@ def pytest_configure(config):
                 testplan_name=config_manager.getoption('tr-testplan-name', 'testplan_name', 'TESTRUN'),
                 publish_errors=config_manager.getoption('tr-publish_errors', 'publish_errors', 'TESTCASE'),
                 custom_fields=config_manager.getoption('tr-custom_fields', 'custom_fields', 'TESTCASE'),
+                metadata_cache_dir=metadata_cache_dir(config),
+                metadata_ttl=float(config_manager.getoption('tr-metadata-ttl', 'metadata_ttl', 'API', default=300)),
             ),
             # Name of plugin instance (allow to be used by other plugins)
             name="pytest-testrail-instance"
         )
 
 
+def metadata_cache_dir(config):
+    """ Directory of the on-disk plan and run cache, shared by xdist workers and reruns """
+    cache = getattr(config, 'cache', None)  # None when the cacheprovider plugin is disabled
+    if cache is None:
+        return None
+    return str(cache.makedir('testrail'))
+
+
 class ConfigManager(object):
     def __init__(self, cfg_file_path, config):
         '''
@@ -0,0 +1,116 @@
+# -*- coding: UTF-8 -*-
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from .testrail_api import APIError, NOT_MODIFIED
+
+# os.replace is atomic on every platform but missing in python2, where os.rename is atomic on POSIX
+_replace = getattr(os, 'replace', os.rename)
+
+
+class MetadataCache(object):
+    def __init__(self, client, cert_check=True, cache_dir=None, ttl=300):
+        '''
+        Plan and run metadata of TestRail, fetched once per uri.
+
+        Responses are kept in memory for the whole session. With a ``cache_dir`` they are also stored on disk
+        with the time they were fetched and their ETag, so parallel workers and reruns within ``ttl`` seconds
+        reuse them without any request, and older entries are revalidated with a conditional GET.
+
+        :param client: API client used for the requests.
+        :type client: pytest_testrail.testrail_api.APIClient
+        :param cert_check: Passed to the client, see ``APIClient.send_get``.
+        :type cert_check: bool or str
+        :param cache_dir: (optional) Directory of the on-disk cache, shared by the processes using it.
+        :type cache_dir: str
+        :param ttl: (optional) How many seconds an on-disk entry is used without asking the server. Defaults to 300.
+        :type ttl: float
+        '''
+        self.client = client
+        self.cert_check = cert_check
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self._memory = {}
+
+    def _path(self, uri):
+        key = '{}{}'.format(getattr(self.client, '_url', ''), uri)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _load(self, uri):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(uri)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _store(self, uri, data, etag):
+        if not self.cache_dir:
+            return
+        entry = {'uri': uri, 'timestamp': time.time(), 'etag': etag, 'data': data}
+        # Write to a temporary file first, so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            _replace(tmp_path, self._path(uri))
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _fetch(self, uri, key, entry):
+        if key is not None:
+            return list(self.client.send_get_paginated(uri, key, cert_check=self.cert_check))
+        etag = entry.get('etag') if entry else None
+        if etag:
+            response = self.client.send_get(uri, cert_check=self.cert_check, etag=etag)
+            if response is NOT_MODIFIED:
+                return entry['data']
+        else:
+            response = self.client.send_get(uri, cert_check=self.cert_check)
+        error = self.client.get_error(response)
+        if error:
+            raise APIError(error)
+        return response
+
+    def get(self, uri, key=None):
+        '''
+        Get the content of an API method, from the cache when possible.
+
+        :param uri: The API method to call including parameters (e.g. get_plan/1)
+        :type uri: str
+        :param key: (optional) Name of the list of a paginated method (e.g. 'runs'): all the pages are fetched
+            and returned as one list.
+        :type key: str
+        :raises APIError: if the server returns an error, errors are not cached
+        '''
+        if uri in self._memory:
+            return self._memory[uri]
+        entry = self._load(uri)
+        if entry is not None and time.time() - entry['timestamp'] < self.ttl:
+            data = entry['data']
+        else:
+            data = self._fetch(uri, key, entry)
+            # A 304 response carries no new ETag, keep the one of the revalidated entry
+            etag = getattr(self.client, 'etags', {}).get(uri) or (entry or {}).get('etag')
+            self._store(uri, data, etag)
+        self._memory[uri] = data
+        return data
+
+    def invalidate(self, uri):
+        '''
+        Forget the content of an API method changed by a write, in memory and on disk.
+
+        :param uri: The API method as passed to ``get``
+        :type uri: str
+        '''
+        self._memory.pop(uri, None)
+        if self.cache_dir:
+            try:
+                os.remove(self._path(uri))
+            except OSError:
+                pass
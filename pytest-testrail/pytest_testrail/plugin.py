@@ -7,6 +7,9 @@ import re
 import warnings
 import logging
 
+from .metadata import MetadataCache
+from .testrail_api import APIError
+
 # Reference: http://docs.gurock.com/testrail-api2/reference-statuses
 TESTRAIL_TEST_STATUS = {
     "passed": 1,
@@ -40,6 +43,7 @@ UPDATE_TESTPLAN = 'update_plan_entry/{}/{}'
 UPDATE_TESTRUN_IN_TESTPLAN = 'update_run_in_plan_entry/{}'
 UPDATE_TESTRUN = 'update_run/{}'
 GET_TESTRUNS_URL = 'get_runs/{}'
+OPEN_FILTER = '&is_completed=0'
 
 COMMENT_SIZE_LIMIT = 4000
 
@@ -152,7 +156,7 @@ class PyTestRailPlugin(object):
                  tr_name, tr_description='', run_id=0, plan_id=0, version='', close_on_complete=False,
                  publish_blocked=True, skip_missing=False, milestone_id=None, custom_comment=None,
                  update=False, testplan_name=None, publish_errors=False, custom_fields=None,
-                 merge_parametrize=False):
+                 merge_parametrize=False, metadata_cache_dir=None, metadata_ttl=300):
         self.update = update
         self.assign_user_id = assign_user_id
         self.cert_check = cert_check
@@ -175,6 +179,8 @@ class PyTestRailPlugin(object):
         self.publish_errors = publish_errors
         self.custom_fields = custom_fields
         self.merge_parametrize = merge_parametrize
+        # Plans and runs are looked up many times during collection: fetch each of them once
+        self.metadata = MetadataCache(client, cert_check, metadata_cache_dir, metadata_ttl)
 
         if run_id:
             logging.warning('--tr-run-id - Этот параметр будет в последующем удалён, пожалуйста не используйте его')
@@ -483,6 +489,7 @@ class PyTestRailPlugin(object):
         if error:
             print('[{}] Failed to create testrun: "{}"'.format(TESTRAIL_PREFIX, error))
         else:
+            self.metadata.invalidate(GET_TESTRUNS_URL.format(project_id))
             self.testrun_id = response['id']
             print('[{}] New testrun created with name "{}" and ID={}'.format(TESTRAIL_PREFIX,
                                                                              testrun_name,
@@ -503,6 +510,7 @@ class PyTestRailPlugin(object):
             print('[{}] Failed to close test run: "{}"'.format(TESTRAIL_PREFIX, error))
         else:
             print('[{}] Test run with ID={} was closed'.format(TESTRAIL_PREFIX, self.testrun_id))
+        self.metadata.invalidate(GET_TESTRUNS_URL.format(self.project_id))
 
     def close_test_plan(self, testplan_id):
         """
@@ -519,6 +527,8 @@ class PyTestRailPlugin(object):
             print('[{}] Failed to close test plan: "{}"'.format(TESTRAIL_PREFIX, error))
         else:
             print('[{}] Test plan with ID={} was closed'.format(TESTRAIL_PREFIX, self.testplan_id))
+        self.metadata.invalidate(GET_TESTPLAN_URL.format(testplan_id))
+        self.metadata.invalidate(GET_TESTPLANS_URL.format('{}{}'.format(self.project_id, OPEN_FILTER)))
 
     # def is_testrun_available(self):
     #     """
@@ -579,15 +589,15 @@ class PyTestRailPlugin(object):
         :return: the list of tests containing in a testrun.
 
         """
-        response = self.client.send_get(
-            GET_TESTS_URL.format(run_id),
-            cert_check=self.cert_check
-        )
-        error = self.client.get_error(response)
-        if error:
+        try:
+            return list(self.client.send_get_paginated(
+                GET_TESTS_URL.format(run_id),
+                'tests',
+                cert_check=self.cert_check
+            ))
+        except APIError as error:
             print('[{}] Failed to get tests: "{}"'.format(TESTRAIL_PREFIX, error))
             return None
-        return response['tests']
 
     def add_plan_entry(self, testplan_id, suite_id, testrun_name, assign_user_id,
                        include_all=False, tr_keys=None, description=None, config_ids=None,
@@ -614,25 +624,25 @@ class PyTestRailPlugin(object):
         if error:
             print('[{}] Failed to add plan entry: "{}"'.format(TESTRAIL_PREFIX, error))
         else:
+            self.metadata.invalidate(GET_TESTPLAN_URL.format(testplan_id))
             self.testrun_id = response['runs'][0]['id']
             print('[{}] Add plan entry created with name "{}" and ID={}'.format(TESTRAIL_PREFIX,
                                                                                 testrun_name,
                                                                                 self.testrun_id))
 
-    def get_plans(self, filters='&is_completed=0'):
+    def get_plans(self, filters=OPEN_FILTER):
         """
-        :return: the list of plans containing in a project.
+        :return: the list of plans containing in a project, fetched once per session.
 
         """
-        response = self.client.send_get(
-            GET_TESTPLANS_URL.format("{}{}".format(self.project_id, filters)),
-            cert_check=self.cert_check
-        )
-        error = self.client.get_error(response)
-        if error:
+        try:
+            return self.metadata.get(
+                GET_TESTPLANS_URL.format("{}{}".format(self.project_id, filters)),
+                'plans'
+            )
+        except APIError as error:
             print('[{}] Failed to retrieve testplans: "{}"'.format(TESTRAIL_PREFIX, error))
-            return None
-        return response['plans']
+            raise Exception("Ошибка при поиске testplan")
 
     def add_plan(self, project_id, name, description=None, milestone_id=None, entries=None):
         """
@@ -656,6 +666,7 @@ class PyTestRailPlugin(object):
         if error:
             print('[{}] Failed to add plan: "{}"'.format(TESTRAIL_PREFIX, error))
         else:
+            self.metadata.invalidate(GET_TESTPLANS_URL.format('{}{}'.format(project_id, OPEN_FILTER)))
             self.testplan_id = response['id']
             print('[{}] Add plan created with name "{}" and ID={}'.format(TESTRAIL_PREFIX,
                                                                           name,
@@ -676,6 +687,7 @@ class PyTestRailPlugin(object):
             data,
             cert_check=self.cert_check
         )
+        self.metadata.invalidate(GET_TESTPLAN_URL.format(testplan_id))
         error = self.client.get_error(response)
         if error:
             print('[{}] Failed to update testplan: "{}"'.format(TESTRAIL_PREFIX, error))
@@ -695,6 +707,7 @@ class PyTestRailPlugin(object):
             data,
             cert_check=self.cert_check
         )
+        self.metadata.invalidate(GET_TESTPLAN_URL.format(self.testplan_id))
         error = self.client.get_error(response)
         if error:
             print('[{}] Failed to update testrun: "{}"'.format(TESTRAIL_PREFIX, error))
@@ -711,26 +724,29 @@ class PyTestRailPlugin(object):
             data,
             cert_check=self.cert_check
         )
+        self.metadata.invalidate(GET_TESTRUNS_URL.format(self.project_id))
         error = self.client.get_error(response)
         if error:
             print('[{}] Failed to update testrun: "{}"'.format(TESTRAIL_PREFIX, error))
             raise Exception("Ошибка при обновлении testrun")
 
-    def get_entry_id(self):
+    def get_plan(self):
         """
-        :return: entry id testrun associated to a test plan in TestRail.
+        :return: the test plan with its entries, fetched once per session.
 
         """
-        response = self.client.send_get(
-            GET_TESTPLAN_URL.format(self.testplan_id),
-            cert_check=self.cert_check
-        )
-        error = self.client.get_error(response)
-        if error:
+        try:
+            return self.metadata.get(GET_TESTPLAN_URL.format(self.testplan_id))
+        except APIError as error:
             print('[{}] Failed to retrieve testplan: "{}"'.format(TESTRAIL_PREFIX, error))
             raise Exception("Ошибка при поиске testplan")
 
-        for entry in response['entries']:
+    def get_entry_id(self):
+        """
+        :return: entry id testrun associated to a test plan in TestRail.
+
+        """
+        for entry in self.get_plan()['entries']:
             if entry['name'] == self.testrun_name:
                 entry_id = entry['id']
                 break
@@ -743,16 +759,7 @@ class PyTestRailPlugin(object):
         :return: testrun id associated to a test plan in TestRail.
 
         """
-        response = self.client.send_get(
-            GET_TESTPLAN_URL.format(self.testplan_id),
-            cert_check=self.cert_check
-        )
-        error = self.client.get_error(response)
-        if error:
-            print('[{}] Failed to retrieve testplan: "{}"'.format(TESTRAIL_PREFIX, error))
-            raise Exception("Ошибка при поиске testplan")
-
-        for entry in response['entries']:
+        for entry in self.get_plan()['entries']:
             if entry['name'] == self.testrun_name:
                 testrun_id = entry['runs'][0]['id']
                 break
@@ -765,39 +772,21 @@ class PyTestRailPlugin(object):
         :return: True if testrun exists AND is open
 
         """
-        response = self.client.send_get(
-            GET_TESTPLAN_URL.format(self.testplan_id),
-            cert_check=self.cert_check
-        )
-        error = self.client.get_error(response)
-        if error:
-            print('[{}] Failed to retrieve testrun: "{}"'.format(TESTRAIL_PREFIX, error))
-            raise Exception("Ошибка при поиске testplan")
-
-        if len(response['entries']) == 0:
-            return False
-        for entry in response['entries']:
+        for entry in self.get_plan()['entries']:
             if entry['name'] == self.testrun_name:
                 break
         else:
             return False
         return True
 
-    def get_testrun_id(self, filters='&is_completed=0'):
+    def get_testrun_id(self, include_completed=False):
         """
         :return: testrun id not associated to a test plan in TestRail.
 
         """
-        response = self.client.send_get(
-            GET_TESTRUNS_URL.format("{}{}".format(self.project_id, filters)),
-            cert_check=self.cert_check
-        )
-        error = self.client.get_error(response)
-        if error:
-            print('[{}] Failed to retrieve testrun: "{}"'.format(TESTRAIL_PREFIX, error))
-            raise Exception("Ошибка при поиске testrun")
-
-        for testrun in response['runs']:
+        for testrun in self.get_runs():
+            if testrun['is_completed'] and not include_completed:
+                continue
             if testrun['name'] == self.testrun_name:
                 testrun_id = testrun['id']
                 break
@@ -810,20 +799,20 @@ class PyTestRailPlugin(object):
         :return: True if testrun exists AND is open
 
         """
-        response = self.client.send_get(
-            GET_TESTRUNS_URL.format(self.project_id),
-            cert_check=self.cert_check
-        )
-        error = self.client.get_error(response)
-        if error:
-            print('[{}] Failed to retrieve testrun: "{}"'.format(TESTRAIL_PREFIX, error))
-            raise Exception("Ошибка при поиске testrun")
-
-        if len(response['runs']) == 0:
-            return False
-        for testrun in response['runs']:
+        for testrun in self.get_runs():
             if testrun['name'] == self.testrun_name:
                 break
         else:
             return False
         return True
+
+    def get_runs(self):
+        """
+        :return: the list of all the testruns (open and completed) containing in a project, fetched once per session.
+
+        """
+        try:
+            return self.metadata.get(GET_TESTRUNS_URL.format(self.project_id), 'runs')
+        except APIError as error:
+            print('[{}] Failed to retrieve testrun: "{}"'.format(TESTRAIL_PREFIX, error))
+            raise Exception("Ошибка при поиске testrun")
@@ -11,6 +11,7 @@
 # Copyright Gurock Software GmbH. See license.md for details.
 #
 
+import random
 import sys
 import requests
 import time
@@ -20,6 +21,18 @@ if sys.version_info.major == 2:
 else:
     from urllib.parse import urljoin
 
+# Statuses worth retrying: rate limiting and transient server/proxy errors.
+# Writes are only retried when rate limited, as the server did not process them.
+RETRY_STATUSES = (429, 502, 503, 504)
+RETRY_STATUSES_POST = (429,)
+API_PREFIX = '/api/v2/'
+# Returned by send_get when the ``etag`` passed still matches the resource (304 Not Modified)
+NOT_MODIFIED = object()
+
+
+class APIError(Exception):
+    pass
+
 
 class APIClient:
     def __init__(self, base_url, user, password, **kwargs):
@@ -41,6 +54,14 @@ class APIClient:
         :param timeout: (optional) How many seconds to wait for the server to send data before giving up, as a float,
             or a :ref:`(connect timeout, read timeout) <timeouts>` tuple.
         :type timeout: float or tuple
+        :param max_retries: (optional) How many times a rate-limited (429) or failed (502/503/504, connection error)
+            request is retried before giving up. Defaults to 5.
+        :type max_retries: int
+        :param backoff: (optional) Base delay in seconds of the jittered exponential backoff between retries, used
+            when the server does not send ``Retry-After``. Defaults to 1.
+        :type backoff: float
+        :param max_backoff: (optional) Upper bound in seconds of a single pause between retries. Defaults to 60.
+        :type max_backoff: float
         '''
         self.user = user
         self.password = password
@@ -50,6 +71,48 @@ class APIClient:
         self.timeout = kwargs.get('timeout', 10.0)
         if self.timeout is not None:
             self.timeout = isinstance(self.timeout, float) if False else float(self.timeout)
+        self.max_retries = kwargs.get('max_retries', 5)
+        self.backoff = kwargs.get('backoff', 1.0)
+        self.max_backoff = kwargs.get('max_backoff', 60.0)
+        # One keep-alive connection (and TLS session) for all the requests
+        self.session = requests.Session()
+        self.session.auth = (self.user, self.password)
+        # Last ETag sent by the server per GET uri, for conditional requests
+        self.etags = {}
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # "Full jitter": spread retries of concurrent clients over the whole backoff window
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _request(self, method, uri, **kwargs):
+        url = self._url + uri
+        retry_statuses = RETRY_STATUSES if method == 'GET' else RETRY_STATUSES_POST
+        attempt = 0
+        while True:
+            try:
+                r = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if method != 'GET' or attempt >= self.max_retries:
+                    raise
+                r = None
+            else:
+                if r.status_code == 304:
+                    return NOT_MODIFIED
+                if r.status_code not in retry_statuses or attempt >= self.max_retries:
+                    if method == 'GET' and r.headers.get('ETag'):
+                        self.etags[uri] = r.headers['ETag']
+                    return r.json()
+            pause = self._retry_delay(attempt, r)
+            print("Request {} failed ({}): retry in {:.1f}s".format(
+                uri, r.status_code if r is not None else 'connection error', pause))
+            time.sleep(pause)
+            attempt += 1
 
     def send_get(self, uri, **kwargs):
         '''
@@ -67,25 +130,15 @@ class APIClient:
         :param timeout: (optional) How many seconds to wait for the server to send data before giving up, as a float,
             or a :ref:`(connect timeout, read timeout) <timeouts>` tuple.
         :type timeout: float or tuple
+        :param etag: (optional) ETag of a previous response (see ``etags``): if the resource did not change,
+            ``NOT_MODIFIED`` is returned instead of its content.
+        :type etag: str
         '''
         cert_check = kwargs.get('cert_check', self.cert_check)
         headers = kwargs.get('headers', self.headers)
-        url = self._url + uri
-        r = requests.get(
-            url,
-            auth=(self.user, self.password),
-            headers=headers,
-            verify=cert_check,
-            timeout=self.timeout
-        )
-
-        if r.status_code == 429:  # Too many requests
-            pause = int(r.headers.get('Retry-After', 60))
-            print("Too many requests: pause for {}s".format(pause))
-            time.sleep(pause)
-            return self.send_get(uri, **kwargs)
-        else:
-            return r.json()
+        if kwargs.get('etag'):
+            headers = dict(headers, **{'If-None-Match': kwargs['etag']})
+        return self._request('GET', uri, headers=headers, verify=cert_check)
 
     def send_post(self, uri, data, **kwargs):
         '''
@@ -108,23 +161,35 @@ class APIClient:
         '''
         cert_check = kwargs.get('cert_check', self.cert_check)
         headers = kwargs.get('headers', self.headers)
-        url = self._url + uri
-        r = requests.post(
-            url,
-            auth=(self.user, self.password),
-            headers=headers,
-            json=data,
-            verify=cert_check,
-            timeout=self.timeout
-        )
-
-        if r.status_code == 429:  # Too many requests
-            pause = int(r.headers.get('Retry-After', 60))
-            print("Too many requests: pause for {}s".format(pause))
-            time.sleep(pause)
-            return self.send_post(uri, data, **kwargs)
-        else:
-            return r.json()
+        return self._request('POST', uri, headers=headers, json=data, verify=cert_check)
+
+    def send_get_paginated(self, uri, key, **kwargs):
+        '''
+        Send GET for all pages
+
+        Generator over the items of a bulk API method (e.g. get_tests/1, key 'tests'), following the
+        ``_links.next`` pages of TestRail 6.7+. Responses of older servers (plain lists) are yielded as is.
+        Pages are requested lazily, so stopping the iteration early saves the remaining requests.
+
+        :param uri: The API method to call including parameters (e.g. get_tests/1)
+        :type uri: str
+        :param key: Name of the list in a paginated response (e.g. 'tests', 'plans', 'runs')
+        :type key: str
+        :raises APIError: if the server returns an error
+        '''
+        while uri:
+            response = self.send_get(uri, **kwargs)
+            if isinstance(response, list):
+                for item in response:
+                    yield item
+                return
+            error = self.get_error(response)
+            if error:
+                raise APIError(error)
+            for item in response.get(key, []):
+                yield item
+            next_page = (response.get('_links') or {}).get('next')
+            uri = next_page.split(API_PREFIX, 1)[-1] if next_page else None
 
     @staticmethod
     def get_error(json_response):
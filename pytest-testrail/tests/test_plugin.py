@@ -1,9 +1,12 @@
 # -*- coding: UTF-8 -*-
 from datetime import datetime
+from functools import partial
 from freezegun import freeze_time
 from mock import call, create_autospec
 import pytest
-from pytest_testrail import plugin
+import requests
+from pytest_testrail import plugin, testrail_api
+from pytest_testrail.metadata import MetadataCache
 from pytest_testrail.plugin import PyTestRailPlugin, TESTRAIL_TEST_STATUS
 from pytest_testrail.testrail_api import APIClient
 
@@ -62,6 +65,8 @@ CUSTOM_COMMENT = "This is custom comment"
 def api_client():
     spec = create_autospec(APIClient)
     spec.get_error = APIClient.get_error  # don't mock get_error
+    # don't mock pagination, only the requests it sends
+    spec.send_get_paginated = partial(APIClient.send_get_paginated, spec)
     return spec
 
 
@@ -457,3 +462,129 @@ def test_api_client_timeout(api_client):
 
     api_client.send_post('/timeout', data={"body": "body"}, timeout=None)
     api_client.send_post.assert_called_with('/timeout', data={"body": "body"}, timeout=None)
+
+
+def _response(status_code, json_data=None, headers=None):
+    response = create_autospec(requests.Response)
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = json_data
+    return response
+
+
+def test_api_client_retry_after(monkeypatch):
+    client = APIClient('http://testrail/', 'user', 'password', max_retries=3)
+    sleeps = []
+    monkeypatch.setattr(testrail_api.time, 'sleep', sleeps.append)
+    client.session.request = create_autospec(client.session.request, side_effect=[
+        _response(429, headers={'Retry-After': '7'}),
+        _response(503),
+        _response(200, {'id': 1}),
+    ])
+
+    assert client.send_get('get_run/1') == {'id': 1}
+    assert client.session.request.call_count == 3
+    assert sleeps[0] == 7
+    assert 0 <= sleeps[1] <= client.backoff * 2
+
+
+def test_api_client_retry_bounded(monkeypatch):
+    client = APIClient('http://testrail/', 'user', 'password', max_retries=2)
+    monkeypatch.setattr(testrail_api.time, 'sleep', lambda pause: None)
+    client.session.request = create_autospec(client.session.request,
+                                             return_value=_response(429, {'error': 'rate limit'}))
+
+    assert client.send_get('get_run/1') == {'error': 'rate limit'}
+    assert client.session.request.call_count == 3
+
+
+def test_api_client_post_not_retried_on_server_error(monkeypatch):
+    client = APIClient('http://testrail/', 'user', 'password')
+    monkeypatch.setattr(testrail_api.time, 'sleep', lambda pause: None)
+    client.session.request = create_autospec(client.session.request,
+                                             return_value=_response(503, {'error': 'unavailable'}))
+
+    assert client.send_post('add_run/1', {}) == {'error': 'unavailable'}
+    assert client.session.request.call_count == 1
+
+
+def test_api_client_pagination(api_client):
+    api_client.send_get.side_effect = [
+        {'offset': 0, 'size': 2, '_links': {'next': '/api/v2/get_tests/10&limit=2&offset=2'},
+         'tests': [{'id': 1}, {'id': 2}]},
+        {'offset': 2, 'size': 1, '_links': {'next': None}, 'tests': [{'id': 3}]},
+    ]
+
+    tests = api_client.send_get_paginated(plugin.GET_TESTS_URL.format(10), 'tests', cert_check=True)
+
+    assert [test['id'] for test in tests] == [1, 2, 3]
+    assert api_client.send_get.call_args_list == [
+        call('get_tests/10', cert_check=True),
+        call('get_tests/10&limit=2&offset=2', cert_check=True),
+    ]
+
+
+def test_plan_fetched_once(api_client, tr_plugin):
+    tr_plugin.testplan_id = 100
+    tr_plugin.testrun_name = 'Test Run 5/23/2017'
+    api_client.send_get.return_value = TESTPLAN
+
+    assert tr_plugin.find_testrun_in_testplan() is True
+    assert tr_plugin.get_testrun_id_in_testplan() == 59
+    assert tr_plugin.get_entry_id() == 'ce2f3c8f-9899-47b9-a6da-db59a66fb794'
+    api_client.send_get.assert_called_once_with('get_plan/100', cert_check=True)
+
+
+def test_runs_fetched_once(api_client, tr_plugin):
+    tr_plugin.testrun_name = 'run'
+    api_client.send_get.return_value = {'_links': {'next': None}, 'runs': [
+        {'id': 1, 'name': 'run', 'is_completed': True},
+        {'id': 2, 'name': 'run', 'is_completed': False},
+    ]}
+
+    assert tr_plugin.find_testrun() is True
+    assert tr_plugin.get_testrun_id() == 2
+    assert tr_plugin.get_testrun_id(include_completed=True) == 1
+    api_client.send_get.assert_called_once_with('get_runs/4', cert_check=True)
+
+
+def test_metadata_disk_cache(api_client, tmpdir):
+    api_client.send_get.return_value = {'_links': {'next': None}, 'plans': [{'id': 1, 'name': 'plan'}]}
+    cache = MetadataCache(api_client, cache_dir=str(tmpdir), ttl=60)
+    assert cache.get('get_plans/4', 'plans') == [{'id': 1, 'name': 'plan'}]
+
+    # another worker or a rerun reuses the entry stored on disk
+    assert MetadataCache(api_client, cache_dir=str(tmpdir), ttl=60).get('get_plans/4', 'plans') == [
+        {'id': 1, 'name': 'plan'}]
+    assert api_client.send_get.call_count == 1
+
+    cache.invalidate('get_plans/4')
+    MetadataCache(api_client, cache_dir=str(tmpdir), ttl=60).get('get_plans/4', 'plans')
+    assert api_client.send_get.call_count == 2
+
+
+def test_metadata_revalidated_with_etag(tmpdir):
+    client = APIClient('http://testrail/', 'user', 'password')
+    client.session.request = create_autospec(client.session.request, side_effect=[
+        _response(200, {'id': 100, 'entries': []}, headers={'ETag': '"v1"'}),
+        _response(304),
+    ])
+    MetadataCache(client, cache_dir=str(tmpdir), ttl=0).get('get_plan/100')
+
+    assert MetadataCache(client, cache_dir=str(tmpdir), ttl=0).get('get_plan/100') == {'id': 100, 'entries': []}
+    assert client.session.request.call_args[1]['headers']['If-None-Match'] == '"v1"'
+
+
+def test_metadata_error_not_cached(api_client, tmpdir):
+    api_client.send_get.return_value = {'error': 'An error occured'}
+    cache = MetadataCache(api_client, cache_dir=str(tmpdir))
+
+    with pytest.raises(testrail_api.APIError):
+        cache.get('get_plan/100')
+    assert tmpdir.listdir() == []
+
+
+def test_get_tests_error(api_client, tr_plugin):
+    api_client.send_get.return_value = {'error': 'An error occured'}
+
+    assert tr_plugin.get_tests(10) is None
@@ -0,0 +1,153 @@
+import logging
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import NamedTuple
+
+from base_vipnet import FuncVipNet, VipNetOperationsName
+
+# Аргументы csp_invoke, через которые команда читает или пишет файлы
+FILE_INPUTS = ('--in', '--sigfile', '--public', '--certfile')
+FILE_OUTPUTS = ('--out',)
+
+# Состояние токена и хранилища сертификатов, общее для всех шагов
+CONTAINER = 'container'
+STORE = 'store'
+# --dn находит сертификат в хранилище и закрытый ключ в его контейнере,
+# --pin - пароль контейнера: команда работает с закрытым ключом (lowdec, sfdec)
+STATE_ARGS = {
+    '--container': {CONTAINER},
+    '--rcontainer': {CONTAINER},
+    '--pin': {CONTAINER},
+    '--dn': {STORE, CONTAINER},
+    '--rdn': {STORE},
+    '--rstore': {STORE},
+}
+
+# Шаги, которые меняют состояние контейнера или хранилища, остальные его только читают
+STATE_WRITES = {
+    VipNetOperationsName.KEY_GENERATION: {CONTAINER},
+    VipNetOperationsName.SAVE_CONTAINER_PASSWORD: {CONTAINER},
+    VipNetOperationsName.SETUP_CERT_TO_CONTAINER: {CONTAINER},
+    VipNetOperationsName.SETUP_CERT_TO_STORAGE: {STORE},
+    VipNetOperationsName.DELETE_PASSWORD: {CONTAINER},
+    VipNetOperationsName.DELETE_CERT: {STORE},
+    VipNetOperationsName.DELETE_CONTAINER: {CONTAINER},
+}
+# Шаги, которые обращаются к токену без явного указания контейнера
+STATE_READS = {
+    VipNetOperationsName.ENUM_CONTAINERS: {CONTAINER},
+}
+
+
+class StepResult(NamedTuple):
+    name: VipNetOperationsName
+    return_code: int
+    output: bytes
+    started: float
+    duration: float
+
+
+class ScenarioStep:
+    """
+    Шаг сценария: операция csp_invoke, ресурсы (файлы, контейнер, хранилище),
+    которые она читает и пишет, и шаги, после которых ее можно запускать.
+    """
+
+    def __init__(self, index, name, process):
+        self.index = index
+        self.name = name
+        self.reads = set(STATE_READS.get(name, ()))
+        self.writes = set(STATE_WRITES.get(name, ()))
+        for arg, value in zip(process, process[1:]):
+            if arg in FILE_INPUTS:
+                self.reads.add(value)
+            elif arg in FILE_OUTPUTS:
+                self.writes.add(value)
+            elif arg in STATE_ARGS:
+                self.reads |= STATE_ARGS[arg]
+        self.reads -= self.writes
+        self.depends_on = set()
+
+    @property
+    def uses_token(self):
+        return bool((self.reads | self.writes) & {CONTAINER, STORE})
+
+    def conflicts(self, other):
+        return bool(
+            self.writes & (other.reads | other.writes) or
+            self.reads & other.writes
+        )
+
+
+class ScenarioEngine:
+    """
+    Выполнение сценария из последовательности VipNetOperationsName.
+
+    Зависимости шагов выводятся из их аргументов: шаг ждет все предыдущие шаги, которые
+    пишут то, что он читает или пишет, и читают то, что он пишет. Независимые шаги
+    (например, ветки низкоуровневой и упрощенной CMS подписи) выполняются параллельно.
+    Операции с токеном по-прежнему сериализует TokenLock, параллельно с ними идут
+    шаги, работающие только с файлами (проверка подписи по открытому ключу).
+    Через CspInvokeWorker команды выполняются по одной, параллельность дает AsyncCspRunner.
+    """
+
+    def __init__(self, executor: FuncVipNet, steps, max_workers=4):
+        self.executor = executor
+        self.max_workers = max_workers
+        self.steps = []
+        for index, name in enumerate(steps):
+            step = ScenarioStep(index, name, executor._get_vip_net_process(name))
+            step.depends_on = {
+                previous.index for previous in self.steps if step.conflicts(previous)
+            }
+            self.steps.append(step)
+        self.results = []
+
+    def _run_step(self, step, start):
+        started = time.monotonic() - start
+        return_code, output = self.executor._run(step.name, exclusive=step.uses_token)
+        return StepResult(step.name, return_code, output, started, time.monotonic() - started - start)
+
+    def run(self):
+        """
+        Выполнить сценарий. Останавливается на первом шаге с ненулевым кодом возврата.
+
+        :return: список StepResult в порядке завершения шагов
+        """
+        pending = deque(self.steps)
+        done = set()
+        running = {}
+        self.results = []
+        failed = None
+        start = time.monotonic()
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            while (pending and failed is None) or running:
+                if failed is None:
+                    for _ in range(len(pending)):
+                        step = pending.popleft()
+                        if step.depends_on <= done and len(running) < self.max_workers:
+                            running[pool.submit(self._run_step, step, start)] = step
+                        else:
+                            pending.append(step)
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    result = future.result()
+                    self.results.append(result)
+                    done.add(step.index)
+                    if result.return_code != 0 and failed is None:
+                        failed = result
+        logging.info(self.report())
+        assert failed is None, \
+            f"Ошибка на шаге {failed.name.value}: {failed.return_code}, {failed.output}"
+        return self.results
+
+    def report(self):
+        lines = [f"scenario: {len(self.results)} steps, "
+                 f"{max((r.started + r.duration for r in self.results), default=0.0):.3f}s"]
+        for result in sorted(self.results, key=lambda r: r.started):
+            lines.append(f"  {result.name.value:<32} start {result.started:8.3f}s "
+                         f"duration {result.duration:8.3f}s rc {result.return_code}")
+        return "\n".join(lines)
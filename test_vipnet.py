@@ -7,7 +7,7 @@ from allure_testrail.plugin import allure_testrail
 
 class TestVipNet:
     @pytest.fixture(scope="class")
-    def base_scenario(self, vip_net_attributes, token):
+    def base_scenario(self, vip_net_attributes, token, csp_worker):
         return FuncVipNet(
             vip_net_attributes['path_to_csp_invoke'],
             vip_net_attributes['container_name'],
@@ -16,9 +16,15 @@ class TestVipNet:
             vip_net_attributes['hash_alg'],
             vip_net_attributes['key_type'],
             vip_net_attributes['certificate_name'],
-            vip_net_attributes['file_path']
+            vip_net_attributes['file_path'],
+            csp_worker
         )
 
+    @pytest.fixture(autouse=True)
+    def scenario_work_dir(self, base_scenario, work_dir):
+        # Файлы каждого теста - в своей директории
+        base_scenario.work_dir = work_dir
+
     @pytest.fixture(scope="class")
     def command(self):
         return Command()
@@ -0,0 +1,148 @@
+"""
+Юнит-тесты AsyncUSBRedirectorAPI без сервера USB Redirector и usbclnt:
+
+    python -m pytest --noconftest -o addopts= tests
+"""
+import asyncio
+import gc
+import weakref
+from unittest import mock
+
+import pytest
+
+from USBRedirectorAPI import async_usbredirectorapi
+from USBRedirectorAPI.async_usbredirectorapi import AsyncUSBRedirectorAPI, DeviceResult
+
+DEVICES = [{'Port': '1-1'}, {'Port': '1-2'}, {'Serial': 'AAA'}, {'Serial': 'BBB'}]
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, timeout=None):
+        self.requests.append(('get', url))
+        return FakeResponse(data={'Devices': DEVICES})
+
+    def post(self, url, data=None, timeout=None):
+        self.requests.append(('post', url, data))
+        return FakeResponse()
+
+    def close(self):
+        pass
+
+
+class FakeClient:
+    """Вместо usbclnt: код возврата 1 для команд с failing, считает одновременные запуски."""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.commands = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, *command, stdout=None, stderr=None):
+        self.commands.append(command)
+        client = self
+
+        class Process:
+            returncode = 1 if any(arg in client.failing for arg in command) else 0
+
+            async def communicate(self):
+                client.running += 1
+                client.max_running = max(client.max_running, client.running)
+                await asyncio.sleep(0.01)
+                client.running -= 1
+                return b'', b''
+
+        return Process()
+
+
+@pytest.fixture
+def fake_session():
+    with mock.patch('USBRedirectorAPI.usbredirectorapi.requests.Session', FakeSession):
+        yield
+
+
+def run(client, coroutine, failing=()):
+    fake = FakeClient(failing)
+    with mock.patch('asyncio.create_subprocess_exec', fake):
+        return asyncio.run(coroutine), fake
+
+
+@pytest.mark.usefixtures('fake_session')
+class TestConnectMany:
+    def test_results_by_device(self):
+        client = AsyncUSBRedirectorAPI('10.0.0.1', client_path='usbclnt')
+        devices = [('1-1', None), (None, 'BBB')]
+        results, fake = run(client, client.connect_many(devices))
+        assert list(results) == devices
+        for result in results.values():
+            assert isinstance(result, DeviceResult)
+            assert result.ok and result.error is None
+            assert set(result.steps) == {'share', 'connect', 'autoconnect'}
+        # -addserver, затем -connect и -autoconnect по каждому устройству
+        assert len(fake.commands) == 5
+
+    def test_failed_device(self):
+        client = AsyncUSBRedirectorAPI('10.0.0.1', client_path='usbclnt')
+        results, _ = run(client, client.connect_many([('1-1', None), ('1-2', None)], force=False),
+                         failing=('1-2',))
+        assert results[('1-1', None)].ok
+        failed = results[('1-2', None)]
+        assert not failed.ok
+        assert failed.error == 'Connect usb failed'
+        assert list(failed.steps) == ['connect']
+
+    def test_unknown_device(self):
+        client = AsyncUSBRedirectorAPI('10.0.0.1', client_path='usbclnt')
+        with pytest.raises(ValueError):
+            run(client, client.connect_many([('9-9', None)]))
+
+    def test_max_concurrency(self):
+        client = AsyncUSBRedirectorAPI('10.0.0.1', client_path='usbclnt', max_concurrency=2)
+        devices = [('1-1', None), ('1-2', None), (None, 'AAA'), (None, 'BBB')]
+        _, fake = run(client, client.disconnect_many(devices))
+        assert fake.max_running == 2
+
+
+@pytest.mark.usefixtures('fake_session')
+class TestSemaphores:
+    def test_closed_loop_released(self):
+        client = AsyncUSBRedirectorAPI('10.0.0.2', client_path='usbclnt', max_concurrency=1)
+        loops = []
+
+        async def connect():
+            loops.append(weakref.ref(asyncio.get_running_loop()))
+            return await client.connect_many([('1-1', None), ('1-2', None)], force=False)
+
+        run(client, connect())
+        run(client, connect())
+        # Клиент держит только семафор последнего цикла
+        gc.collect()
+        assert loops[0]() is None
+        del client
+        gc.collect()
+        assert loops[1]() is None
+        assert not async_usbredirectorapi._semaphores
+
+    def test_shared_limit(self):
+        first = AsyncUSBRedirectorAPI('10.0.0.3', client_path='usbclnt', max_concurrency=2)
+        second = AsyncUSBRedirectorAPI('10.0.0.3', client_path='usbclnt', max_concurrency=2)
+        other = AsyncUSBRedirectorAPI('10.0.0.3', client_path='usbclnt', max_concurrency=8)
+
+        async def semaphores():
+            assert first._semaphore is second._semaphore
+            with pytest.raises(ValueError):
+                other._semaphore
+
+        asyncio.run(semaphores())
@@ -0,0 +1,116 @@
+"""
+Юнит-тесты протокола CspInvokeWorker без sudo и csp_invoke:
+
+    python -m pytest --noconftest -o addopts= tests
+"""
+import asyncio
+import shutil
+import subprocess
+from subprocess import TimeoutExpired
+
+import pytest
+
+import csp_worker
+from csp_helper import NOT_ALLOWED
+from csp_worker import CspInvokeWorker, AsyncCspRunner
+from errors import CspWorkerException
+
+ECHO = shutil.which('echo')
+FALSE = shutil.which('false')
+
+
+@pytest.fixture
+def worker():
+    with CspInvokeWorker(elevate=False) as worker:
+        yield worker
+
+
+def test_output_and_return_code(worker):
+    assert worker.run([ECHO, 'hello']) == (0, b'hello\n')
+    assert worker.run([FALSE])[0] != 0
+    assert worker.run_many([[ECHO, 'a'], [ECHO, 'b']]) == [(0, b'a\n'), (0, b'b\n')]
+
+
+def test_cwd(worker, tmp_path):
+    assert worker.run(['pwd'], cwd=tmp_path) == (0, f'{tmp_path}\n'.encode())
+
+
+def test_missing_program(worker):
+    assert worker.run(['/nonexistent/csp_invoke'])[0] == 127
+
+
+def test_command_timeout(worker):
+    with pytest.raises(TimeoutExpired):
+        worker.run(['sleep', '10'], timeout=0.5)
+    # Помощник продолжает работать
+    assert worker.run([ECHO, 'ok']) == (0, b'ok\n')
+
+
+def test_only_executable_allowed():
+    with CspInvokeWorker(ECHO, elevate=False) as worker:
+        assert worker.run([ECHO, 'ok']) == (0, b'ok\n')
+        assert worker.run([FALSE])[0] == NOT_ALLOWED
+
+
+def test_elevate_requires_executable():
+    with pytest.raises(ValueError):
+        CspInvokeWorker(elevate=True)
+
+
+def test_elevate_requires_helper():
+    with pytest.raises(ValueError):
+        CspInvokeWorker(ECHO, elevate=True)
+
+
+def test_writable_helper_refused(tmp_path):
+    helper = tmp_path / 'csp_helper.py'
+    helper.write_text('')
+    helper.chmod(0o666)
+    worker = CspInvokeWorker(ECHO, elevate=True, python=ECHO, helper=str(helper))
+    with pytest.raises(CspWorkerException, match='not writable'):
+        worker.start()
+    assert not worker.alive
+
+
+def test_missing_sudo_rule_named(monkeypatch):
+    # Файлы root: проверяется только ответ sudo -n -l
+    worker = CspInvokeWorker(FALSE, elevate=True, python=ECHO, helper=ECHO)
+    monkeypatch.setattr(csp_worker, 'Popen', lambda *args, **kwargs: subprocess.Popen([FALSE], **kwargs))
+    with pytest.raises(CspWorkerException) as e:
+        worker.start()
+    assert worker.sudoers_rule() in str(e.value)
+    assert f'NOPASSWD: {ECHO} -u {ECHO} {FALSE}' in str(e.value)
+    assert not worker.alive
+
+
+def test_helper_not_answering(tmp_path):
+    helper = tmp_path / 'helper.py'
+    helper.write_text('import sys, time\nsys.stdin.readline()\ntime.sleep(60)\n')
+    worker = CspInvokeWorker(elevate=False, helper=str(helper))
+    worker.RESPONSE_MARGIN = 0.5
+    with pytest.raises(TimeoutExpired):
+        worker.run([ECHO, 'hello'], timeout=0)
+    assert not worker.alive
+
+
+def test_helper_exited(tmp_path):
+    helper = tmp_path / 'helper.py'
+    helper.write_text('import sys\nsys.stdin.readline()\n')
+    worker = CspInvokeWorker(elevate=False, helper=str(helper))
+    with pytest.raises(CspWorkerException):
+        worker.run([ECHO, 'hello'])
+    assert not worker.alive
+
+
+def test_runner_sync():
+    runner = AsyncCspRunner(elevate=False)
+    assert runner.run_sync([ECHO, 'hello']) == (0, b'hello\n')
+    with pytest.raises(TimeoutExpired):
+        runner.run_sync(['sleep', '10'], timeout=0.5)
+
+
+def test_runner_sync_in_running_loop():
+    async def main():
+        return AsyncCspRunner(elevate=False).run_sync([ECHO, 'hello'])
+
+    assert asyncio.run(main()) == (0, b'hello\n')
@@ -0,0 +1,71 @@
+"""
+Юнит-тесты ProcessRegistry:
+
+    python -m pytest --noconftest -o addopts= tests
+"""
+import subprocess
+import sys
+import time
+from unittest import mock
+
+import psutil
+import pytest
+
+from process_registry import ProcessRegistry
+
+
+@pytest.fixture
+def registry():
+    return ProcessRegistry()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="sh")
+def test_kill_tracked_with_children(registry):
+    proc = subprocess.Popen(['sh', '-c', 'sleep 60 & sleep 60 & wait'])
+    registry.register(proc.pid, 'sh')
+    deadline = time.monotonic() + 5
+    while len(psutil.Process(proc.pid).children()) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    children = psutil.Process(proc.pid).children()
+
+    registry.kill_tracked()
+
+    assert proc.wait(5) is not None
+    _, alive = psutil.wait_procs(children, timeout=5)
+    assert alive == []
+    assert registry.tracked() == []
+
+
+def test_kill_continues_after_access_denied(registry):
+    root_child, other_child = mock.Mock(pid=2), mock.Mock(pid=3)
+    root_child.kill.side_effect = psutil.AccessDenied(2)
+    parent = mock.Mock(pid=1)
+    parent.children.return_value = [root_child, other_child]
+    with mock.patch.object(psutil, 'wait_procs', return_value=([], [root_child, other_child, parent])):
+        registry._kill(parent, 'sudo')
+    parent.terminate.assert_called_once_with()
+    parent.kill.assert_called_once_with()
+    other_child.kill.assert_called_once_with()
+
+
+def test_untracked_process_not_killed(registry):
+    proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    try:
+        registry.register(proc.pid)
+        registry.unregister(proc.pid)
+        registry.kill_tracked()
+        assert proc.poll() is None
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_wait_stats(registry):
+    registry.record_wait('token', 0.5)
+    registry.record_wait('token', 1.5)
+    stats = registry.wait_stats(scan=0.2)
+    assert stats['operations'] == 2
+    assert stats['total_wait'] == 2.0
+    assert stats['max_wait'] == 1.5
+    assert stats['saved'] == (0.4 if sys.platform == "win32" else 0.0)
+    assert registry.measure_scan() >= 0
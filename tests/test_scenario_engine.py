@@ -0,0 +1,97 @@
+"""
+Юнит-тесты ScenarioEngine без токена и csp_invoke:
+
+    python -m pytest --noconftest -o addopts= tests
+"""
+import threading
+
+import pytest
+
+from base_vipnet import FuncVipNet, VipNetOperationsName as Op
+from scenario_engine import ScenarioEngine, CONTAINER, STORE
+
+SCENARIO = [
+    Op.KEY_GENERATION,
+    Op.CREATE_SELFSIGNED_CERT,
+    Op.SETUP_CERT_TO_CONTAINER,
+    Op.SETUP_CERT_TO_STORAGE,
+    Op.LOWLVL_CMS_SIGN_FROM_STORAGE,
+    Op.LOWLVL_CMS_ENCRYPT,
+    Op.LOWLVL_CMS_ENCRYPT2,
+    Op.DELETE_CERT,
+    Op.DELETE_CONTAINER,
+]
+
+
+class FakeVipNet(FuncVipNet):
+    """Вместо csp_invoke записывает порядок шагов."""
+
+    def __init__(self, fail=None):
+        super().__init__('csp_invoke', 'container', '12345678', '77', '2012-256', 'signature', 'cert', 'test.txt')
+        self.fail = fail
+        self.order = []
+        self._order_lock = threading.Lock()
+
+    def _run(self, key_name, exclusive=True):
+        with self._order_lock:
+            self.order.append(key_name)
+        return (1 if key_name == self.fail else 0), b''
+
+
+@pytest.fixture
+def vipnet():
+    return FakeVipNet()
+
+
+class TestDependencies:
+    def test_private_key_operations_read_container(self, vipnet):
+        for name in (Op.LOWLVL_CMS_SIGN_FROM_STORAGE, Op.SIMPLE_CMS_SIGN_FROM_STORAGE,
+                     Op.LOWLVL_CMS_ENCRYPT2, Op.SIMPLE_CMS_ENCRYPT2):
+            step = ScenarioEngine(vipnet, [name]).steps[0]
+            assert CONTAINER in step.reads, name
+
+    def test_encrypt_reads_only_store(self, vipnet):
+        step = ScenarioEngine(vipnet, [Op.LOWLVL_CMS_ENCRYPT]).steps[0]
+        assert step.reads == {'test.txt', STORE}
+        assert step.writes == {'low.enc'}
+
+    def test_delete_container_waits_for_key_users(self, vipnet):
+        steps = ScenarioEngine(vipnet, SCENARIO).steps
+        assert {4, 6} <= steps[8].depends_on
+        assert 5 not in steps[8].depends_on
+        assert {3, 4, 5, 6} <= steps[7].depends_on
+
+    def test_file_dependencies(self, vipnet):
+        steps = ScenarioEngine(vipnet, [
+            Op.SIGN_MESSAGE, Op.SIGN_MESSAGE2, Op.CHECK_MESSAGE,
+        ]).steps
+        assert steps[2].depends_on == {0, 1}
+        assert not steps[2].uses_token
+        # Оба шага только читают контейнер
+        assert steps[1].depends_on == set()
+
+    def test_independent_branches(self, vipnet):
+        steps = ScenarioEngine(vipnet, [
+            Op.LOWLVL_CMS_SIGN_FROM_STORAGE, Op.LOWLVL_CMS_SIGN_FROM_STORAGE2,
+            Op.SIMPLE_CMS_SIGN_FROM_STORAGE3, Op.SIMPLE_CMS_SIGN_FROM_STORAGE4,
+        ]).steps
+        assert steps[1].depends_on == {0}
+        assert steps[2].depends_on == set()
+        assert steps[3].depends_on == {2}
+
+
+class TestRun:
+    def test_order_respects_dependencies(self, vipnet):
+        engine = ScenarioEngine(vipnet, SCENARIO)
+        engine.run()
+        position = {name: index for index, name in enumerate(vipnet.order)}
+        for step in engine.steps:
+            for dependency in step.depends_on:
+                assert position[engine.steps[dependency].name] < position[step.name]
+        assert len(engine.results) == len(SCENARIO)
+
+    def test_stops_on_failure(self):
+        vipnet = FakeVipNet(fail=Op.SETUP_CERT_TO_CONTAINER)
+        with pytest.raises(AssertionError, match=Op.SETUP_CERT_TO_CONTAINER.value):
+            ScenarioEngine(vipnet, SCENARIO).run()
+        assert Op.DELETE_CONTAINER not in vipnet.order
@@ -0,0 +1,118 @@
+"""
+Юнит-тесты USBDeviceWatcher без сервера USB Redirector:
+
+    python -m pytest --noconftest -o addopts= tests
+"""
+import threading
+
+import pytest
+
+from USBRedirectorAPI.usbdevicewatcher import USBDeviceWatcher, USBDeviceStateError, is_connected
+
+
+class FakeAPI:
+    """Отдает текущий список устройств, как /api/devices."""
+
+    def __init__(self, devices=()):
+        self.devices = list(devices)
+        self.lock = threading.Lock()
+
+    def list_usb(self, refresh=False):
+        with self.lock:
+            return [dict(device) for device in self.devices]
+
+    def set(self, *devices):
+        with self.lock:
+            self.devices = list(devices)
+
+
+@pytest.fixture
+def api():
+    return FakeAPI([{'Port': '1-1', 'State': 'Available'}])
+
+
+class TestDiff:
+    def test_events(self, api):
+        watcher = USBDeviceWatcher(api)
+        events = []
+        watcher.subscribe(lambda event, device: events.append((event, device)))
+        watcher.poll()
+        api.set({'Port': '1-1', 'State': 'Connected'}, {'Serial': 'AAA', 'State': 'Available'})
+        watcher.poll()
+        api.set({'Serial': 'AAA', 'State': 'Available'})
+        watcher.poll()
+        assert events == [
+            ('added', {'Port': '1-1', 'State': 'Available'}),
+            ('changed', {'Port': '1-1', 'State': 'Connected'}),
+            ('added', {'Serial': 'AAA', 'State': 'Available'}),
+            ('removed', {'Port': '1-1', 'State': 'Connected'}),
+        ]
+
+    def test_device_in_both_indexes_notified_once(self, api):
+        watcher = USBDeviceWatcher(api)
+        events = []
+        watcher.subscribe(lambda event, device: events.append(event))
+        api.set({'Port': '1-1', 'Serial': 'AAA', 'State': 'Available'})
+        watcher.poll()
+        assert events == ['added']
+        assert watcher.device(port='1-1') is watcher.device(serial='AAA')
+
+    def test_unsubscribe(self, api):
+        watcher = USBDeviceWatcher(api)
+        events = []
+        callback = watcher.subscribe(lambda event, device: events.append(event))
+        watcher.unsubscribe(callback)
+        watcher.poll()
+        assert events == []
+
+
+class TestWait:
+    def test_wait_connected(self, api):
+        with USBDeviceWatcher(api, interval=0.01) as watcher:
+            timer = threading.Timer(0.05, api.set, [{'Port': '1-1', 'State': 'In use'}])
+            timer.start()
+            assert watcher.wait_connected(port='1-1', timeout=5) > 0
+            timer.join()
+
+    def test_wait_released(self, api):
+        api.set({'Serial': 'AAA', 'State': 'Connected'})
+        with USBDeviceWatcher(api, interval=0.01) as watcher:
+            # Пропавшее из списка устройство тоже освобождено
+            threading.Timer(0.05, api.set).start()
+            watcher.wait_released(serial='AAA', timeout=5)
+            assert watcher.device(serial='AAA') is None
+
+    def test_timeout(self, api):
+        with USBDeviceWatcher(api, interval=0.01) as watcher:
+            with pytest.raises(TimeoutError):
+                watcher.wait_connected(port='1-1', timeout=0.05)
+
+    def test_not_started(self, api):
+        with pytest.raises(RuntimeError):
+            USBDeviceWatcher(api).wait_connected(port='1-1', timeout=0)
+
+    def test_no_state_field(self, api):
+        api.set({'Port': '1-1'})
+        with USBDeviceWatcher(api, interval=0.01) as watcher:
+            with pytest.raises(USBDeviceStateError):
+                watcher.wait_connected(port='1-1', timeout=1)
+
+    def test_custom_state_field(self, api):
+        api.set({'Port': '1-1', 'Attached': 'yes'})
+        with USBDeviceWatcher(api, interval=0.01, state_keys=('Attached',),
+                              connected_states=('YES',)) as watcher:
+            watcher.wait_connected(port='1-1', timeout=1)
+
+
+class TestIsConnected:
+    @pytest.mark.parametrize('state, connected', [('Connected', True), ('in-use', True),
+                                                  ('Available', False), ('', False)])
+    def test_states(self, state, connected):
+        assert is_connected({'Status': state}) is connected
+
+    def test_missing_device(self):
+        assert is_connected(None) is False
+
+    def test_missing_state(self):
+        with pytest.raises(USBDeviceStateError, match='no state field'):
+            is_connected({'Port': '1-1'})
@@ -0,0 +1,139 @@
+"""
+Юнит-тесты USBRedirectorAPI без сервера USB Redirector и usbclnt:
+
+    python -m pytest --noconftest -o addopts= tests
+"""
+from unittest import mock
+
+import pytest
+
+from USBRedirectorAPI.usbredirectorapi import USBRedirectorAPI
+
+DEVICES = [{'Port': '1-1'}, {'Port': '1-2'}, {'Serial': 'AAA'}]
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    def __init__(self):
+        self.requests = []
+        self.closed = False
+
+    def get(self, url, timeout=None):
+        self.requests.append(('get', url))
+        return FakeResponse(data={'Devices': DEVICES})
+
+    def post(self, url, data=None, timeout=None):
+        self.requests.append(('post', url, data))
+        return FakeResponse()
+
+    def close(self):
+        self.closed = True
+
+
+class FakePopen:
+    """Вместо usbclnt: код возврата 1 для команд с аргументом из failing."""
+    failing = ()
+    commands = []
+
+    def __init__(self, command, stdout=None, stderr=None):
+        self.commands.append(command)
+        self.returncode = None
+        self._returncode = 1 if any(arg in self.failing for arg in command) else 0
+
+    def communicate(self):
+        self.returncode = self._returncode
+        return b'', b''
+
+    def wait(self):
+        self.communicate()
+        return self.returncode
+
+
+@pytest.fixture
+def api():
+    FakePopen.commands = []
+    with mock.patch('USBRedirectorAPI.usbredirectorapi.requests.Session', FakeSession), \
+            mock.patch('USBRedirectorAPI.usbredirectorapi.subprocess.Popen', FakePopen), \
+            mock.patch('USBRedirectorAPI.usbredirectorapi.time.monotonic') as monotonic:
+        monotonic.return_value = 100.0
+        api = USBRedirectorAPI('10.0.0.1', client_path='usbclnt')
+        api.clock = monotonic
+        yield api
+
+
+def gets(api):
+    return [request for request in api.session.requests if request[0] == 'get']
+
+
+class TestDevicesCache:
+    def test_cached_within_ttl(self, api):
+        assert api.list_usb() == DEVICES
+        api.clock.return_value += 1
+        api.list_usb()
+        api.autoconnect_on(port='1-1')
+        assert len(gets(api)) == 1
+
+    def test_expired(self, api):
+        api.list_usb()
+        api.clock.return_value += api.devices_ttl
+        api.list_usb()
+        assert len(gets(api)) == 2
+
+    def test_refresh(self, api):
+        api.list_usb()
+        api.list_usb(refresh=True)
+        assert len(gets(api)) == 2
+
+    @pytest.mark.parametrize('method', ['share_usb', 'unshare_usb'])
+    def test_invalidated_by_share(self, api, method):
+        getattr(api, method)(serial='AAA')
+        api.list_usb()
+        assert [request[0] for request in api.session.requests] == ['get', 'post', 'get']
+        assert api.session.requests[1][2] == {'Serial': 'AAA'}
+
+    def test_server_error(self, api):
+        api.session.get = lambda url, timeout=None: FakeResponse(500)
+        with pytest.raises(ConnectionError):
+            api.list_usb()
+
+    def test_session_closed(self, api):
+        with api:
+            pass
+        assert api.session.closed
+
+
+class TestConnectMany:
+    def test_connect(self, api):
+        api.connect_usb_many([('1-1', None), (None, 'AAA')])
+        posts = [request[2] for request in api.session.requests if request[0] == 'post']
+        assert posts == [{'Port': '1-1'}, {'Serial': 'AAA'}]
+        actions = [command[1] for command in FakePopen.commands]
+        assert actions == ['-addserver', '-connect', '-connect', '-autoconnect', '-autoconnect']
+        assert FakePopen.commands[1][-2:] == ['-usbport', '1-1']
+        assert FakePopen.commands[2][-2:] == ['-serial', 'AAA']
+
+    def test_unknown_device(self, api):
+        with pytest.raises(ValueError):
+            api.connect_usb_many([('1-1', None), ('9-9', None)])
+        assert FakePopen.commands == []
+
+    def test_failed_device(self, api):
+        with mock.patch.object(FakePopen, 'failing', ('1-2',)), \
+                pytest.raises(ValueError, match='Connect usb failed'):
+            api.connect_usb_many([('1-1', None), ('1-2', None)], force=False)
+        # Оба устройства запускаются, autoconnect после ошибки не выполняется
+        assert [command[1] for command in FakePopen.commands] == ['-connect', '-connect']
+
+    def test_disconnect_force(self, api):
+        api.disconnect_usb_many([('1-1', None), ('1-2', None)], force=True)
+        actions = [command[1] for command in FakePopen.commands]
+        assert actions == ['-disconnect', '-disconnect', '-remserver']
+        assert len([request for request in api.session.requests if request[0] == 'post']) == 2
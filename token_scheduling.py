@@ -0,0 +1,30 @@
+import re
+
+from xdist.scheduler import LoadScopeScheduling
+
+# id параметра токена: token<длина имени> <имя> applet... (см. get_tokens_list)
+TOKEN_ID = re.compile(r'[\[-]token(\d+) ')
+
+
+def token_scope(nodeid):
+    """
+    Имя физического токена из id теста. Для тестов без токена - сам id.
+    """
+    match = TOKEN_ID.search(nodeid)
+    if match is None:
+        return nodeid
+    start = match.end()
+    return nodeid[start:start + int(match.group(1))]
+
+
+class TokenScheduling(LoadScopeScheduling):
+    """
+    Планировщик pytest-xdist: все тесты одного физического токена (со всеми апплетами
+    и провайдерами) выполняет один воркер, разные токены - разные воркеры.
+
+    Так каждый воркер работает только со своим токеном и его портом USB redirector,
+    и время прогона делится на число токенов.
+    """
+
+    def _split_scope(self, nodeid):
+        return token_scope(nodeid)